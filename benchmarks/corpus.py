@@ -0,0 +1,136 @@
+import os
+import re
+import csv
+import random
+
+# ============================================================
+# 📄 合成測試語料 (固定 seed，每次產生的內容完全相同)
+# ============================================================
+TOPICS = [
+    "PCR amplification", "western blot", "cell culture", "CRISPR knockout", "flow cytometry",
+    "RNA extraction", "protein purification", "mass spectrometry", "confocal imaging", "ELISA",
+]
+VOCAB = (
+    "buffer sample incubate centrifuge minutes temperature protocol reagent antibody dilution "
+    "concentration plate well wash solution primer template enzyme sequence gel band marker "
+    "volume pipette tube control replicate signal analysis result observe measure record"
+).split()
+
+PDF_LINES_PER_PAGE = 40
+PDF_CHARS_PER_LINE = 90
+
+
+def _sentence(rng: random.Random, words: int = 14) -> str:
+    return " ".join(rng.choice(VOCAB) for _ in range(words)).capitalize() + "."
+
+def _paragraph(rng: random.Random, sentences: int = 5) -> str:
+    return " ".join(_sentence(rng) for _ in range(sentences))
+
+# ============================================================
+# ✍️ 各格式產生器
+# ============================================================
+def write_markdown(path: str, rng: random.Random, sections: int = 8) -> int:
+    topic = rng.choice(TOPICS)
+    parts = [f"# {topic} protocol\n"]
+    for i in range(sections):
+        parts.append(f"## Step {i + 1}: {rng.choice(TOPICS)}\n")
+        parts.append(_paragraph(rng) + "\n")
+        parts.append("\n".join(f"- {_sentence(rng, 8)}" for _ in range(3)) + "\n")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(parts))
+    return 1
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path: str, rng: random.Random, pages: int = 5) -> int:
+    """不依賴任何套件、只含文字的最小 PDF (Helvetica)，每頁 PDF_LINES_PER_PAGE 行"""
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog_id = add(b"")          # 先佔位，頁面建立完再補
+    pages_id = add(b"")
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for p in range(pages):
+        lines = [f"{rng.choice(TOPICS)} notes, page {p + 1}"]
+        while len(lines) < PDF_LINES_PER_PAGE:
+            lines.append(_sentence(rng)[:PDF_CHARS_PER_LINE])
+        text = "\n".join(f"({_pdf_escape(line)}) Tj T*" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 780 Td\n{text}\nET".encode("latin-1")
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font_id, content_id)
+        ))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[catalog_id - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+    return pages
+
+def write_csv(path: str, rng: random.Random, rows: int = 500) -> int:
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ID", "Sample", "Assay", "Concentration", "Replicate", "Passed"])
+        for i in range(rows):
+            writer.writerow([i + 1, f"S{rng.randint(1, 200):03d}", rng.choice(TOPICS),
+                             round(rng.uniform(0.1, 50.0), 3), rng.randint(1, 3), rng.random() > 0.2])
+    return 1
+
+_PDF_PAGE_RE = re.compile(rb"/Type\s*/Page(?![s\w])")
+
+def count_pdf_pages(path: str) -> int:
+    """粗估頁數 (未壓縮的 page 物件)；讀不到時以 1 計"""
+    with open(path, "rb") as f:
+        return len(_PDF_PAGE_RE.findall(f.read())) or 1
+
+WRITERS = {".md": write_markdown, ".pdf": write_pdf, ".csv": write_csv}
+
+# ============================================================
+# 📦 產生整份語料
+# ============================================================
+def build_corpus(out_dir: str, n_markdown: int = 20, n_pdf: int = 5, n_csv: int = 5,
+                 pdf_pages: int = 5, seed: int = 42, fixture_dir: str = None) -> list[dict]:
+    """
+    回傳 [{path, kind, pages, bytes}]。
+    fixture_dir 內的 .md / .pdf / .csv (真實文件) 會一併加入；md / csv 每檔算 1 頁
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    plan = [(".md", n_markdown, {}), (".pdf", n_pdf, {"pages": pdf_pages}), (".csv", n_csv, {})]
+
+    manifest = []
+    for ext, count, kwargs in plan:
+        for i in range(count):
+            path = os.path.join(out_dir, f"synthetic_{ext[1:]}_{i:03d}{ext}")
+            pages = WRITERS[ext](path, rng, **kwargs)
+            manifest.append({"path": path, "kind": ext[1:], "pages": pages, "bytes": os.path.getsize(path)})
+
+    if fixture_dir and os.path.isdir(fixture_dir):
+        for name in sorted(os.listdir(fixture_dir)):
+            ext = os.path.splitext(name)[1].lower()
+            if ext in WRITERS:
+                path = os.path.join(fixture_dir, name)
+                pages = count_pdf_pages(path) if ext == ".pdf" else 1
+                manifest.append({"path": path, "kind": ext[1:], "pages": pages, "bytes": os.path.getsize(path)})
+    return manifest
+
+def synthetic_chunks(count: int, seed: int = 7) -> list[str]:
+    """query latency 測試時灌入 collection 的額外 chunk 文字"""
+    rng = random.Random(seed)
+    return [f"{rng.choice(TOPICS)}: {_paragraph(rng, 4)}" for _ in range(count)]
@@ -0,0 +1,256 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import build_corpus
+from run_benchmarks import RESULTS_DIR, Quiet, latency_summary, open_core, git_commit
+
+# ============================================================
+# ⚙️ 評估設定
+# ============================================================
+SCHEMA_VERSION = 1
+DEFAULT_SPLITTERS = "500/100,300/50,1000/200"     # chunk_size/chunk_overlap
+DEFAULT_LIMITS = "3,5,10"                           # 檢索筆數 (_run_qdrant_query 的 limit)
+DEFAULT_PROFILES = "hybrid,dense,hybrid-bm25"
+SYNTHETIC_QUESTIONS = 60
+SPAN_WORDS = 6               # 合成題目的答案片段長度 (字)
+
+# 檢索組合 → sparse 模型；dense 一律用 bitsAI_core.DENSE_MODEL
+# fastembed 的 client.query 固定以 RRF 融合兩路結果，所以混合檢索的差異在 sparse 模型
+CORE_SPARSE = "core"         # 與 bitsAI_core 相同 (SPARSE_MODEL)
+PROFILES = {
+    "hybrid": CORE_SPARSE,
+    "dense": None,           # 不使用 sparse，純向量搜尋
+    "hybrid-bm25": "Qdrant/bm25",
+}
+
+# ============================================================
+# 🏷️ 標註資料：{"question": ..., "relevant": ["答案片段", ...]}
+# 以文字片段判斷相關，不綁定 chunk id，換 chunk 大小後仍可共用
+# ============================================================
+def _norm(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def load_qrels(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        qrels = [json.loads(line) for line in f if line.strip()]
+    for q in qrels:
+        if not q.get("question") or not q.get("relevant"):
+            raise ValueError(f"{path}: 每行需要 question 與 relevant 欄位")
+    return qrels
+
+def _corpus_sentences(item: dict) -> list[str]:
+    """讀取合成語料的原始句子 (md 直接讀，PDF 取內容流的 Tj 字串)"""
+    if item["kind"] == "md":
+        with open(item["path"], encoding="utf-8") as f:
+            return re.findall(r"[A-Z][a-z ]{40,}\.", f.read())
+    if item["kind"] == "pdf":
+        with open(item["path"], "rb") as f:
+            return [s.decode("latin-1") for s in re.findall(rb"\(([A-Z][a-z ]{40,})\.?\) Tj", f.read())]
+    return []
+
+def synthetic_qrels(manifest: list[dict], count: int = SYNTHETIC_QUESTIONS, seed: int = 42) -> list[dict]:
+    """從語料隨機取一段連續字詞當答案，打亂字序當問題 (已知答案位置的檢索題)"""
+    rng = random.Random(seed)
+    pool = [(item, s) for item in manifest for s in _corpus_sentences(item)]
+    qrels = []
+    for item, sentence in rng.sample(pool, min(count, len(pool))):
+        words = sentence.rstrip(".").split()
+        start = rng.randrange(0, len(words) - SPAN_WORDS + 1)
+        span = words[start:start + SPAN_WORDS]
+        question = span[:]
+        rng.shuffle(question)
+        qrels.append({"question": " ".join(question).lower() + "?", "relevant": [" ".join(span)],
+                      "source": os.path.basename(item["path"])})
+    return qrels
+
+# ============================================================
+# 📏 指標
+# ============================================================
+def score_ranking(texts: list[str], spans: list[str], relevant_chunks: int, k: int) -> dict:
+    """recall@k (答案片段覆蓋率)、reciprocal rank、nDCG@k (二元相關)"""
+    flags, found = [], set()
+    for text in texts[:k]:
+        hit = [s for s in spans if s in text]
+        flags.append(bool(hit))
+        found.update(hit)
+    first = next((i for i, f in enumerate(flags) if f), None)
+    dcg = sum(1 / math.log2(i + 2) for i, f in enumerate(flags) if f)
+    idcg = sum(1 / math.log2(i + 2) for i in range(min(k, relevant_chunks)))
+    return {
+        "recall": len(found) / len(spans),
+        "rr": 1 / (first + 1) if first is not None else 0.0,
+        "ndcg": dcg / idcg if idcg else 0.0,
+    }
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+# ============================================================
+# 🧪 單一組合 (splitter × profile) 的評估
+# ============================================================
+def _use_profile(core, profile: str) -> dict:
+    sparse = core.SPARSE_MODEL if PROFILES[profile] == CORE_SPARSE else PROFILES[profile]
+    core.client.set_model(core.DENSE_MODEL)
+    core.client.set_sparse_model(sparse)
+    return {"dense_model": core.DENSE_MODEL, "sparse_model": sparse}
+
+def evaluate_config(core, docs, qrels, limits, profile, verbose=False) -> dict:
+    chunk_texts = [_norm(d.page_content) for d in docs]
+    spans = [[_norm(s) for s in q["relevant"]] for q in qrels]
+    relevant_chunks = [sum(1 for t in chunk_texts if any(s in t for s in sp)) for sp in spans]
+
+    with Quiet(verbose):
+        start = time.perf_counter()
+        core.add_docs_to_qdrant(docs)
+        ingest_seconds = time.perf_counter() - start
+    points = core.client.count(collection_name=core.COLLECTION_NAME, exact=True).count
+
+    by_limit = {}
+    for k in limits:
+        scores, latencies = [], []
+        with Quiet(verbose):
+            core._run_qdrant_query(qrels[0]["question"], None, limit=k)     # 暖機
+            for q, sp, n_rel in zip(qrels, spans, relevant_chunks):
+                start = time.perf_counter()
+                points_found = core._run_qdrant_query(q["question"], None, limit=k)
+                latencies.append(time.perf_counter() - start)
+                texts = [_norm(p.document or p.metadata.get("document", "")) for p in points_found]
+                scores.append(score_ranking(texts, sp, n_rel, k))
+        latency = latency_summary(latencies)
+        by_limit[str(k)] = {
+            f"recall@{k}": round(sum(s["recall"] for s in scores) / len(scores), 4),
+            "mrr": round(sum(s["rr"] for s in scores) / len(scores), 4),
+            f"ndcg@{k}": round(sum(s["ndcg"] for s in scores) / len(scores), 4),
+            "p50_ms": latency["p50_ms"],
+            "p95_ms": latency["p95_ms"],
+        }
+
+    return {
+        "profile": profile,
+        "chunks": len(docs),
+        "points": points,
+        "unreachable_questions": sum(1 for n in relevant_chunks if n == 0),
+        "index_bytes": _dir_bytes(os.path.join(core.QDRANT_PATH, "collection",
+                                                 core.qdrant_conn.physical_name(core.client, core.COLLECTION_NAME))),
+        "ingest_seconds": round(ingest_seconds, 3),
+        "by_limit": by_limit,
+    }
+
+def print_table(results: dict):
+    print(f"\n{'config':<28} {'k':>3} {'recall':>7} {'MRR':>6} {'nDCG':>6} {'p50 ms':>8} {'p95 ms':>8} {'index MB':>9}")
+    for name, r in results.items():
+        for k, m in r["by_limit"].items():
+            print(f"{name:<28} {k:>3} {m[f'recall@{k}']:>7.3f} {m['mrr']:>6.3f} {m[f'ndcg@{k}']:>6.3f} "
+                  f"{m['p50_ms']:>8.2f} {m['p95_ms']:>8.2f} {r['index_bytes'] / 1e6:>9.2f}")
+
+# ============================================================
+# 🚀 Main
+# ============================================================
+def main():
+    parser = argparse.ArgumentParser(description="BITS-AI 檢索品質 vs 延遲評估 (離線、暫存 Qdrant)")
+    parser.add_argument("--splitters", default=DEFAULT_SPLITTERS, help="chunk_size/chunk_overlap 組合，逗號分隔")
+    parser.add_argument("--limits", default=DEFAULT_LIMITS, help="檢索筆數 k，逗號分隔")
+    parser.add_argument("--profiles", default=DEFAULT_PROFILES, help=f"檢索組合：{', '.join(PROFILES)}")
+    parser.add_argument("--docs", default=None, help="要評估的文件資料夾 (需搭配 --qrels)；預設使用合成語料")
+    parser.add_argument("--qrels", default=None, help="標註檔 JSONL：{\"question\": ..., \"relevant\": [答案片段, ...]}")
+    parser.add_argument("--questions", type=int, default=SYNTHETIC_QUESTIONS, help="合成題目數")
+    parser.add_argument("--save-qrels", default=None, help="把使用的標註寫出 (方便改成人工標註)")
+    parser.add_argument("--out", default=None, help="結果 JSON 路徑 (預設 benchmarks/results/eval-<時間>.json)")
+    parser.add_argument("--workdir", default=None, help="工作資料夾 (預設暫存資料夾，結束後刪除)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true", help="顯示 BITS-AI 本身的 log")
+    args = parser.parse_args()
+
+    if args.docs and not args.qrels:
+        parser.error("--docs 需要搭配 --qrels")
+    splitters = [tuple(int(x) for x in s.split("/")) for s in args.splitters.split(",")]
+    limits = sorted(int(k) for k in args.limits.split(","))
+    profiles = args.profiles.split(",")
+    unknown = [p for p in profiles if p not in PROFILES]
+    if unknown:
+        parser.error(f"未知的 profile: {unknown}")
+
+    out_path = os.path.abspath(args.out or os.path.join(RESULTS_DIR, f"eval-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+    docs_dir = os.path.abspath(args.docs) if args.docs else None
+    qrels_path = os.path.abspath(args.qrels) if args.qrels else None
+    save_qrels = os.path.abspath(args.save_qrels) if args.save_qrels else None
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="bitsai-eval-"))
+    original_cwd = os.getcwd()
+    print(f"🏁 BITS-AI retrieval eval → {workdir}")
+    core = open_core(workdir, args.verbose)
+
+    if docs_dir:
+        manifest = build_corpus("corpus", n_markdown=0, n_pdf=0, n_csv=0, fixture_dir=docs_dir)
+    else:
+        manifest = build_corpus("corpus", n_csv=0, seed=args.seed)
+    qrels = load_qrels(qrels_path) if qrels_path else synthetic_qrels(manifest, args.questions, args.seed)
+    if save_qrels:
+        with open(save_qrels, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(q, ensure_ascii=False) + "\n" for q in qrels)
+    print(f"📄 {len(manifest)} files, {len(qrels)} questions")
+
+    default_splitter, default_collection = core.text_splitter, core.COLLECTION_NAME
+    results = {}
+    try:
+        for chunk_size, chunk_overlap in splitters:
+            core.text_splitter = core.make_text_splitter(chunk_size, chunk_overlap)
+            with Quiet(args.verbose):
+                docs = [d for item in manifest for d in core.load_file_to_docs(item["path"], doc_type="other")]
+            for profile in profiles:
+                name = f"{chunk_size}/{chunk_overlap} {profile}"
+                core.COLLECTION_NAME = f"eval_{chunk_size}_{chunk_overlap}_{profile}"
+                models_used = _use_profile(core, profile)
+                print(f"🧪 {name}: {len(docs)} chunks")
+                results[name] = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, **models_used,
+                                 **evaluate_config(core, docs, qrels, limits, profile, args.verbose)}
+    finally:
+        core.text_splitter, core.COLLECTION_NAME = default_splitter, default_collection
+        _use_profile(core, "hybrid")
+        os.chdir(original_cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "schema_version": SCHEMA_VERSION,
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "files": len(manifest),
+            "questions": len(qrels),
+            "qrels": qrels_path or "synthetic",
+            "limits": limits,
+            "profiles": profiles,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_table(results)
+    print(f"\n✅ Results written to {out_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import uuid
+import urllib.request
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import build_corpus
+from run_benchmarks import (RESULTS_DIR, Quiet, latency_summary, open_core, git_commit,
+                            NORMAL_QUESTIONS, RAG_QUESTIONS, TOOL_QUESTIONS, FAST_PATH_QUESTIONS)
+from stub_llm import StubChatModel
+
+# ============================================================
+# ⚙️ Load test 設定
+# ============================================================
+SCHEMA_VERSION = 1
+DEFAULT_CONCURRENCY = "1,2,4,8,16"
+DEFAULT_MIX = "normal=0.4,rag=0.3,tools=0.3"
+REQUESTS_PER_SESSION = 5
+KNEE_FACTOR = 3.0            # p95 超過單人 p95 的幾倍視為延遲崩潰
+KNEE_FAILURE_RATE = 0.05     # 失敗比例超過此值也視為崩潰
+ERROR_EXAMPLES = 5
+
+MESSAGES = {
+    "normal": NORMAL_QUESTIONS,
+    "rag": RAG_QUESTIONS,
+    "tools": TOOL_QUESTIONS + FAST_PATH_QUESTIONS,
+}
+STUB_MCP_SERVER = os.path.join(BENCH_DIR, "stub_mcp_server.py").replace("\\", "/")
+_SEEN_RE = re.compile(r"\[sessions seen: ([\w,]+)\]")
+
+# ============================================================
+# 🧪 測試資料 (RAG 用的 markdown + 工具模式用的 CSV)
+# ============================================================
+def prepare_data(core, seed: int = 42):
+    import bitsAI_storage as storage
+    manifest = build_corpus("corpus", n_markdown=10, n_pdf=0, n_csv=3, seed=seed)
+    docs = []
+    for item in manifest:
+        if item["kind"] == "csv":
+            storage.ingest_file(item["path"])
+        else:
+            docs.extend(core.load_file_to_docs(item["path"], doc_type="other"))
+    core.add_docs_to_qdrant(docs)
+    first_csv = next(os.path.basename(i["path"]) for i in manifest if i["kind"] == "csv")
+    return f"SELECT Assay, COUNT(*) AS n FROM read_csv('{storage.STORAGE_DIR}/{first_csv}') GROUP BY Assay"
+
+def stub_model(llm_latency: float, sql: str) -> StubChatModel:
+    """工具模式的規劃呼叫固定送一個 SQL 查詢給 DuckDB MCP (stub)"""
+    return StubChatModel(latency=llm_latency, tool_name="query", tool_args={"query": sql})
+
+# ============================================================
+# 🔌 送出方式：in-process (直接呼叫 generate_response) / api (bitsAI_api) / gradio (HTTP)
+# ============================================================
+class InProcessTarget:
+    name = "inprocess"
+
+    def __init__(self, core):
+        self.core = core
+
+    def reset(self):
+        """每個階段換一個新的 LLM gateway，排隊統計只算這個階段"""
+        core = self.core
+        old = core.llm_gateway
+        core.llm_gateway = core.LLMGateway(old.max_in_flight, old.max_queue_depth, old.queue_timeout, history=100_000)
+        core.memory.clear()
+
+    def session(self):
+        session_id = uuid.uuid4().hex
+        return lambda text, mode: self.core.generate_response(text, self.core.Mode[mode.upper()], session_id)
+
+    def queue_metrics(self) -> dict:
+        classes = self.core.llm_gateway.metrics()["classes"]
+        return {name: {"calls": c["calls"], "rejected": c["rejected"],
+                       "queue_wait_p50_ms": round(c["queue_wait_p50"] * 1000, 2),
+                       "queue_wait_p95_ms": round(c["queue_wait_p95"] * 1000, 2)}
+                for name, c in classes.items() if c["calls"] or c["rejected"]}
+
+
+class ApiTarget:
+    """透過 bitsAI_api 的 POST /chat (非串流)；每個模擬使用者一個 session，模式逐則指定"""
+    name = "api"
+
+    def __init__(self, url: str, metrics_url: str = None):
+        self.url = url.rstrip("/")
+        self.metrics_url = metrics_url or f"{self.url}/metrics"
+
+    def reset(self):
+        pass
+
+    def session(self):
+        import httpx
+        client = httpx.Client(base_url=self.url, timeout=600)
+        session_id = uuid.uuid4().hex
+
+        def send(text, mode):
+            r = client.post("/chat", json={"message": text, "mode": mode, "session_id": session_id})
+            if r.status_code not in (200, 503):
+                r.raise_for_status()
+            return r.json()["response"]
+        return send
+
+    def queue_metrics(self) -> dict:
+        """多 worker 時只拿得到回應這個請求的 worker 的統計"""
+        try:
+            with urllib.request.urlopen(self.metrics_url, timeout=5) as r:
+                return json.load(r).get("llm_gateway", {})
+        except Exception as e:
+            return {"error": str(e)}
+
+
+class GradioTarget:
+    """
+    透過 gradio_client 呼叫 respond_wrapper (UI → API 兩段 HTTP)。
+    注意：模式存在 UI 的 session state，HTTP 無法逐則指定，所有訊息都走 Normal 模式
+    """
+    name = "gradio"
+
+    def __init__(self, url: str, metrics_url: str = None):
+        self.url = url
+        self.metrics_url = metrics_url
+
+    def reset(self):
+        pass
+
+    def session(self):
+        from gradio_client import Client
+        client = Client(self.url, verbose=False)
+
+        def send(text, mode):
+            _, history = client.predict(text, [], api_name="/respond_wrapper")
+            return history[-1][1] if history else ""
+        return send
+
+    def queue_metrics(self) -> dict:
+        if not self.metrics_url:
+            return {}
+        try:
+            with urllib.request.urlopen(self.metrics_url, timeout=5) as r:
+                return json.load(r).get("llm_gateway", {})
+        except Exception as e:
+            return {"error": str(e)}
+
+# ============================================================
+# 👥 模擬使用者
+# ============================================================
+def parse_mix(text: str) -> dict:
+    mix = {k: float(v) for k, v in (part.split("=") for part in text.split(","))}
+    unknown = set(mix) - set(MESSAGES)
+    if unknown:
+        raise ValueError(f"unknown modes in mix: {sorted(unknown)}")
+    return mix
+
+def classify(response: str, session_id: str):
+    """回傳 (結果, 說明)：ok / busy (LLM 排隊滿) / error (回傳錯誤訊息) / leak (看到別的 session 的對話)"""
+    if not response or not response.strip():
+        return "error", "empty response"
+    if response.startswith("⏳"):
+        return "busy", response[:200]
+    if response.startswith("❌"):
+        return "error", response[:200]
+    seen = _SEEN_RE.search(response)
+    others = sorted(set(seen.group(1).split(",")) - {session_id}) if seen else []
+    if others:
+        return "leak", f"session {session_id} saw sessions {','.join(others)}"
+    return "ok", None
+
+def _session_worker(session_id, send, mix, n_requests, think, seed, barrier, records):
+    rng = random.Random(f"{seed}-{session_id}")
+    modes, weights = list(mix), list(mix.values())
+    barrier.wait()
+    for _ in range(n_requests):
+        mode = rng.choices(modes, weights)[0]
+        question = rng.choice(MESSAGES[mode])
+        # 快速路徑要求整句符合樣板，不能加標記
+        text = question if question in FAST_PATH_QUESTIONS else f"[session {session_id}] {question}"
+        start = time.perf_counter()
+        try:
+            outcome, detail = classify(send(text, mode), session_id)
+        except Exception as e:
+            outcome, detail = "exception", f"{type(e).__name__}: {e}"
+        records.append({"session": session_id, "mode": mode, "start": start,
+                        "latency": time.perf_counter() - start, "outcome": outcome, "detail": detail})
+        if think:
+            time.sleep(rng.expovariate(1 / think))
+
+def run_step(target, concurrency, mix, n_requests, think, seed, verbose=False) -> dict:
+    target.reset()
+    sends = [target.session() for _ in range(concurrency)]
+    records = []
+    barrier = threading.Barrier(concurrency + 1)
+    threads = [
+        threading.Thread(target=_session_worker, name=f"load-session-{i}",
+                         args=(str(i), sends[i], mix, n_requests, think, seed, barrier, records))
+        for i in range(concurrency)
+    ]
+    with Quiet(verbose):
+        for t in threads:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - start
+
+    outcomes = Counter(r["outcome"] for r in records)
+    examples = {}
+    for r in records:
+        if r["detail"] and len(examples.setdefault(r["outcome"], [])) < ERROR_EXAMPLES:
+            examples[r["outcome"]].append(r["detail"])
+    by_mode = {}
+    for mode in mix:
+        lat = [r["latency"] for r in records if r["mode"] == mode]
+        if lat:
+            by_mode[mode] = latency_summary(lat)
+    return {
+        "concurrency": concurrency,
+        "requests": len(records),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(records) / wall, 3) if wall else 0.0,
+        "latency": latency_summary([r["latency"] for r in records]),
+        "by_mode": by_mode,
+        "outcomes": dict(outcomes),
+        "failure_rate": round(1 - outcomes.get("ok", 0) / len(records), 4) if records else 0.0,
+        "examples": examples,
+        "queue": target.queue_metrics(),
+    }
+
+def find_knee(steps: list) -> int:
+    """延遲崩潰的第一個並行數 (p95 暴增或失敗率過高)；沒有則回傳 None"""
+    if not steps:
+        return None
+    base = steps[0]["latency"]["p95_ms"] or 1e-9
+    for step in steps[1:]:
+        if step["latency"]["p95_ms"] > KNEE_FACTOR * base or step["failure_rate"] > KNEE_FAILURE_RATE:
+            return step["concurrency"]
+    return None
+
+def print_step(step: dict):
+    lat = step["latency"]
+    bad = {k: v for k, v in step["outcomes"].items() if k != "ok"}
+    print(f"   👥 {step['concurrency']:>3} sessions  {step['throughput_rps']:>7.2f} req/s  "
+          f"p50={lat['p50_ms']:>8.1f} ms  p95={lat['p95_ms']:>8.1f} ms  p99={lat['p99_ms']:>8.1f} ms"
+          + (f"  ⚠️ {bad}" if bad else ""))
+
+# ============================================================
+# 🚀 Main
+# ============================================================
+def main():
+    parser = argparse.ArgumentParser(description="BITS-AI 多使用者壓力測試 (stub LLM + stub MCP)")
+    parser.add_argument("--target", choices=["inprocess", "api", "gradio"], default="inprocess")
+    parser.add_argument("--url", default=None,
+                        help="--target api / gradio 的網址 (預設 http://127.0.0.1:8000 / http://127.0.0.1:7860)")
+    parser.add_argument("--metrics-url", default=None, help="伺服器的 metrics endpoint (例如 http://127.0.0.1:9464/metrics)")
+    parser.add_argument("--serve", action="store_true",
+                        help="以 stub LLM / stub MCP 啟動 bitsAI_api (單一 worker)，給 --target api / gradio 測試")
+    parser.add_argument("--port", type=int, default=8000, help="--serve 的 port")
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY, help="每個階段的同時 session 數")
+    parser.add_argument("--requests", type=int, default=REQUESTS_PER_SESSION, help="每個 session 送出幾則訊息")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="模式比例，例如 normal=0.4,rag=0.3,tools=0.3")
+    parser.add_argument("--think", type=float, default=0.0, help="訊息之間的平均思考時間 (秒，指數分佈)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="stub LLM 每次呼叫的延遲 (秒)")
+    parser.add_argument("--mcp-latency", type=float, default=0.05, help="stub MCP 每次 query 的延遲 (秒)")
+    parser.add_argument("--out", default=None, help="結果 JSON 路徑 (預設 benchmarks/results/load-<時間>.json)")
+    parser.add_argument("--workdir", default=None, help="工作資料夾 (預設暫存資料夾，結束後刪除)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true", help="顯示 BITS-AI 本身的 log")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    levels = [int(c) for c in args.concurrency.split(",")]
+    out_path = os.path.abspath(args.out or os.path.join(RESULTS_DIR, f"load-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+
+    core = None
+    original_cwd = os.getcwd()
+    workdir = None
+    if args.serve or args.target == "inprocess":
+        workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="bitsai-load-"))
+        python = sys.executable.replace("\\", "/")
+        mcp_command = f'"{python}" "{STUB_MCP_SERVER}" --latency {args.mcp_latency}'
+        print(f"🏁 BITS-AI load test → {workdir}")
+        core = open_core(workdir, args.verbose, mcp_command=mcp_command)
+        with Quiet(args.verbose):
+            sql = prepare_data(core, args.seed)
+        core.set_chat_models(stub_model(args.llm_latency, sql))
+
+    if args.target == "inprocess":
+        target = InProcessTarget(core)
+    elif args.target == "api":
+        target = ApiTarget(args.url or "http://127.0.0.1:8000", args.metrics_url)
+    else:
+        target = GradioTarget(args.url or "http://127.0.0.1:7860", args.metrics_url)
+    steps = []
+    try:
+        if args.serve:
+            import bitsAI_api as api
+            print("🌐 Stub-backed BITS-AI API (Ctrl+C to stop); point bitsAI_app.py at it with BITSAI_API_URL")
+            api.serve(port=args.port, workers=1)
+            return
+        print(f"🚦 {target.name}: concurrency {levels}, {args.requests} requests/session, mix {mix}")
+        for n in levels:
+            steps.append(run_step(target, n, mix, args.requests, args.think, args.seed, args.verbose))
+            print_step(steps[-1])
+    finally:
+        os.chdir(original_cwd)
+        if workdir and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    knee = find_knee(steps)
+    leaks = sum(s["outcomes"].get("leak", 0) for s in steps)
+    report = {
+        "schema_version": SCHEMA_VERSION,
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "target": target.name,
+            "mix": mix,
+            "requests_per_session": args.requests,
+            "think_seconds": args.think,
+            "llm_latency": args.llm_latency,
+            "mcp_latency": args.mcp_latency,
+            "seed": args.seed,
+        },
+        "results": {"steps": steps, "knee_concurrency": knee, "cross_session_leaks": leaks},
+    }
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if knee:
+        print(f"📉 Latency collapses at {knee} concurrent sessions")
+    if leaks:
+        print(f"⚠️ {leaks} responses saw another session's conversation")
+    print(f"✅ Results written to {out_path}")
+
+if __name__ == "__main__":
+    main()
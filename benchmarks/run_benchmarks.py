@@ -0,0 +1,352 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import build_corpus, synthetic_chunks, TOPICS
+from stub_llm import StubChatModel
+
+# ============================================================
+# ⚙️ Benchmark 設定
+# ============================================================
+SCHEMA_VERSION = 1
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+DEFAULT_SIZES = "500,1000,2000,4000"   # query latency 量測時 collection 的 chunk 數
+QUICK_SIZES = "200,400"
+QUERIES_PER_SIZE = 20
+CHAT_REPEAT = 10                        # 每種模式量測幾次 generate_response
+WARMUP_CHUNKS = 16                      # 第一次 embedding 會載入模型，先暖機不計時
+
+RAG_QUESTIONS = [f"What is the protocol for {t}?" for t in TOPICS]
+NORMAL_QUESTIONS = [f"Explain {t} in one paragraph." for t in TOPICS]
+TOOL_QUESTIONS = [f"Which samples in the data center were used for {t}?" for t in TOPICS]
+FAST_PATH_QUESTIONS = ["list the files"]
+
+# ============================================================
+# 📐 統計
+# ============================================================
+def _percentile(ordered, q: float) -> float:
+    if not ordered:
+        return 0.0
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+def latency_summary(seconds: list) -> dict:
+    ordered = sorted(s * 1000 for s in seconds)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered), 3) if ordered else 0.0,
+        "p50_ms": round(_percentile(ordered, 0.50), 3),
+        "p95_ms": round(_percentile(ordered, 0.95), 3),
+        "p99_ms": round(_percentile(ordered, 0.99), 3),
+        "max_ms": round(ordered[-1], 3) if ordered else 0.0,
+    }
+
+def _rate(count, seconds) -> float:
+    return round(count / seconds, 3) if seconds > 0 else 0.0
+
+class Quiet:
+    """量測時把 BITS-AI 的 print 導到 /dev/null (仍保留格式化成本)"""
+
+    def __init__(self, verbose: bool):
+        self.verbose = verbose
+
+    def __enter__(self):
+        if self.verbose:
+            return self
+        self._sink = open(os.devnull, "w", encoding="utf-8")
+        self._redirect = redirect_stdout(self._sink)
+        self._redirect.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.verbose:
+            self._redirect.__exit__(*exc)
+            self._sink.close()
+
+# ============================================================
+# 📥 Ingestion：load_file_to_docs / add_docs_to_qdrant
+# ============================================================
+def bench_load(core, manifest, verbose=False):
+    per_kind = {}
+    all_docs = []
+    for item in manifest:
+        with Quiet(verbose):
+            start = time.perf_counter()
+            docs = core.load_file_to_docs(item["path"], title=os.path.basename(item["path"]), doc_type="other")
+            elapsed = time.perf_counter() - start
+        all_docs.extend(docs)
+        k = per_kind.setdefault(item["kind"], {"files": 0, "pages": 0, "bytes": 0, "chunks": 0, "seconds": 0.0})
+        k["files"] += 1
+        k["pages"] += item["pages"]
+        k["bytes"] += item["bytes"]
+        k["chunks"] += len(docs)
+        k["seconds"] += elapsed
+
+    total = {"files": 0, "pages": 0, "bytes": 0, "chunks": 0, "seconds": 0.0}
+    for k in per_kind.values():
+        for key in total:
+            total[key] += k[key]
+    for k in list(per_kind.values()) + [total]:
+        k["pages_per_s"] = _rate(k["pages"], k["seconds"])
+        k["chunks_per_s"] = _rate(k["chunks"], k["seconds"])
+        k["mb_per_s"] = _rate(k["bytes"] / 1e6, k["seconds"])
+        k["seconds"] = round(k["seconds"], 4)
+    return {"by_kind": per_kind, "total": total}, all_docs
+
+def _chunk_docs(core, texts, source):
+    """模擬 load_file_to_docs 的 metadata (登錄一份文件，chunk 只帶 doc_ids)，讓灌入的 chunk 與真實上傳一致"""
+    from langchain_core.documents import Document
+    doc_id = core.docstore.registry.register(source, source, "other", source, core.compute_hash("".join(texts)))
+    return [
+        Document(page_content=t, metadata={"doc_ids": [doc_id], "chunk_id": i})
+        for i, t in enumerate(texts)
+    ]
+
+def bench_embed(core, docs, verbose=False):
+    with Quiet(verbose):
+        core.add_docs_to_qdrant(_chunk_docs(core, synthetic_chunks(WARMUP_CHUNKS, seed=1), "warmup.md"))
+        start = time.perf_counter()
+        n = core.add_docs_to_qdrant(docs)
+        elapsed = time.perf_counter() - start
+    chars = sum(len(d.page_content) for d in docs)
+    return {
+        "chunks": n,
+        "chars": chars,
+        "seconds": round(elapsed, 4),
+        "chunks_per_s": _rate(n, elapsed),
+        "chars_per_s": _rate(chars, elapsed),
+    }
+
+# ============================================================
+# 🔍 Retrieval：_run_qdrant_query 隨 collection 成長的延遲
+# ============================================================
+def bench_query(core, sizes, verbose=False):
+    from qdrant_client import models
+    type_filter = models.Filter(must=[core.type_filter("other")])
+    questions = [RAG_QUESTIONS[i % len(RAG_QUESTIONS)] + f" (variant {i})" for i in range(QUERIES_PER_SIZE)]
+
+    results = {}
+    filler_seed = 100
+    for target in sizes:
+        points = core.client.count(collection_name=core.COLLECTION_NAME, exact=True).count
+        grow = {"chunks": 0, "seconds": 0.0}
+        if target > points:
+            texts = synthetic_chunks(target - points, seed=filler_seed)
+            filler_seed += 1
+            with Quiet(verbose):
+                start = time.perf_counter()
+                core.add_docs_to_qdrant(_chunk_docs(core, texts, f"filler_{target}.md"))
+                grow = {"chunks": len(texts), "seconds": round(time.perf_counter() - start, 4)}
+            points = core.client.count(collection_name=core.COLLECTION_NAME, exact=True).count
+
+        unfiltered, filtered = [], []
+        with Quiet(verbose):
+            core._run_qdrant_query(questions[0], None)          # 暖機
+            for q in questions:
+                start = time.perf_counter()
+                core._run_qdrant_query(q, None)
+                unfiltered.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                core._run_qdrant_query(q, type_filter)
+                filtered.append(time.perf_counter() - start)
+        results[str(target)] = {
+            "points": points,
+            "grow_chunks": grow["chunks"],
+            "grow_chunks_per_s": _rate(grow["chunks"], grow["seconds"]),
+            "unfiltered": latency_summary(unfiltered),
+            "filtered": latency_summary(filtered),
+        }
+        print(f"   🔍 {points:>6} points  p50={results[str(target)]['unfiltered']['p50_ms']:.1f} ms")
+    return results
+
+# ============================================================
+# 💬 End-to-end：generate_response 每種模式的開銷 (stub LLM)
+# ============================================================
+def bench_chat(core, repeat, verbose=False):
+    import bitsAI_trace as tracing
+    scenarios = [
+        ("normal", core.Mode.NORMAL, NORMAL_QUESTIONS),
+        ("rag", core.Mode.RAG, RAG_QUESTIONS),
+        ("tools", core.Mode.TOOLS, TOOL_QUESTIONS),
+        ("tools_fast_path", core.Mode.TOOLS, FAST_PATH_QUESTIONS),
+    ]
+    results = {}
+    for name, mode, questions in scenarios:
+        core.memory.clear()
+        latencies = []
+        with Quiet(verbose):
+            core.generate_response(questions[0], mode)          # 暖機
+            for i in range(repeat):
+                start = time.perf_counter()
+                core.generate_response(questions[i % len(questions)], mode)
+                latencies.append(time.perf_counter() - start)
+        results[name] = latency_summary(latencies)
+        print(f"   💬 {name:<16} p50={results[name]['p50_ms']:.2f} ms")
+    # 各階段 (meta filter / 搜尋 / LLM / 工具 / 記憶摘要) 的分佈直接取自 tracing
+    results["stages"] = tracing.recorder.metrics()["latency_ms"].get("chat", {})
+    return results
+
+# ============================================================
+# 🆚 與前一次結果比較
+# ============================================================
+def _flatten(data, prefix=""):
+    flat = {}
+    if isinstance(data, dict):
+        for k, v in data.items():
+            flat.update(_flatten(v, f"{prefix}{k}."))
+    elif isinstance(data, list):
+        for i, v in enumerate(data):
+            flat.update(_flatten(v, f"{prefix}{i}."))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        flat[prefix[:-1]] = data
+    return flat
+
+def _higher_is_better(key: str) -> bool:
+    return key.endswith("_per_s")
+
+def compare(baseline: dict, current: dict, threshold: float = 0.10) -> list:
+    """回傳 [(key, 舊值, 新值, 變化比例, 是否變差)]，只比較兩邊都有的速率 / 延遲指標"""
+    old, new = _flatten(baseline["results"]), _flatten(current["results"])
+    rows = []
+    for key in sorted(old.keys() & new.keys()):
+        if not (key.endswith("_per_s") or key.endswith("_ms")) or key.startswith("chat.stages."):
+            continue
+        a, b = old[key], new[key]
+        if not a:
+            continue
+        change = (b - a) / a
+        worse = change < -threshold if _higher_is_better(key) else change > threshold
+        rows.append((key, a, b, change, worse))
+    return rows
+
+def print_comparison(rows):
+    print(f"\n{'metric':<58} {'baseline':>12} {'current':>12} {'change':>8}")
+    for key, a, b, change, worse in rows:
+        flag = " ⚠️" if worse else ""
+        print(f"{key:<58} {a:>12.3f} {b:>12.3f} {change:>+8.1%}{flag}")
+    regressions = sum(1 for r in rows if r[4])
+    print(f"\n{'⚠️' if regressions else '✅'} {regressions} regression(s) out of {len(rows)} metrics")
+
+# ============================================================
+# 🚀 Main
+# ============================================================
+def open_core(workdir: str, verbose: bool = False, llm_latency: float = 0.0, mcp_command: str = None):
+    """
+    bitsAI_core 在 import 時就建立 qdrant_db / data_storage / traces (相對路徑)，
+    所以先切到獨立的工作資料夾再 import，不碰正式資料；LLM 換成 stub。
+    mcp_command 為 None 時不啟動 MCP，否則用它取代 DuckDB MCP server (例如 stub_mcp_server.py)
+    """
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    os.environ["BITSAI_MCP"] = "1" if mcp_command else "0"
+    if mcp_command:
+        os.environ["BITSAI_DUCKDB_MCP_COMMAND"] = mcp_command
+    os.environ.setdefault("BITSAI_METRICS_INTERVAL", "60")
+    with Quiet(verbose):
+        import bitsAI_core as core
+    core.set_chat_models(StubChatModel(latency=llm_latency))
+    return core
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "-C", REPO_ROOT, "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return ""
+
+def main():
+    parser = argparse.ArgumentParser(description="BITS-AI 離線 benchmark (stub LLM、不連 Ollama / MCP)")
+    parser.add_argument("--out", default=None, help="結果 JSON 路徑 (預設 benchmarks/results/bench-<時間>.json)")
+    parser.add_argument("--compare", default=None, help="與之前的結果 JSON 比較")
+    parser.add_argument("--threshold", type=float, default=0.10, help="比較時超過此變化比例視為退步")
+    parser.add_argument("--quick", action="store_true", help="小語料、小 collection，快速檢查用")
+    parser.add_argument("--sizes", default=None, help=f"query latency 的 collection 大小 (預設 {DEFAULT_SIZES})")
+    parser.add_argument("--fixtures", default=None, help="額外加入的真實文件資料夾 (.md / .pdf / .csv)")
+    parser.add_argument("--repeat", type=int, default=CHAT_REPEAT, help="每種模式的 generate_response 次數")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="stub LLM 每次呼叫的模擬延遲 (秒)")
+    parser.add_argument("--workdir", default=None, help="工作資料夾 (預設暫存資料夾，結束後刪除)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true", help="顯示 BITS-AI 本身的 log")
+    args = parser.parse_args()
+
+    out_path = os.path.abspath(args.out or os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    fixtures = os.path.abspath(args.fixtures) if args.fixtures else None
+    sizes = sorted(int(s) for s in (args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)).split(","))
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="bitsai-bench-"))
+    original_cwd = os.getcwd()
+    print(f"🏁 BITS-AI benchmark → {workdir}")
+    core = open_core(workdir, args.verbose, args.llm_latency)
+    import bitsAI_storage as storage
+
+    if args.quick:
+        manifest = build_corpus("corpus", n_markdown=5, n_pdf=2, n_csv=2, pdf_pages=3, seed=args.seed, fixture_dir=fixtures)
+    else:
+        manifest = build_corpus("corpus", seed=args.seed, fixture_dir=fixtures)
+    for item in manifest:
+        if item["kind"] == "csv":
+            storage.ingest_file(item["path"])
+
+    started = time.strftime("%Y-%m-%d %H:%M:%S")
+    results = {}
+    try:
+        print(f"📄 load_file_to_docs: {len(manifest)} files")
+        results["load_file_to_docs"], docs = bench_load(core, manifest, args.verbose)
+        print(f"   {results['load_file_to_docs']['total']['chunks_per_s']} chunks/s, "
+              f"{results['load_file_to_docs']['total']['pages_per_s']} pages/s")
+
+        print(f"🧮 add_docs_to_qdrant: {len(docs)} chunks")
+        results["add_docs_to_qdrant"] = bench_embed(core, docs, args.verbose)
+        print(f"   {results['add_docs_to_qdrant']['chunks_per_s']} chunks/s")
+
+        print(f"🔍 _run_qdrant_query: sizes {sizes}")
+        results["qdrant_query"] = bench_query(core, sizes, args.verbose)
+
+        print(f"💬 generate_response: {args.repeat} runs per mode")
+        results["chat"] = bench_chat(core, args.repeat, args.verbose)
+    finally:
+        os.chdir(original_cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "schema_version": SCHEMA_VERSION,
+        "meta": {
+            "started_at": started,
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+            "sizes": sizes,
+            "repeat": args.repeat,
+            "llm_latency": args.llm_latency,
+            "seed": args.seed,
+            "corpus_files": len(manifest),
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Results written to {out_path}")
+
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            print_comparison(compare(json.load(f), report, args.threshold))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import re
+import time
+import hashlib
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# ============================================================
+# 🤖 Deterministic Stub Chat Model (不需要 Ollama)
+# ============================================================
+STUB_ANSWER_WORDS = 40       # 每次回答的字數 (固定，讓後處理成本穩定)
+
+# load test 在訊息裡加上 [session N]；回答會列出 prompt 中看到的所有 session，
+# 出現別人的 session 就代表對話狀態 (memory) 被共用
+SESSION_TAG_RE = re.compile(r"\[session (\w+)\]")
+
+
+def _text_of(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+class StubChatModel(BaseChatModel):
+    """
+    相同輸入永遠得到相同輸出：
+    - Metadata 分類 prompt (結尾是 "JSON:") → 固定的 JSON
+    - 綁定工具且最後一則是使用者問題 → 以 tool_args 呼叫 tool_name (規劃呼叫)
+    - 其他 → 由輸入雜湊產生固定長度的回答，結尾附上 prompt 中出現的 session 標記
+    latency 可模擬模型耗時 (秒)，預設 0 只量測 BITS-AI 本身的開銷
+    """
+
+    latency: float = 0.0
+    tool_name: str = "list_storage_files"
+    tool_args: Dict[str, Any] = {}
+    bound_tools: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "bitsai-stub"
+
+    def bind_tools(self, tools, **kwargs):
+        names = [getattr(t, "name", None) or t.get("name") for t in tools]
+        return self.model_copy(update={"bound_tools": names})
+
+    def _reply(self, messages: List[BaseMessage]) -> AIMessage:
+        last = messages[-1]
+        text = _text_of(last)
+        digest = hashlib.sha1("\n".join(_text_of(m) for m in messages).encode("utf-8")).hexdigest()
+
+        if text.rstrip().endswith("JSON:"):
+            return AIMessage(content='{"type": "other", "subtype": ""}')
+
+        if self.bound_tools and isinstance(last, HumanMessage) and not any(isinstance(m, ToolMessage) for m in messages):
+            name = self.tool_name if self.tool_name in self.bound_tools else self.bound_tools[0]
+            args = self.tool_args if name == self.tool_name else {}
+            return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{digest[:12]}"}])
+
+        words = [digest[(i * 7) % 34:(i * 7) % 34 + 6] for i in range(STUB_ANSWER_WORDS)]
+        sessions = sorted({tag for m in messages for tag in SESSION_TAG_RE.findall(_text_of(m))})
+        seen = f" [sessions seen: {','.join(sessions)}]" if sessions else ""
+        return AIMessage(content="Stub answer: " + " ".join(words) + seen)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        message = self._reply(messages)
+        prompt_tokens = sum(len(_text_of(m).split()) for m in messages)
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": len(message.content.split()),
+            "total_tokens": prompt_tokens + len(message.content.split()),
+        }
+        return ChatResult(generations=[ChatGeneration(message=message)])
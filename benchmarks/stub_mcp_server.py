@@ -0,0 +1,38 @@
+import time
+import argparse
+
+import duckdb
+from mcp.server.fastmcp import FastMCP
+
+# ============================================================
+# 🦆 Stub DuckDB MCP Server (取代 uvx mcp-server-motherduck，不需網路)
+# 介面與官方 server 相同：單一 query 工具，回傳文字表格或錯誤訊息
+# ============================================================
+parser = argparse.ArgumentParser(description="BITS-AI load test 用的 DuckDB MCP stub")
+parser.add_argument("--latency", type=float, default=0.0, help="每次 query 額外等待的秒數")
+args = parser.parse_args()
+
+mcp = FastMCP("bitsai-stub-duckdb", log_level="WARNING")
+conn = duckdb.connect(":memory:")
+
+
+@mcp.tool()
+def query(query: str) -> str:
+    """Execute a SQL query on the DuckDB in-memory database and return the results."""
+    if args.latency:
+        time.sleep(args.latency)
+    try:
+        cursor = conn.execute(query)
+        if cursor.description is None:
+            return "Query executed successfully."
+        columns = [d[0] for d in cursor.description]
+        rows = cursor.fetchall()
+    except duckdb.Error as e:
+        return f"Error: {e}"
+    lines = [" | ".join(columns)]
+    lines += [" | ".join(str(v) for v in row) for row in rows]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    mcp.run()
@@ -0,0 +1,342 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import argparse
+from typing import List, Optional
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from pydantic import BaseModel
+
+# bitsAI_core 在 worker 啟動時才載入 (模型 / MCP / Qdrant 連線)，
+# 多 worker 模式下的主行程只負責管理 worker，不佔用本地 Qdrant 資料夾
+core = None
+
+# ============================================================
+# ⚙️ HTTP API 設定
+# ============================================================
+API_HOST = os.getenv("BITSAI_API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("BITSAI_API_PORT", "8000"))
+API_WORKERS = int(os.getenv("BITSAI_API_WORKERS", "1"))   # >1 需要 BITSAI_QDRANT_URL (本地模式會鎖住 qdrant_db)
+API_STATE_DIR = os.getenv("BITSAI_API_STATE_DIR", "api_state")  # session 記憶與 ingest 工作狀態 (所有 worker 共用)
+SESSION_DIR = os.path.join(API_STATE_DIR, "sessions")
+JOB_DIR = os.path.join(API_STATE_DIR, "jobs")
+UPLOAD_DIR = os.path.join(API_STATE_DIR, "uploads")
+INGEST_WORKERS = 1           # 每個 worker 同時處理的 ingest 工作數 (embedding 本身就吃滿 CPU)
+STORAGE_UPLOAD_WORKERS = 4   # 表格資料中心同時寫入的檔案數
+# POST /storage/local 只接受這些資料夾底下的檔案 (介面的上傳暫存區，預設系統暫存資料夾；多個以 os.pathsep 分隔)
+LOCAL_UPLOAD_ROOTS = [os.path.realpath(p) for p in
+                      os.getenv("BITSAI_LOCAL_UPLOAD_ROOTS", tempfile.gettempdir()).split(os.pathsep) if p]
+MAX_TOP_K = 50
+
+_ID_RE = re.compile(r"^[\w\-]{1,64}$")
+
+for _d in (SESSION_DIR, JOB_DIR, UPLOAD_DIR):
+    os.makedirs(_d, exist_ok=True)
+
+_ingest_pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="bitsai-ingest")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global core
+    import bitsAI_core as core
+    core.tracing.start_metrics_server()
+    yield
+    _ingest_pool.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="BITS-AI API", lifespan=lifespan)
+
+# ============================================================
+# 🗃️ 共用狀態 (JSON 檔；多個 worker 透過同一個資料夾共用)
+# ============================================================
+def _check_id(value: str, what: str) -> str:
+    if not _ID_RE.match(value or ""):
+        raise HTTPException(400, f"invalid {what}: {value!r}")
+    return value
+
+def _read_json(path: str):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _write_json(path: str, data: dict):
+    """先寫暫存檔再 os.replace，其他 worker 不會讀到寫一半的檔案"""
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def _session_memory(session_id: str):
+    """同一個 session 的請求可能落在不同 worker，每次都從共用檔案載入最新狀態"""
+    memory = core.get_memory(session_id)
+    state = _read_json(os.path.join(SESSION_DIR, f"{session_id}.json"))
+    if state is None:
+        memory.clear()  # 可能已被其他 worker 清除
+    else:
+        memory.load_dict(state)
+    return memory
+
+def _save_session(session_id: str):
+    _write_json(os.path.join(SESSION_DIR, f"{session_id}.json"), core.get_memory(session_id).to_dict())
+
+def _split_files(response: str):
+    """把工具落地檔的標記行拆出來，回傳 (回覆文字, [檔名])；檔案透過 GET /files/{name} 下載"""
+    paths = core.find_spill_paths(response)
+    text = "\n".join(line for line in response.splitlines() if not line.startswith(core.SPILL_MARKER))
+    return text.strip(), [os.path.basename(p) for p in paths]
+
+# ============================================================
+# 💬 Chat
+# ============================================================
+class ChatRequest(BaseModel):
+    message: str
+    mode: str = "normal"             # normal / tools / rag
+    session_id: Optional[str] = None  # 沒給就開新 session，回應會帶回 session_id
+    stream: bool = False             # true 時回傳 NDJSON：{"type": "token"} ... {"type": "done"}
+
+
+@app.post("/chat")
+async def chat(req: ChatRequest):
+    """推論 (同步的 LangChain / Ollama 呼叫) 與 session 檔案讀寫都交給 thread pool，event loop 不會被擋住"""
+    try:
+        mode = core.Mode[req.mode.upper()]
+    except KeyError:
+        raise HTTPException(400, f"unknown mode: {req.mode!r} (normal / tools / rag)")
+    session_id = _check_id(req.session_id, "session_id") if req.session_id else uuid.uuid4().hex
+    await run_in_threadpool(_session_memory, session_id)
+
+    if req.stream:
+        async def events():
+            text = ""
+            async for kind, text in iterate_in_threadpool(core.stream_response(req.message, mode, session_id)):
+                if kind == "token":
+                    yield json.dumps({"type": "token", "text": text}, ensure_ascii=False) + "\n"
+            await run_in_threadpool(_save_session, session_id)
+            response, files = _split_files(text)
+            yield json.dumps({"type": "done", "response": response, "files": files,
+                              "session_id": session_id, "busy": text == core.BUSY_MESSAGE},
+                             ensure_ascii=False) + "\n"
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
+    text = await run_in_threadpool(core.generate_response, req.message, mode, session_id)
+    await run_in_threadpool(_save_session, session_id)
+    response, files = _split_files(text)
+    body = {"response": response, "files": files, "session_id": session_id}
+    if text == core.BUSY_MESSAGE:
+        return JSONResponse(body, status_code=503, headers={"Retry-After": "5"})
+    return body
+
+
+@app.delete("/sessions/{session_id}")
+def clear_session(session_id: str):
+    _check_id(session_id, "session_id")
+    core.get_memory(session_id).clear()
+    core.drop_session(session_id)
+    try:
+        os.remove(os.path.join(SESSION_DIR, f"{session_id}.json"))
+    except FileNotFoundError:
+        pass
+    return {"session_id": session_id, "cleared": True}
+
+
+@app.get("/files/{name}")
+def download_result(name: str):
+    """工具模式落地的完整查詢結果 (只允許 RESULT_SPILL_DIR 底下的檔名)"""
+    path = os.path.join(core.RESULT_SPILL_DIR, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise HTTPException(404, "result file not found (expired or on another host)")
+    return FileResponse(path, filename=os.path.basename(path))
+
+# ============================================================
+# 🔍 Retrieval
+# ============================================================
+class RetrieveRequest(BaseModel):
+    question: str
+    limit: int = 0                   # 0 = core.RAG_TOP_K
+    doc_type: Optional[str] = None   # people / paper / other
+
+
+@app.post("/retrieve")
+def retrieve(req: RetrieveRequest):
+    limit = req.limit or core.RAG_TOP_K
+    if not 1 <= limit <= MAX_TOP_K:
+        raise HTTPException(400, f"limit must be between 1 and {MAX_TOP_K}")
+    start = time.perf_counter()
+    hits = core.retrieve(req.question, limit, req.doc_type)
+    return {"hits": hits, "took_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+# ============================================================
+# 📥 Ingest 工作 (上傳後立即回傳 job_id，背景轉換與 embedding)
+# ============================================================
+def _job_path(job_id: str) -> str:
+    return os.path.join(JOB_DIR, f"{job_id}.json")
+
+def _run_ingest_job(job_id: str, job_dir: str, paths: list, title: str, doc_type: str, use_marker: bool):
+    job = _read_json(_job_path(job_id))
+    job.update(status="running", started_at=time.time(), worker_pid=os.getpid())
+    _write_json(_job_path(job_id), job)
+    try:
+        job.update(status="done", result=core.process_upload_files(title, doc_type, paths, use_marker))
+    except Exception as e:
+        job.update(status="failed", result=f"❌ RAG 處理失敗: {e}")
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+    job["finished_at"] = time.time()
+    _write_json(_job_path(job_id), job)
+
+
+@app.post("/ingest", status_code=202)
+def create_ingest_job(files: List[UploadFile] = File(...), title: str = Form(""),
+                      doc_type: str = Form("other"), use_marker: bool = Form(False)):
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(UPLOAD_DIR, job_id)
+    os.makedirs(job_dir)
+    paths = []
+    for upload in files:
+        path = os.path.join(job_dir, os.path.basename(upload.filename or f"upload-{len(paths)}"))
+        with open(path, "wb") as f:
+            shutil.copyfileobj(upload.file, f, length=1024 * 1024)
+        paths.append(path)
+
+    job = {"job_id": job_id, "status": "queued", "files": [os.path.basename(p) for p in paths],
+           "created_at": time.time(), "result": None}
+    _write_json(_job_path(job_id), job)
+    _ingest_pool.submit(_run_ingest_job, job_id, job_dir, paths, title, doc_type, use_marker)
+    return job
+
+
+@app.get("/ingest/{job_id}")
+def get_ingest_job(job_id: str):
+    job = _read_json(_job_path(_check_id(job_id, "job_id")))
+    if job is None:
+        raise HTTPException(404, "job not found")
+    return job
+
+# ============================================================
+# 🗄️ 表格資料中心 (寫入 data_storage；Parquet 轉換、catalog 與 view 註冊都在 worker 內完成)
+# ============================================================
+def _save_upload(upload: UploadFile, upload_dir: str) -> str:
+    path = os.path.join(upload_dir, os.path.basename(upload.filename or uuid.uuid4().hex))
+    with open(path, "wb") as f:
+        shutil.copyfileobj(upload.file, f, length=1024 * 1024)
+    return path
+
+
+def _ingest_storage_files(paths: list, names: list = None) -> dict:
+    names = names or [None] * len(paths)
+    with ThreadPoolExecutor(max_workers=min(STORAGE_UPLOAD_WORKERS, len(paths))) as pool:
+        results = list(pool.map(core.storage.ingest_file, paths, names))
+    for r in results:
+        # 有寫入的 CSV 會在背景轉成 Parquet，之後的 SQL 查詢改讀 columnar 檔
+        r["converting"] = (r["status"] != "unchanged"
+                           and os.path.splitext(r["file"])[1].lower() in core.storage.CONVERTIBLE_EXTS)
+    return {"storage_dir": core.storage.STORAGE_DIR, "files": results}
+
+
+@app.post("/storage")
+def upload_storage_files(files: List[UploadFile] = File(...)):
+    """上傳檔案內容 (API 在別台主機時使用)；同一個檔案系統直接 hardlink，內容相同的檔案不重寫"""
+    upload_dir = os.path.join(UPLOAD_DIR, uuid.uuid4().hex)
+    os.makedirs(upload_dir)
+    try:
+        return _ingest_storage_files([_save_upload(upload, upload_dir) for upload in files])
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+class LocalStorageRequest(BaseModel):
+    paths: List[str]                 # 介面的上傳暫存檔 (必須在 LOCAL_UPLOAD_ROOTS 底下)
+    names: Optional[List[str]] = None
+
+
+def _check_local_path(path: str) -> str:
+    real = os.path.realpath(path)
+    if not any(os.path.commonpath([real, root]) == root for root in LOCAL_UPLOAD_ROOTS):
+        raise HTTPException(403, f"path outside the allowed upload folders: {path}")
+    if not os.path.isfile(real):
+        raise HTTPException(404, f"file not found on the API host: {path}")
+    return real
+
+
+@app.post("/storage/local")
+def ingest_local_storage_files(req: LocalStorageRequest):
+    """
+    介面與 API 共用檔案系統時只送路徑：直接從介面的暫存檔 hardlink 進 data_storage，
+    不再經過 HTTP 複製一次內容 (找不到檔案回 404，介面改用 POST /storage 上傳)
+    """
+    if not req.paths or (req.names is not None and len(req.names) != len(req.paths)):
+        raise HTTPException(400, "paths is empty or does not match names")
+    paths = [_check_local_path(p) for p in req.paths]
+    names = [os.path.basename(n or p) for n, p in zip(req.names or [None] * len(paths), req.paths)]
+    return _ingest_storage_files(paths, names)
+
+
+# ============================================================
+# 🩺 Health / Metrics
+# ============================================================
+@app.get("/health")
+def health():
+    collection = core.client.collection_exists(core.COLLECTION_NAME)
+    gateway = core.llm_gateway.metrics()
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "llm": core.LLM_NAME,
+        "qdrant": core.qdrant_conn.describe(core.QDRANT_URL, core.QDRANT_PATH),
+        "collection": core.COLLECTION_NAME,
+        "points": core.client.count(collection_name=core.COLLECTION_NAME, exact=False).count if collection else 0,
+        "tools": len(core.loaded_tools),
+        "llm_in_flight": gateway["in_flight"],
+        "llm_queued": gateway["queued"],
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    """與 metrics endpoint 相同的內容，但只涵蓋處理這個請求的 worker"""
+    return {"pid": os.getpid(), **core.tracing.collect_metrics()}
+
+
+@app.get("/profile")
+def profile(request: Request):
+    """與 metrics endpoint 的 /profile 相同 (?next=5&mode=cprofile)，只對處理這個請求的 worker 生效"""
+    try:
+        return {"pid": os.getpid(), **core.profiler.http_control(dict(request.query_params))}
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+# ============================================================
+# 🚀 Main
+# ============================================================
+def serve(host: str = API_HOST, port: int = API_PORT, workers: int = API_WORKERS):
+    import uvicorn
+    if workers > 1:
+        if not os.getenv("BITSAI_QDRANT_URL"):
+            raise SystemExit("❌ 多個 worker 需要共用 Qdrant server：請設定 BITSAI_QDRANT_URL (例如 http://127.0.0.1:6333)")
+        # 各 worker 不搶同一個 metrics port，改用 GET /metrics
+        os.environ.setdefault("BITSAI_METRICS_PORT", "0")
+        print(f"🚀 BITS-AI API on http://{host}:{port} ({workers} workers)")
+        uvicorn.run("bitsAI_api:app", host=host, port=port, workers=workers, log_level="warning")
+    else:
+        print(f"🚀 BITS-AI API on http://{host}:{port}")
+        uvicorn.run(app, host=host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BITS-AI headless HTTP API")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=API_WORKERS)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
@@ -1,41 +1,58 @@
 import gradio as gr
 import os
-import shutil
-import bitsAI_core as core
+import json
+import uuid
 import time
+import httpx
 from bitsAI_css import CUSTOM_CSS, JS_TOGGLE_THEME
 
+# ============================================================
+# 🌐 BITS-AI API 連線 (推論、檢索、建立知識庫都在 bitsAI_api.py 執行)
+# ============================================================
+API_URL = os.getenv("BITSAI_API_URL", "http://127.0.0.1:8000")
+API_PUBLIC_URL = os.getenv("BITSAI_API_PUBLIC_URL", API_URL)  # 瀏覽器下載結果檔用的網址
+API_TIMEOUT = 600            # 單次對話最長等待秒數
+# 介面與 API 在同一台主機 (共用檔案系統) 時，表格上傳只送路徑；API 找不到檔案時自動改送內容
+API_SHARED_FS = os.getenv("BITSAI_API_SHARED_FS", "1") != "0"
+INGEST_POLL_SECONDS = 1.0
+
+api = httpx.Client(base_url=API_URL, timeout=httpx.Timeout(API_TIMEOUT, connect=5))
+
+def api_health() -> dict:
+    try:
+        return api.get("/health", timeout=5).json()
+    except (httpx.HTTPError, ValueError):
+        return {}
+
 # ============================================================
 # ⚙️ 上傳限制與路徑設定
 # ============================================================
 MAX_FILE_SIZE_MB = 100       # 單一檔案最大 100MB
 MAX_FILE_COUNT = 100         # 一次上傳最大 100 個檔案
-STORAGE_DIR = "data_storage" # VisiData 專用資料夾
+STORAGE_DIR = "data_storage" # VisiData 專用資料夾 (與 API 共用同一個工作資料夾)
+QUEUE_MAX_SIZE = 10          # Gradio 排隊上限 (benchmarks/load_test.py 可量測其影響)
 
 # 確保資料夾存在
 os.makedirs(STORAGE_DIR, exist_ok=True)
 
 # ============================================================
-# 🧠 UI 狀態管理
+# 🧠 UI 狀態管理 (模式與 session 都存在各瀏覽器分頁的 gr.State)
 # ============================================================
-current_mode = core.Mode.NORMAL
-
 LABELS = {
-    core.Mode.NORMAL: ("🔴 開啟工具模式", "🔴 開啟 RAG 模式"),
-    core.Mode.TOOLS:  ("🟢 工具模式已啟用", "🔴 開啟 RAG 模式"),
-    core.Mode.RAG:    ("🔴 開啟工具模式", "🟢 RAG 模式已啟用"),
+    "normal": ("🔴 開啟工具模式", "🔴 開啟 RAG 模式"),
+    "tools":  ("🟢 工具模式已啟用", "🔴 開啟 RAG 模式"),
+    "rag":    ("🔴 開啟工具模式", "🟢 RAG 模式已啟用"),
 }
 
-def update_ui_state():
-    t_label, r_label = LABELS[current_mode]
-    t_variant = "primary" if current_mode == core.Mode.TOOLS else "secondary"
-    r_variant = "primary" if current_mode == core.Mode.RAG else "secondary"
+def update_ui_state(mode):
+    t_label, r_label = LABELS[mode]
+    t_variant = "primary" if mode == "tools" else "secondary"
+    r_variant = "primary" if mode == "rag" else "secondary"
     return gr.update(value=t_label, variant=t_variant), gr.update(value=r_label, variant=r_variant)
 
-def set_mode(new_mode):
-    global current_mode
-    current_mode = core.Mode.NORMAL if current_mode == new_mode else new_mode
-    return update_ui_state()
+def set_mode(new_mode, current_mode):
+    mode = "normal" if current_mode == new_mode else new_mode
+    return (mode, *update_ui_state(mode))
 
 # ============================================================
 # 📂 檔案處理邏輯
@@ -58,52 +75,112 @@ def validate_files(files):
     return True, ""
 
 def rag_upload_handler(title, doc_type, files, use_marker):
-    """處理 RAG 知識庫上傳 (透過 Core 處理)"""
+    """處理 RAG 知識庫上傳 (送到 API 建立 ingest 工作，再輪詢進度)"""
     is_valid, msg = validate_files(files)
     if not is_valid:
-        return msg
+        yield msg
+        return
 
+    handles = [open(f.name, "rb") for f in files]
     try:
-        # 呼叫 Core 進行向量化
-        result = core.process_upload_files(title=title, doc_type=doc_type, files=files, use_marker=use_marker)
-        return result
-    except Exception as e:
-        return f"❌ RAG 處理失敗: {str(e)}"
+        r = api.post("/ingest",
+                     data={"title": title or "", "doc_type": doc_type, "use_marker": str(bool(use_marker)).lower()},
+                     files=[("files", (os.path.basename(f.name), h)) for f, h in zip(files, handles)])
+        r.raise_for_status()
+        job = r.json()
+        while job["status"] in ("queued", "running"):
+            yield f"⏳ 轉換中... ({job['status']}, {len(job['files'])} 個檔案)"
+            time.sleep(INGEST_POLL_SECONDS)
+            r = api.get(f"/ingest/{job['job_id']}")
+            r.raise_for_status()
+            job = r.json()
+        yield job["result"]
+    except httpx.HTTPError as e:
+        yield f"❌ RAG 處理失敗: {str(e)}"
+    finally:
+        for h in handles:
+            h.close()
+
+UPLOAD_STATUS = {
+    "linked": "🔗 hardlink",
+    "copied": "📋 串流複製",
+    "deduplicated": "♻️ 內容與既有檔案相同，已共用",
+    "unchanged": "⏭️ 內容未變，略過",
+}
 
 def storage_upload_handler(files):
-    """處理數據中心上傳 (僅儲存到 data_storage)"""
+    """處理數據中心上傳 (送到 API 寫入 data_storage，由 API worker 轉換 Parquet 並更新 catalog)"""
     is_valid, msg = validate_files(files)
     if not is_valid:
         return msg
 
-    saved_count = 0
     logs = []
-    
+    handles = []
     try:
-        for file in files:
-            filename = os.path.basename(file.name)
-            # 處理檔名重複或直接覆蓋 (這邊選擇直接覆蓋)
-            dest_path = os.path.join(STORAGE_DIR, filename)
-            
-            # 從 Gradio Temp 複製到 data_storage
-            shutil.copy(file.name, dest_path)
-            saved_count += 1
-            logs.append(f"📄 {filename}")
+        resp = None
+        if API_SHARED_FS:
+            # 與 API 同一台主機：只送暫存檔路徑，API 直接 hardlink，不經 HTTP 再複製一次內容
+            resp = api.post("/storage/local", json={"paths": [os.path.abspath(f.name) for f in files]})
+            if resp.status_code in (403, 404):
+                resp = None
+        if resp is None:
+            handles = [open(f.name, "rb") for f in files]
+            resp = api.post("/storage", files=[("files", (os.path.basename(f.name), h))
+                                               for f, h in zip(files, handles)])
+        resp.raise_for_status()
+        results = resp.json()["files"]
+
+        for r in results:
+            mb = r["bytes"] / (1024 * 1024)
+            speed = mb / r["seconds"] if r["seconds"] > 0 else 0
+            line = f"📄 {r['file']} ({mb:.2f} MB, {UPLOAD_STATUS[r['status']]}, {speed:.1f} MB/s)"
+            if r["converting"]:
+                line += " (🧱 背景轉換 Parquet 中)"
+            logs.append(line)
             
-        return f"✅ 已儲存 {saved_count} 個檔案至 '{STORAGE_DIR}'：\n" + "\n".join(logs)
+        return f"✅ 已儲存 {len(results)} 個檔案至 '{STORAGE_DIR}'：\n" + "\n".join(logs)
     except Exception as e:
         return f"❌ 儲存失敗: {str(e)}"
+    finally:
+        for h in handles:
+            h.close()
 
 # ============================================================
 # 💬 對話包裝函式
 # ============================================================
-def respond_wrapper(message, chat_history):
+def linkify_spills(text, files):
+    """工具落地的完整結果改成 API 的下載連結"""
+    links = [f"📎 [完整結果：{name}]({API_PUBLIC_URL}/files/{name})" for name in files]
+    return "\n\n".join([text, *links]) if links else text
+
+def respond_wrapper(message, chat_history, session_id, mode):
     if not message.strip():
-        return "", chat_history
-    
-    response_text = core.generate_response(message, current_mode)
-    chat_history.append((message, response_text))
-    return "", chat_history
+        yield "", chat_history
+        return
+
+    chat_history.append((message, ""))
+    try:
+        with api.stream("POST", "/chat", json={"message": message, "mode": mode,
+                                              "session_id": session_id, "stream": True}) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["type"] == "token":
+                    chat_history[-1] = (message, chat_history[-1][1] + event["text"])
+                else:
+                    chat_history[-1] = (message, linkify_spills(event["response"], event["files"]))
+                yield "", chat_history
+    except httpx.HTTPError as e:
+        chat_history[-1] = (message, f"❌ 無法連線到 BITS-AI API ({API_URL})：{e}")
+        yield "", chat_history
+
+def clear_session(session_id):
+    try:
+        api.delete(f"/sessions/{session_id}", timeout=10)
+    except httpx.HTTPError as e:
+        print(f"⚠️ 清除 session 失敗: {e}")
 
 # ============================================================
 # 🎨 Gradio Layout
@@ -117,10 +194,13 @@ theme = gr.themes.Soft(
 
 with gr.Blocks(theme=theme, css=CUSTOM_CSS, fill_width=True) as demo:
     
+    session_state = gr.State(lambda: uuid.uuid4().hex)
+    mode_state = gr.State("normal")
+
     gr.HTML(f"""
     <div class="header-container">
         <div class="header-title">BITS-AI Agent</div>
-        <div class="header-subtitle">核心模型：<b>{core.LLM_NAME}</b> | 知識庫：<b>Qdrant</b></div>
+        <div class="header-subtitle">核心模型：<b>{api_health().get("llm", "API 未連線")}</b> | 知識庫：<b>Qdrant</b></div>
     </div>
     """)
 
@@ -138,8 +218,8 @@ with gr.Blocks(theme=theme, css=CUSTOM_CSS, fill_width=True) as demo:
                         theme_btn = gr.Button(value="", elem_classes=["theme-switch-btn"])
 
                 with gr.Group():
-                    toggle_tool_btn = gr.Button(LABELS[current_mode][0], variant="secondary")
-                    toggle_rag_btn = gr.Button(LABELS[current_mode][1], variant="secondary")
+                    toggle_tool_btn = gr.Button(LABELS["normal"][0], variant="secondary")
+                    toggle_rag_btn = gr.Button(LABELS["normal"][1], variant="secondary")
             
             # 卡片 2: 檔案管理 (使用 Tabs 解決空間問題)
             with gr.Column(elem_classes="sidebar-card"):
@@ -168,8 +248,8 @@ with gr.Blocks(theme=theme, css=CUSTOM_CSS, fill_width=True) as demo:
 
             # --- 事件綁定 ---
             theme_btn.click(None, None, None, js=JS_TOGGLE_THEME)
-            toggle_tool_btn.click(lambda: set_mode(core.Mode.TOOLS), None, [toggle_tool_btn, toggle_rag_btn])
-            toggle_rag_btn.click(lambda: set_mode(core.Mode.RAG), None, [toggle_tool_btn, toggle_rag_btn])
+            toggle_tool_btn.click(lambda m: set_mode("tools", m), mode_state, [mode_state, toggle_tool_btn, toggle_rag_btn])
+            toggle_rag_btn.click(lambda m: set_mode("rag", m), mode_state, [mode_state, toggle_tool_btn, toggle_rag_btn])
 
             # RAG 上傳事件
             rag_upload_btn.click(
@@ -222,9 +302,12 @@ with gr.Blocks(theme=theme, css=CUSTOM_CSS, fill_width=True) as demo:
             with gr.Row():
                 clear_btn = gr.Button("清空歷史紀錄", variant="stop")
 
-            msg.submit(respond_wrapper, [msg, chatbot], [msg, chatbot])
-            submit_btn.click(respond_wrapper, [msg, chatbot], [msg, chatbot])
-            clear_btn.click(lambda: None, None, chatbot, queue=False).then(lambda: core.memory.clear(), None, None)
+            msg.submit(respond_wrapper, [msg, chatbot, session_state, mode_state], [msg, chatbot])
+            submit_btn.click(respond_wrapper, [msg, chatbot, session_state, mode_state], [msg, chatbot])
+            clear_btn.click(lambda: None, None, chatbot, queue=False).then(clear_session, session_state, None)
+
+def main(server_name="0.0.0.0", server_port=7860):
+    demo.queue(max_size=QUEUE_MAX_SIZE).launch(server_name=server_name, server_port=server_port, show_api=False)
 
 if __name__ == "__main__":
-    demo.queue(max_size=10).launch(server_name="0.0.0.0", server_port=7860, show_api=False)
\ No newline at end of file
+    main()
\ No newline at end of file
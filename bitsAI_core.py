@@ -2,18 +2,27 @@ import os
 import subprocess
 import uuid
 import time
-from datetime import datetime
+import hashlib
+import re
 import json
-from enum import Enum
-
+import queue
+import heapq
+import itertools
+import threading
+import contextvars
+from collections import deque, OrderedDict
+from enum import Enum, IntEnum
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
 from langchain_ollama import ChatOllama
-from qdrant_client import QdrantClient
 from qdrant_client import models
 
 from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnableLambda
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage, ToolMessage
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.documents import Document
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter, MarkdownTextSplitter
@@ -21,7 +30,15 @@ from langchain_community.document_loaders import TextLoader
 
 from markitdown import MarkItDown
 
-from bitsAI_tools import get_all_tools_async, list_storage_files
+from bitsAI_tools import (get_all_tools_async, list_storage_files, mcp_loop,
+                         find_spill_paths, parse_result_page, SPILL_MARKER, RESULT_SPILL_DIR,
+                         DUCKDB_QUERY_TOOL, STORAGE_DIR, ToolCallError, ToolErrorKind,
+                         RETRYABLE_ERROR_KINDS, sql_cache)
+import bitsAI_storage as storage
+import bitsAI_docstore as docstore
+import bitsAI_qdrant_client as qdrant_conn
+import bitsAI_trace as tracing
+import bitsAI_profile as profiler
 import asyncio
 
 # ============================================================
@@ -29,37 +46,227 @@ import asyncio
 # ============================================================
 LLM_NAME = "qwen3:1.7b"
 SUMMARIZER_LLM_NAME = LLM_NAME 
-QDRANT_PATH = "qdrant_db"
-COLLECTION_NAME = "lab_knowledge"
+QDRANT_PATH = qdrant_conn.QDRANT_PATH
+QDRANT_URL = qdrant_conn.QDRANT_URL   # BITSAI_QDRANT_URL：改連 Qdrant server (多個 API worker 共用時必須)
+COLLECTION_NAME = qdrant_conn.COLLECTION_NAME
+DENSE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+SPARSE_MODEL = "prithivida/Splade_PP_en_v1"
+
+# Chunk 與檢索設定 (benchmarks/eval_retrieval.py 可比較不同組合)
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+RAG_TOP_K = 3                # 每次檢索取回的 chunk 數
 
 # 設定保留最近幾輪對話 (1輪 = User + AI)
 MEMORY_WINDOW_ROUNDS = 3
+MAX_SESSIONS = 256           # 同一行程最多保留幾個 session 的記憶 (LRU)
+
+# Ollama 連線與排程設定
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
+LLM_MAX_IN_FLIGHT = 2        # 同時送進 Ollama 的請求上限 (建議對齊 OLLAMA_NUM_PARALLEL)
+LLM_MAX_QUEUE_DEPTH = 8      # 排隊中的請求超過此數量就直接回報忙碌
+LLM_QUEUE_TIMEOUT = 60       # 單一請求最多排隊秒數
 
 class Mode(Enum):
     NORMAL = 0
     TOOLS = 1
     RAG = 2
 
+# ============================================================
+# 🚦 LLM Gateway (優先權排程 + 准入控制)
+# ============================================================
+class Priority(IntEnum):
+    """數字越小越優先"""
+    INTERACTIVE = 0      # 使用者直接等待的回答
+    TOOL_PLANNING = 1    # 工具模式的規劃呼叫
+    CLASSIFICATION = 2   # Metadata 分類
+    SUMMARIZATION = 3    # 背景記憶摘要
+
+
+class LLMBusyError(RuntimeError):
+    """排隊已滿或等待逾時，呼叫端應回報忙碌而非無限等待"""
+
+
+BUSY_MESSAGE = "⏳ 系統忙碌中，目前排隊的請求過多，請稍後再試。"
+
+# stream_response() 在執行緒內設定；INTERACTIVE 呼叫產生的 token 會即時送進這個 callback
+_token_sink = contextvars.ContextVar("bitsai_token_sink", default=None)
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class LLMGateway:
+    """
+    所有 LLM 呼叫的單一入口。
+    - 同時進行中的呼叫數上限為 max_in_flight
+    - 等待者依 Priority 排序 (同優先權 FIFO)
+    - 排隊深度超過 max_queue_depth 時立即丟出 LLMBusyError
+    """
+
+    def __init__(self, max_in_flight=LLM_MAX_IN_FLIGHT, max_queue_depth=LLM_MAX_QUEUE_DEPTH,
+                 queue_timeout=LLM_QUEUE_TIMEOUT, history=500):
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._stats = {
+            p: {"calls": 0, "errors": 0, "rejected": 0,
+                "latency": deque(maxlen=history), "queue_wait": deque(maxlen=history)}
+            for p in Priority
+        }
+
+    def _acquire(self, priority: Priority) -> float:
+        start = time.perf_counter()
+        with self._cond:
+            if self._in_flight < self.max_in_flight and not self._waiting:
+                self._in_flight += 1
+                return 0.0
+
+            if len(self._waiting) >= self.max_queue_depth:
+                self._stats[priority]["rejected"] += 1
+                raise LLMBusyError(f"LLM queue is full ({len(self._waiting)} waiting)")
+
+            ticket = (int(priority), next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            deadline = start + self.queue_timeout
+            while not (self._in_flight < self.max_in_flight and self._waiting[0] == ticket):
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._stats[priority]["rejected"] += 1
+                    self._cond.notify_all()
+                    raise LLMBusyError(f"LLM queue wait exceeded {self.queue_timeout}s")
+                self._cond.wait(timeout=remaining)
+
+            heapq.heappop(self._waiting)
+            self._in_flight += 1
+            # 下一位可能也能拿到空位
+            self._cond.notify_all()
+        return time.perf_counter() - start
+
+    def _release(self, priority: Priority, wait: float, latency: float, failed: bool):
+        with self._cond:
+            self._in_flight -= 1
+            stats = self._stats[priority]
+            stats["calls"] += 1
+            stats["errors"] += int(failed)
+            stats["queue_wait"].append(wait)
+            stats["latency"].append(latency)
+            self._cond.notify_all()
+
+    def invoke(self, runnable, inputs, priority: Priority = Priority.INTERACTIVE):
+        """在取得執行名額後呼叫 runnable.invoke(inputs)；每次呼叫記成一個 llm.<priority> span"""
+        with tracing.span(f"llm.{priority.name.lower()}") as sp:
+            wait = self._acquire(priority)
+            sp.set(queue_wait_ms=round(wait * 1000, 2))
+            callbacks = [_TokenUsageHandler(sp)]
+            sink = _token_sink.get()
+            if sink is not None and priority == Priority.INTERACTIVE:
+                callbacks.append(_TokenStreamHandler(sink))
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = runnable.invoke(inputs, config={"callbacks": callbacks})
+                failed = False
+                return result
+            finally:
+                self._release(priority, wait, time.perf_counter() - start, failed)
+
+    def metrics(self) -> dict:
+        """各優先權類別的延遲統計 (秒)"""
+        with self._cond:
+            snapshot = {
+                "in_flight": self._in_flight,
+                "queued": len(self._waiting),
+                "classes": {},
+            }
+            for p, s in self._stats.items():
+                latency, wait = list(s["latency"]), list(s["queue_wait"])
+                snapshot["classes"][p.name.lower()] = {
+                    "calls": s["calls"],
+                    "errors": s["errors"],
+                    "rejected": s["rejected"],
+                    "latency_p50": round(_percentile(latency, 0.50), 4),
+                    "latency_p95": round(_percentile(latency, 0.95), 4),
+                    "queue_wait_p50": round(_percentile(wait, 0.50), 4),
+                    "queue_wait_p95": round(_percentile(wait, 0.95), 4),
+                }
+        return snapshot
+
+
+class _TokenUsageHandler(BaseCallbackHandler):
+    """把模型回報的 usage_metadata (prompt / completion tokens) 寫進 span"""
+
+    def __init__(self, span):
+        self.span = span
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for gen in generations:
+                usage = getattr(getattr(gen, "message", None), "usage_metadata", None)
+                if usage:
+                    self.span.set(prompt_tokens=usage.get("input_tokens"),
+                                  completion_tokens=usage.get("output_tokens"))
+
+
+class _TokenStreamHandler(BaseCallbackHandler):
+    """ChatOllama 內部本來就是串流接收，invoke 期間逐 token 轉給 sink"""
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            self.sink(token)
+
+
+llm_gateway = LLMGateway()
+
+# 所有 ChatOllama 共用同一個連線池 (httpx transport)，避免每個 client 各自開連線
+_ollama_transport = httpx.HTTPTransport(
+    limits=httpx.Limits(max_connections=LLM_MAX_IN_FLIGHT * 2,
+                        max_keepalive_connections=LLM_MAX_IN_FLIGHT),
+)
+
+def make_chat_llm(model: str = LLM_NAME, temperature: float = 0.1) -> ChatOllama:
+    return ChatOllama(model=model, temperature=temperature, base_url=OLLAMA_HOST,
+                      sync_client_kwargs={"transport": _ollama_transport})
+
+def get_llm_metrics() -> dict:
+    return llm_gateway.metrics()
+
+# 本地 metrics endpoint 一併提供 LLM 排隊與 SQL 快取狀態
+tracing.register_metrics("llm_gateway", get_llm_metrics)
+tracing.register_metrics("sql_cache", sql_cache.stats)
+tracing.register_route("/profile", profiler.http_control)
+
 # ============================================================
 # 🤖 Agent 初始化
 # ============================================================
 # General Agent (不需工具)
-agent_general = ChatOllama(model=LLM_NAME, temperature=0.1)
+agent_general = make_chat_llm(LLM_NAME)
 
 # RAG & Summarizer LLMs
-rag_llm = ChatOllama(model=LLM_NAME, temperature=0.1)
-summarizer_llm = ChatOllama(model=SUMMARIZER_LLM_NAME, temperature=0.1)
+rag_llm = make_chat_llm(LLM_NAME)
+summarizer_llm = make_chat_llm(SUMMARIZER_LLM_NAME)
 
 # Tool Agent 需要等待 MCP 連線，所以我們延遲初始化，或者在此處 block 等待
 print("⏳ Connecting to Local MCP Servers...")
 
-# 建立一個全域的 Event Loop 來管理 MCP 連線
-# 注意：如果在 Jupyter Notebook 中，請勿使用 new_event_loop，改用 get_event_loop
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
-
+# MCP 連線全部建立在 bitsAI_tools 的背景 loop 執行緒上 (mcp_loop)，
+# 各 Gradio worker 只透過 mcp_loop.run() 提交 coroutine，不再共用 run_until_complete
 try:
-    loaded_tools = loop.run_until_complete(get_all_tools_async())
+    loaded_tools = mcp_loop.run(get_all_tools_async())
 except Exception as e:
     print(f"❌ Tool loading failed: {e}")
     loaded_tools = [list_storage_files] # Fallback
@@ -67,12 +274,74 @@ except Exception as e:
 print(f"✅ Total Tools Loaded: {len(loaded_tools)}")
 
 # 綁定工具到 LLM
-agent_tools = ChatOllama(model=LLM_NAME, temperature=0.1).bind_tools(loaded_tools)
+agent_tools = make_chat_llm(LLM_NAME).bind_tools(loaded_tools)
 
 # 建立 Mapping
 TOOL_MAPPING = {t.name: t for t in loaded_tools}
+
+# 工具並行執行設定
+TOOL_TIMEOUT_SECONDS = 60
+TOOL_TIMEOUTS = {           # 個別工具的逾時 (秒)，未列出者使用 TOOL_TIMEOUT_SECONDS
+    "get_time": 5,
+    "system_info": 5,       # 系統指標工具只讀背景 sampler 的 ring buffer
+    "disk_info": 5,
+    "gpu_info": 5,
+    "resource_monitor": 5,
+    "metrics_history": 5,
+}
+_tool_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="bitsai-tool")
+
+async def _run_tool_call(call: dict, index: int, trace=None) -> ToolMessage:
+    """執行單一 tool call；同步工具丟到 thread pool，MCP 工具直接 await"""
+    with tracing.span(f"tool.{call['name']}", trace=trace) as sp:
+        msg = await _run_tool_call_inner(call, index)
+        sp.set(status=msg.status, result_chars=len(msg.content))
+        return msg
+
+async def _run_tool_call_inner(call: dict, index: int) -> ToolMessage:
+    name = call["name"]
+    args = call.get("args", call.get("arguments", {})) or {}
+    call_id = call.get("id") or f"call_{index}_{name}"
+    timeout = TOOL_TIMEOUTS.get(name, TOOL_TIMEOUT_SECONDS)
+
+    print(f"🔧 Invoking Tool: {name}")
+    tool = TOOL_MAPPING.get(name)
+
+    # 失敗以 status="error" + artifact["error_kind"] 標記，重試邏輯不再比對輸出字串
+    error_kind = None
+    if not tool:
+        tool_result = f"❌ Error: Tool '{name}' not found. Available tools: {', '.join(TOOL_MAPPING)}"
+        error_kind = ToolErrorKind.BAD_ARGUMENTS
+    else:
+        try:
+            if tool.coroutine:
+                pending = tool.coroutine(**args)
+            else:
+                pending = asyncio.get_running_loop().run_in_executor(_tool_executor, tool.invoke, args)
+            tool_result = await asyncio.wait_for(pending, timeout=timeout)
+        except ToolCallError as e:
+            tool_result, error_kind = str(e), e.kind
+        except asyncio.TimeoutError:
+            tool_result = f"❌ Error: Tool '{name}' timed out after {timeout}s."
+            error_kind = ToolErrorKind.TIMEOUT
+        except Exception as e:
+            tool_result = f"❌ Error executing tool: {e}"
+            error_kind = ToolErrorKind.EXECUTION
+
+    if error_kind is None:
+        return ToolMessage(content=str(tool_result), tool_call_id=call_id, name=name)
+    return ToolMessage(content=str(tool_result), tool_call_id=call_id, name=name,
+                       status="error", artifact={"error_kind": error_kind.value})
+
+async def execute_tool_calls(calls: list[dict], trace=None) -> list[ToolMessage]:
+    """
+    同一輪的所有 tool call 一次送出，結果順序與 calls 相同。
+    這段在 MCP loop 執行緒上跑，contextvars 帶不過去，所以 trace 由呼叫端明確傳入。
+    """
+    return list(await asyncio.gather(*(_run_tool_call(c, i, trace) for i, c in enumerate(calls))))
+
 base_path = os.path.abspath('data_storage').replace('\\', '/')
-TOOL_SYSTEM_PROMPT = TOOL_SYSTEM_PROMPT = f"""
+TOOL_SYSTEM_PROMPT = f"""
 You are a Data Analysis Assistant with access to local tools.
 
 CRITICAL RULES:
@@ -88,25 +357,45 @@ CRITICAL RULES:
    - If the user asks for rows, top N records, or specific values, you **MUST** execute a `sql_query` to get the actual data.
    - If you haven't run a tool, you do not know the answer.
    - Do NOT generate a fake CSV table.
+
+4. **Use the Dataset Catalog**:
+   - The KNOWN DATASETS section (if present) lists the real columns and types of each file.
+   - Only use column names that appear there. Quote names with spaces or capitals, e.g. "Age".
 """
 
+def build_tool_system_prompt(question: str) -> str:
+    """TOOL_SYSTEM_PROMPT + 與問題相關的資料集 schema"""
+    datasets = storage.catalog_slice(question)
+    if not datasets:
+        return TOOL_SYSTEM_PROMPT
+    return f"{TOOL_SYSTEM_PROMPT}\nKNOWN DATASETS:\n{datasets}\n"
+
 # ============================================================
 # 🧠 Summarized Short-Term Memory 實作
 # ============================================================
 
+# 記憶摘要在背景執行緒跑 (SUMMARIZATION 優先權)，不佔用使用者等待回覆的時間；
+# 一次只跑一個，結果在下一輪對話時套用
+_summary_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bitsai-summary")
+
 class ChatMemory:
     def __init__(self, llm, keep_rounds=5):
         self.llm = llm
         self.keep_rounds = keep_rounds
         self.summary = "" 
         self.buffer = []  
+        self.pending = []   # 已移出 buffer、還在等背景摘要的訊息 (摘要完成前仍放進 prompt)
+        self._summary_job = None   # (future, 摘要時的 summary, 摘要的訊息)
+        self._lock = threading.Lock()
 
     def get_messages(self, system_instruction: str = "") -> list[BaseMessage]:
+        self.apply_summary()
         full_system_text = system_instruction
         if self.summary:
             full_system_text += f"\n\n[Previous Conversation Summary]:\n{self.summary}"
         
         messages = [SystemMessage(content=full_system_text)]
+        messages.extend(self.pending)
         messages.extend(self.buffer)
         return messages
 
@@ -121,11 +410,34 @@ class ChatMemory:
         max_msgs = self.keep_rounds * 2
         if len(self.buffer) > max_msgs:
             prune_count = 2 
-            messages_to_summarize = self.buffer[:prune_count]
+            self.pending.extend(self.buffer[:prune_count])
             self.buffer = self.buffer[prune_count:]
-            self._update_summary(messages_to_summarize)
-
-    def _update_summary(self, old_messages: list[BaseMessage]):
+        self._schedule_summary()
+
+    def _schedule_summary(self):
+        with self._lock:
+            if self._summary_job is not None or not self.pending:
+                return
+            base, batch = self.summary, list(self.pending)
+            self._summary_job = (_summary_pool.submit(self._update_summary, base, batch), base, batch)
+
+    def apply_summary(self):
+        """背景摘要完成時套用；期間若 clear() / load_dict() 換掉了狀態就丟棄結果"""
+        with self._lock:
+            if self._summary_job is None or not self._summary_job[0].done():
+                return
+            future, base, batch = self._summary_job
+            self._summary_job = None
+            n = len(batch)
+            if self.summary == base and [m.content for m in self.pending[:n]] == [m.content for m in batch]:
+                new_summary = future.result()
+                # 摘要失敗時與原本相同：這幾則訊息不再保留
+                if new_summary is not None:
+                    self.summary = new_summary
+                self.pending = self.pending[n:]
+        self._schedule_summary()
+
+    def _update_summary(self, summary: str, old_messages: list[BaseMessage]):
         conversation_text = ""
         for msg in old_messages:
             role = "User" if isinstance(msg, HumanMessage) else "AI"
@@ -142,32 +454,88 @@ class ChatMemory:
         chain = prompt_template | self.llm | StrOutputParser()
         
         try:
-            new_summary = chain.invoke({
-                "summary": self.summary or "No previous summary.",
-                "new_lines": conversation_text
-            })
-            self.summary = new_summary.strip()
-            print(f"🔄 Memory Summarized. New Summary Length: {len(self.summary)}")
+            with tracing.start_trace("memory", messages=len(old_messages)), tracing.span("memory.summarize"):
+                new_summary = llm_gateway.invoke(chain, {
+                    "summary": summary or "No previous summary.",
+                    "new_lines": conversation_text
+                }, priority=Priority.SUMMARIZATION)
+            new_summary = new_summary.strip()
+            print(f"🔄 Memory Summarized. New Summary Length: {len(new_summary)}")
+            return new_summary
         except Exception as e:
             print(f"⚠️ Summary update failed: {e}")
+            return None
 
     def clear(self):
         self.summary = ""
         self.buffer = []
-
-# 初始化全域記憶體
+        self.pending = []
+
+    def to_dict(self) -> dict:
+        """可轉 JSON 的狀態 (HTTP API 用來在多個 worker 之間共用 session)"""
+        def dump(messages):
+            return [{"role": "user" if isinstance(m, HumanMessage) else "ai", "content": m.content}
+                    for m in messages]
+        return {"summary": self.summary, "pending": dump(self.pending), "buffer": dump(self.buffer)}
+
+    def load_dict(self, data: dict):
+        def load(items):
+            return [HumanMessage(content=m["content"]) if m["role"] == "user" else AIMessage(content=m["content"])
+                    for m in items]
+        self.summary = data.get("summary", "")
+        self.pending = load(data.get("pending", []))
+        self.buffer = load(data.get("buffer", []))
+        # 其他 worker 留下的待摘要訊息由這個 worker 接手
+        self._schedule_summary()
+
+# 初始化全域記憶體 (沒有指定 session 的呼叫共用這一份)
 memory = ChatMemory(llm=summarizer_llm, keep_rounds=MEMORY_WINDOW_ROUNDS)
 
+# 每個 session 各自的記憶體，超過 MAX_SESSIONS 時淘汰最久沒用的
+_sessions: "OrderedDict[str, ChatMemory]" = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def get_memory(session_id: str = None) -> ChatMemory:
+    if not session_id:
+        return memory
+    with _sessions_lock:
+        mem = _sessions.get(session_id)
+        if mem is None:
+            mem = _sessions[session_id] = ChatMemory(llm=summarizer_llm, keep_rounds=MEMORY_WINDOW_ROUNDS)
+            while len(_sessions) > MAX_SESSIONS:
+                _sessions.popitem(last=False)
+        else:
+            _sessions.move_to_end(session_id)
+        return mem
+
+def drop_session(session_id: str):
+    with _sessions_lock:
+        _sessions.pop(session_id, None)
+
 
 # ============================================================
 # 📚 Qdrant 資料庫初始化
 # ============================================================
-client = QdrantClient(path=QDRANT_PATH)
+client = qdrant_conn.make_client(QDRANT_URL, QDRANT_PATH)
 
 print("⏳ Loading embedding models...")
-client.set_model("sentence-transformers/all-MiniLM-L6-v2")
-client.set_sparse_model("prithivida/Splade_PP_en_v1")
-print(f"📂 Qdrant 資料庫路徑: {os.path.abspath(QDRANT_PATH)}")
+client.set_model(DENSE_MODEL)
+client.set_sparse_model(SPARSE_MODEL)
+print(f"📂 Qdrant 資料庫: {qdrant_conn.describe(QDRANT_URL, QDRANT_PATH)}")
+if qdrant_conn.is_physical_collection(client, COLLECTION_NAME):
+    print(f"⚠️ {COLLECTION_NAME} 是舊版建立的實體 collection，匯入備份無法原子切換；"
+          f"執行 python -u bitsAI_qdrant_backup.py adopt-alias 改成 alias")
+
+def ensure_collection():
+    """第一次寫入前建立實體 collection，COLLECTION_NAME 是指向它的 alias (匯入備份時可直接切換)"""
+    if client.collection_exists(COLLECTION_NAME):
+        return
+    physical = qdrant_conn.create_aliased_collection(
+        client, COLLECTION_NAME,
+        vectors_config=client.get_fastembed_vector_params(),
+        sparse_vectors_config=client.get_fastembed_sparse_vector_params(),
+    )
+    print(f"🆕 Collection {physical} (alias {COLLECTION_NAME})")
 
 # ============================================================
 # 📥 檔案處理與 chunk 設定 (Markdown 增強版)
@@ -225,10 +593,10 @@ def convert_to_markdown(file_path: str, use_marker_for_pdf: bool = False) -> str
         return f"❌ Conversion Error: {str(e)}"
 
 # 改用 Markdown 專用的 Splitter，能更好保留結構
-text_splitter = MarkdownTextSplitter(
-    chunk_size=500,
-    chunk_overlap=100
-)
+def make_text_splitter(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+    return MarkdownTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+text_splitter = make_text_splitter()
 
 def compute_hash(text: str) -> str:
     return str(uuid.uuid5(uuid.NAMESPACE_DNS, text))
@@ -240,35 +608,37 @@ def load_file_to_docs(file_path, title="", doc_type="other", subtype=None, use_m
     base_name = os.path.basename(file_path)
     
     # 呼叫轉換函式
-    markdown_text = convert_to_markdown(file_path, use_marker_for_pdf=use_marker)
+    with tracing.span("ingest.convert", file=base_name, marker=use_marker) as sp:
+        markdown_text = convert_to_markdown(file_path, use_marker_for_pdf=use_marker)
+        sp.set(chars=len(markdown_text))
     
     raw_doc = Document(
         page_content=markdown_text,
         metadata={"source": base_name}
     )
-    
-    docs = text_splitter.split_documents([raw_doc])
 
     default_subtype = os.path.splitext(base_name)[0]
     resolved_subtype = subtype.strip() if subtype and subtype.strip() else default_subtype
 
+    with tracing.span("ingest.split", file=base_name) as sp:
+        docs = text_splitter.split_documents([raw_doc])
+        sp.set(chunks=len(docs))
+
+    # 文件層級的 metadata 只記一次在登錄表，chunk 只帶 doc_id
+    # (寫入 Qdrant 失敗時由 _process_upload_files 刪掉沒有 chunk 引用的資料列)
+    doc_id = docstore.registry.register(
+        base_name, title or base_name, doc_type or "other", resolved_subtype,
+        hashlib.sha1(markdown_text.encode("utf-8")).hexdigest(),
+    )
+
     processed = []
     for i, d in enumerate(docs):
         if not d.page_content.strip():
             continue
 
-        chunk_hash = compute_hash(d.page_content)
-        current_timestamp = time.time()
-        readable_time = datetime.fromtimestamp(current_timestamp).strftime('%Y-%m-%d %H:%M:%S')
-
         new_metadata = {
-            "title": title or base_name,
-            "source": base_name,
-            "type": doc_type or "other",
-            "subtype": resolved_subtype,
+            "doc_ids": [doc_id],
             "chunk_id": i,
-            "hash": chunk_hash,
-            "timestamp": readable_time,
         }
 
         # 保留轉換工具可能留下的 metadata (如有)
@@ -281,23 +651,71 @@ def load_file_to_docs(file_path, title="", doc_type="other", subtype=None, use_m
     return processed
 
 def add_docs_to_qdrant(docs):
+    """
+    chunk id = uuid5(內容)。同樣的內容已經在 collection 裡 (別的檔案也有這一段) 時不重新 embedding，
+    只把新的 doc_id 併進 doc_ids；同一批裡重複的內容也合併成一個 point。
+    回傳新增 (embedding) 的 point 數，只併入 doc_ids 的不算
+    """
     if not docs:
         return 0
 
-    documents_content = [d.page_content for d in docs]
-    metadatas = [d.metadata for d in docs]
-    ids = [d.metadata["hash"] for d in docs]
-
-    client.add(
-        collection_name=COLLECTION_NAME,
-        documents=documents_content,
-        metadata=metadatas,
-        ids=ids,
-        batch_size=32
-    )
-    return len(docs)
-
+    merged = {}  # chunk id -> (Document, doc_ids)
+    for d in docs:
+        chunk_id = compute_hash(d.page_content)
+        if chunk_id in merged:
+            doc_ids = merged[chunk_id][1]
+            doc_ids.extend(i for i in d.metadata.get("doc_ids", []) if i not in doc_ids)
+        else:
+            merged[chunk_id] = (d, list(d.metadata.get("doc_ids", [])))
+
+    existing = {}
+    if client.collection_exists(COLLECTION_NAME):
+        with tracing.span("ingest.lookup_existing", chunks=len(merged)) as sp:
+            for point in client.retrieve(COLLECTION_NAME, ids=list(merged), with_payload=True, with_vectors=False):
+                existing[str(point.id)] = point.payload or {}
+            sp.set(existing=len(existing))
+
+    new_ids, new_texts, new_metas, ops = [], [], [], []
+    for chunk_id, (d, doc_ids) in merged.items():
+        payload = existing.get(chunk_id)
+        if payload is None:
+            new_ids.append(chunk_id)
+            new_texts.append(d.page_content)
+            new_metas.append({**d.metadata, "doc_ids": doc_ids} if doc_ids else d.metadata)
+            continue
+        old_ids = payload.get("doc_ids")
+        if old_ids is None:
+            # 舊格式的 point：先把它原本的來源登錄成文件，再改成只存 doc_ids
+            old_ids = [docstore.legacy_doc_id(payload)]
+            combined = old_ids + [i for i in doc_ids if i not in old_ids]
+            ops.append(models.OverwritePayloadOperation(overwrite_payload=models.SetPayload(
+                payload=docstore.slim_payload(payload, combined), points=[chunk_id])))
+        elif any(i not in old_ids for i in doc_ids):
+            ops.append(models.SetPayloadOperation(set_payload=models.SetPayload(
+                payload={"doc_ids": old_ids + [i for i in doc_ids if i not in old_ids]}, points=[chunk_id])))
+
+    if ops:
+        with tracing.span("ingest.merge_sources", chunks=len(ops)):
+            client.batch_update_points(collection_name=COLLECTION_NAME, update_operations=ops)
+
+    if new_ids:
+        ensure_collection()
+        with tracing.span("ingest.embed_upsert", chunks=len(new_ids)):
+            client.add(
+                collection_name=COLLECTION_NAME,
+                documents=new_texts,
+                metadata=new_metas,
+                ids=new_ids,
+                batch_size=32
+            )
+    return len(new_ids)
+
+@profiler.profiled("ingest")
 def process_upload_files(title, doc_type, files, use_marker=False):
+    with tracing.start_trace("ingest", "marker" if use_marker else "markitdown", files=len(files or [])):
+        return _process_upload_files(title, doc_type, files, use_marker)
+
+def _process_upload_files(title, doc_type, files, use_marker=False):
     if not files:
         return "⚠️ 請先上傳檔案。"
 
@@ -308,16 +726,23 @@ def process_upload_files(title, doc_type, files, use_marker=False):
         path = normalize_file(file)
         file_name = os.path.basename(path)
 
+        docs = []
         try:
             docs = load_file_to_docs(path, title, doc_type, subtype=None, use_marker=use_marker)
             n_added = add_docs_to_qdrant(docs)
             
-            print(f"📄 {file_name} → 轉換為 Markdown 並儲存 {n_added} chunks")
+            print(f"📄 {file_name} → 轉換為 Markdown，{len(docs)} chunks (新增 {n_added}，"
+                  f"{len(docs) - n_added} 個與既有內容相同，只併入來源)")
             total_add += n_added
         except Exception as e:
             logs.append(f"❌ {path} 發生錯誤：{e}")
+            doc_ids = {i for d in docs for i in d.metadata.get("doc_ids", [])}
+            try:
+                docstore.discard_unused(client, doc_ids)
+            except Exception as cleanup_error:
+                print(f"⚠️ 清理登錄表失敗 ({sorted(doc_ids)}): {cleanup_error}")
 
-    logs.append(f"\n**總計成功處理 {total_add} 個 chunks**")
+    logs.append(f"\n**總計新增 {total_add} 個 chunks**")
     return "\n".join(logs)
 
 # ============================================================
@@ -341,10 +766,26 @@ JSON:
 
 meta_filter_chain = meta_filter_prompt | agent_general | StrOutputParser()
 
+def set_chat_models(general, summarizer=None):
+    """
+    替換所有聊天模型 (離線 benchmark / 測試用的 stub)。
+    general 需支援 bind_tools；summarizer 預設與 general 相同。
+    """
+    global agent_general, rag_llm, summarizer_llm, agent_tools, meta_filter_chain
+    agent_general = rag_llm = general
+    summarizer_llm = summarizer or general
+    agent_tools = general.bind_tools(loaded_tools)
+    memory.llm = summarizer_llm
+    with _sessions_lock:
+        for mem in _sessions.values():
+            mem.llm = summarizer_llm
+    meta_filter_chain = meta_filter_prompt | agent_general | StrOutputParser()
+
 def decide_metadata_filter(question: str):
     raw = ""
     try:
-        raw = meta_filter_chain.invoke({"question": question})
+        raw = llm_gateway.invoke(meta_filter_chain, {"question": question},
+                                 priority=Priority.CLASSIFICATION)
         start = raw.find("{")
         end = raw.rfind("}")
         if start != -1 and end != -1 and end > start:
@@ -363,7 +804,7 @@ def decide_metadata_filter(question: str):
     if type_ and type_ not in ["any", ""]:
         if type_ not in ["people", "paper", "other"]:
             type_ = "other"
-        must_conditions.append(models.FieldCondition(key="type", match=models.MatchValue(value=type_)))
+        must_conditions.append(type_filter(type_))
 
     if not must_conditions:
         return None, {"type": type_, "subtype": subtype}
@@ -372,32 +813,57 @@ def decide_metadata_filter(question: str):
     return qdrant_filter, {"type": type_, "subtype": subtype}
 
 
-def _run_qdrant_query(question: str, qdrant_filter):
+def type_filter(type_: str) -> models.Filter:
+    """type 記在文件登錄表 → 轉成 doc_ids 過濾；尚未遷移的舊 chunk 仍比對 payload 的 type"""
+    doc_ids = docstore.registry.ids_matching(doc_type=type_)
+    return models.Filter(should=[
+        models.FieldCondition(key="doc_ids", match=models.MatchAny(any=doc_ids or [-1])),
+        models.FieldCondition(key="type", match=models.MatchValue(value=type_)),
+    ])
+
+
+def _run_qdrant_query(question: str, qdrant_filter, limit: int = RAG_TOP_K):
     if not client.collection_exists(COLLECTION_NAME):
         return []
     
     all_points = []
     seen_hashes = set()
 
-    search_result = client.query(
-        collection_name=COLLECTION_NAME,
-        query_text=question,
-        limit=3,
-        query_filter=qdrant_filter
-    )
+    # fastembed 的 client.query 內部先做 query embedding 再搜尋，兩者記在同一個 span
+    with tracing.span("rag.embed_search", filtered=qdrant_filter is not None) as sp:
+        search_result = client.query(
+            collection_name=COLLECTION_NAME,
+            query_text=question,
+            limit=limit,
+            query_filter=qdrant_filter
+        )
+        sp.set(hits=len(search_result))
 
     for point in search_result:
-        doc_hash = point.metadata.get("hash")
-        if doc_hash not in seen_hashes:
+        if point.id not in seen_hashes:
             all_points.append(point)
-            seen_hashes.add(doc_hash)
+            seen_hashes.add(point.id)
 
     all_points.sort(key=lambda x: x.score, reverse=True)
-    return all_points[:8]
+    return all_points[:limit]
+
+
+def retrieve(question: str, limit: int = RAG_TOP_K, doc_type: str = None) -> list[dict]:
+    """只做檢索、不呼叫 LLM (HTTP API 的 /retrieve)；doc_type 對應 payload 的 type 欄位"""
+    qdrant_filter = models.Filter(must=[type_filter(doc_type)]) if doc_type else None
+    with tracing.start_trace("retrieve", doc_type or "all", chars=len(question)):
+        points = _run_qdrant_query(question, qdrant_filter, limit)
+    hits = []
+    for point in points:
+        meta = docstore.registry.resolve(point.metadata)
+        text = meta.pop("document", "") or getattr(point, "document", "")
+        hits.append({"id": str(point.id), "score": point.score, "text": text, "metadata": meta})
+    return hits
 
 
 def qdrant_hybrid_search_with_meta(question: str):
-    qdrant_filter, debug_meta = decide_metadata_filter(question)
+    with tracing.span("rag.meta_filter"):
+        qdrant_filter, debug_meta = decide_metadata_filter(question)
     subtype_hint = debug_meta.get("subtype", "")
 
     results = _run_qdrant_query(question, qdrant_filter) if qdrant_filter else _run_qdrant_query(question, None)
@@ -405,29 +871,178 @@ def qdrant_hybrid_search_with_meta(question: str):
     if qdrant_filter and not results:
         results = _run_qdrant_query(question, None)
 
-    context_list = []
-    for idx, point in enumerate(results, start=1):
-        content = point.metadata.get("document", "")
-        source = point.metadata.get("source", "unknown")
-        if not content and hasattr(point, 'document'): 
-             content = point.document
-        
-        block = (
-            f"### Document {idx} (Source: {source})\n"
-            f"\n"
-            f"{content}"
-        )
-        context_list.append(block)
-
-    context_text = "\n\n".join(context_list)
+    with tracing.span("rag.context_build", docs=len(results)) as sp:
+        context_list = []
+        for idx, point in enumerate(results, start=1):
+            content = point.metadata.get("document", "")
+            meta = docstore.registry.resolve(point.metadata)
+            source = ", ".join(meta.get("sources") or [meta.get("source", "unknown")])
+            if not content and hasattr(point, 'document'): 
+                 content = point.document
+            
+            block = (
+                f"### Document {idx} (Source: {source})\n"
+                f"\n"
+                f"{content}"
+            )
+            context_list.append(block)
+
+        context_text = "\n\n".join(context_list)
+        sp.set(chars=len(context_text))
     return {"context": context_text, "subtype": subtype_hint}
 
 
+# ============================================================
+# ⚡ 資料中心常見意圖快速路徑 (不經過工具規劃 LLM)
+# ============================================================
+FAST_PATH_MAX_ROWS = 50
+
+_FILE_PAT = r"(?P<file>[\w\-.]+\.(?:csv|tsv|parquet))"
+_COL_PAT = r'(?P<col>"[^"]+"|[\w]+)'
+_AGG_PAT = r"(?P<agg>average|avg|mean|sum|total|max|maximum|min|minimum)"
+_AGG_SQL = {
+    "average": "AVG", "avg": "AVG", "mean": "AVG", "sum": "SUM", "total": "SUM",
+    "max": "MAX", "maximum": "MAX", "min": "MIN", "minimum": "MIN",
+}
+_AGG_WORD = {"AVG": "average", "SUM": "total", "MAX": "maximum", "MIN": "minimum"}
+
+FAST_PATH_INTENTS = [
+    ("list_files", re.compile(
+        r"(?:please\s+)?(?:list|show)(?:\s+me)?(?:\s+all)?(?:\s+the)?\s+files"
+        r"|what files are there|列出(?:所有)?檔案|有哪些檔案", re.IGNORECASE)),
+    ("head", re.compile(
+        _FILE_PAT + r"\s+(?:head|first|top)\s+(?P<n>\d+)(?:\s+rows?)?", re.IGNORECASE)),
+    ("head", re.compile(
+        r"(?:show\s+(?:me\s+)?)?(?:the\s+)?(?:first|top|head)\s+(?P<n>\d+)\s+rows?\s+(?:of|from|in)\s+"
+        + _FILE_PAT, re.IGNORECASE)),
+    ("aggregate", re.compile(
+        _FILE_PAT + r"\s+column\s+" + _COL_PAT + r"\s+" + _AGG_PAT + r"(?:\s+value)?", re.IGNORECASE)),
+    ("aggregate", re.compile(
+        r"(?:what\s+is\s+)?(?:the\s+)?" + _AGG_PAT + r"(?:\s+value)?\s+of\s+(?:the\s+)?(?:column\s+)?"
+        + _COL_PAT + r"(?:\s+column)?\s+in\s+" + _FILE_PAT, re.IGNORECASE)),
+    ("count", re.compile(
+        r"how\s+many\s+rows\s+(?:are\s+)?(?:in|does)\s+" + _FILE_PAT + r"(?:\s+have)?", re.IGNORECASE)),
+]
+
+def _resolve_storage_file(name: str):
+    """大小寫不敏感地對應到 data_storage 內實際存在的檔名"""
+    return storage.storage_index.lookup(name)
+
+def _table_expr(filename: str) -> str:
+    reader = "read_parquet" if filename.lower().endswith(".parquet") else "read_csv"
+    return f"{reader}('{STORAGE_DIR}/{filename}')"
+
+def _run_fast_sql(sql: str):
+    tool = TOOL_MAPPING.get(DUCKDB_QUERY_TOOL)
+    if not tool:
+        return None
+    return parse_result_page(str(tool.invoke({"query": sql})))
+
+def _markdown_table(columns, rows) -> str:
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    lines += ["| " + " | ".join(r) + " |" for r in rows]
+    return "\n".join(lines)
+
+def try_fast_path(message: str):
+    """
+    辨識高頻的資料中心問題並直接以 SQL / list_storage_files 回答。
+    回傳 None 代表沒有把握 (不符合樣板、檔案或欄位不存在、查詢失敗)，交給 LLM 處理。
+    """
+    text = message.strip().rstrip("?？.!。！ ")
+    for intent, pattern in FAST_PATH_INTENTS:
+        m = pattern.fullmatch(text)
+        if m:
+            break
+    else:
+        return None
+
+    try:
+        if intent == "list_files":
+            return str(TOOL_MAPPING.get("list_storage_files", list_storage_files).invoke({}))
+
+        filename = _resolve_storage_file(m.group("file"))
+        if not filename:
+            return None
+        table = _table_expr(filename)
+
+        if intent == "head":
+            n = int(m.group("n"))
+            if not 0 < n <= FAST_PATH_MAX_ROWS:
+                return None
+            page = _run_fast_sql(f"SELECT * FROM {table} LIMIT {n}")
+            if not page:
+                return None
+            columns, rows, _ = page
+            return f"Here are the first {len(rows)} rows from {filename}:\n\n" + _markdown_table(columns, rows)
+
+        if intent == "count":
+            page = _run_fast_sql(f"SELECT COUNT(*) AS row_count FROM {table}")
+            if not page or not page[1]:
+                return None
+            return f"`{filename}` has {page[1][0][0]} rows."
+
+        if intent == "aggregate":
+            entry = storage.get_catalog().get(filename)
+            if not entry:
+                return None
+            wanted = m.group("col").strip('"').lower()
+            column = next((c["name"] for c in entry["columns"] if c["name"].lower() == wanted), None)
+            if column is None:
+                return None
+            func = _AGG_SQL[m.group("agg").lower()]
+            page = _run_fast_sql(f'SELECT {func}("{column}") AS value FROM {table}')
+            if not page or not page[1]:
+                return None
+            value = page[1][0][0]
+            try:
+                value = f"{float(value):.2f}".rstrip("0").rstrip(".") if func == "AVG" else value
+            except ValueError:
+                pass
+            return f'The {_AGG_WORD[func]} value of the "{column}" column in `{filename}` is {value}.'
+
+    except Exception as e:
+        print(f"⚠️ [FastPath] fallback to LLM: {e}")
+    return None
+
+def _traced_fast_path(message: str):
+    with tracing.span("tools.fast_path") as sp:
+        answer = try_fast_path(message)
+        sp.set(hit=answer is not None)
+        return answer
+
 # ============================================================
 # 💬 核心回應生成邏輯 (整合 Memory)
 # ============================================================
 
-def generate_response(message: str, current_mode: Mode) -> str:
+@profiler.profiled("chat")
+def generate_response(message: str, current_mode: Mode, session_id: str = None) -> str:
+    """每次對話是一個 trace，各階段耗時寫入 traces/*.jsonl 並彙整到 metrics endpoint"""
+    with tracing.start_trace("chat", current_mode.name.lower(), chars=len(message)):
+        return _generate_response(message, current_mode, get_memory(session_id))
+
+def stream_response(message: str, current_mode: Mode, session_id: str = None):
+    """
+    generate_response 的串流版：先逐一產出 ("token", 文字)，最後產出 ("done", 完整回覆)。
+    只有使用者直接等待的 INTERACTIVE 呼叫會串流；完整回覆以 done 為準 (含快速路徑與落地檔標記)
+    """
+    events = queue.Queue()
+
+    def run():
+        _token_sink.set(lambda token: events.put(("token", token)))
+        response = ""
+        try:
+            response = generate_response(message, current_mode, session_id)
+        finally:
+            events.put(("done", response))
+
+    threading.Thread(target=run, name="bitsai-stream", daemon=True).start()
+    while True:
+        kind, text = events.get()
+        yield kind, text
+        if kind == "done":
+            return
+
+def _generate_response(message: str, current_mode: Mode, memory: ChatMemory) -> str:
     final_response = ""
 
     try:
@@ -452,18 +1067,23 @@ def generate_response(message: str, current_mode: Mode) -> str:
             messages = memory.get_messages(system_instruction=system_prompt)
             messages.append(HumanMessage(content=message))
             
-            res = agent_general.invoke(messages)
+            res = llm_gateway.invoke(agent_general, messages, priority=Priority.INTERACTIVE)
             final_response = res.content
 
         # 2. 處理 Tools Mode
+        elif current_mode == Mode.TOOLS and (fast_answer := _traced_fast_path(message)) is not None:
+            print("⚡ Mode: TOOLS (Fast Path)")
+            final_response = fast_answer
+
         elif current_mode == Mode.TOOLS:
             print("🛠️ Mode: TOOLS (Auto-Retry Enabled)")
             
             # 準備初始訊息
             # 我們加入 TOOL_SYSTEM_PROMPT 讓它一開始就知道路徑規則
-            msgs = [SystemMessage(content=TOOL_SYSTEM_PROMPT)]
+            msgs = [SystemMessage(content=build_tool_system_prompt(message))]
             
             # 加入對話歷史摘要 (如果有的話)
+            memory.apply_summary()
             if memory.summary:
                 msgs.append(SystemMessage(content=f"Context Summary: {memory.summary}"))
             
@@ -477,7 +1097,7 @@ def generate_response(message: str, current_mode: Mode) -> str:
                 print(f"🔄 Attempt {attempt + 1}/{max_retries}")
                 
                 # 呼叫 Agent
-                res = agent_tools.invoke(msgs)
+                res = llm_gateway.invoke(agent_tools, msgs, priority=Priority.TOOL_PLANNING)
                 msgs.append(res) # 將 AI 的回應 (包含 Tool Call) 加入歷史
                 
                 calls = getattr(res, "tool_calls", [])
@@ -487,46 +1107,18 @@ def generate_response(message: str, current_mode: Mode) -> str:
                     final_response = res.content
                     break
                 
-                # 處理工具呼叫
-                call = calls[0] # 目前假設一次呼叫一個工具
-                name = call["name"]
-                args = call.get("args", call.get("arguments", {}))
-                
-                print(f"🔧 Invoking Tool: {name}")
-                
-                tool = TOOL_MAPPING.get(name)
-                tool_result = ""
-                
-                if not tool:
-                    tool_result = f"❌ Error: Tool '{name}' not found."
-                else:
-                    try:
-                        if tool.coroutine:
-                            tool_result = loop.run_until_complete(tool.coroutine(**args))
-                        else:
-                            tool_result = tool.invoke(args)
-                    except Exception as e:
-                        tool_result = f"❌ Error executing tool: {e}"
-
-                # 將工具結果轉為 ToolMessage 加入歷史
-                # 注意：LangChain 需要正確的 tool_call_id (這裡簡化處理，Ollama 通常不強制)
-                from langchain_core.messages import ToolMessage
-                tool_msg = ToolMessage(content=str(tool_result), tool_call_id=call.get("id", "call_default"))
-                msgs.append(tool_msg)
+                # 處理工具呼叫：同一輪的所有工具並行執行
+                tool_msgs = mcp_loop.run(execute_tool_calls(calls, tracing.current_trace()))
+                msgs.extend(tool_msgs)
+                tool_result = "\n".join(m.content for m in tool_msgs)
                 
                 # 🔍 判斷是否需要重試
-                # 檢查 bitsAI_tools.py 裡我們設下的 "SYSTEM HINT" 或常見錯誤關鍵字
-                result_lower = str(tool_result).lower()
-                is_error = (
-                    "system hint" in result_lower or 
-                    "error" in result_lower or 
-                    "exception" in result_lower or 
-                    "failed" in result_lower or
-                    "required property" in result_lower # 針對這次的錯誤
-                )
+                # 只看工具回報的結構化錯誤類型，資料內容剛好含有 "error" 等字樣不會誤判
+                error_kinds = {m.artifact["error_kind"] for m in tool_msgs if m.status == "error"}
+                is_error = any(ToolErrorKind(k) in RETRYABLE_ERROR_KINDS for k in error_kinds)
                 
                 if is_error and attempt < max_retries - 1:
-                    print(f"⚠️ Detected Error in Tool Output. Retrying... \nError snippet: {str(tool_result)[:100]}...")
+                    print(f"⚠️ Detected {sorted(error_kinds)} in Tool Output. Retrying... \nError snippet: {tool_result[:100]}...")
                     continue
                 else:
                     # 成功，或者重試次數用盡 -> 生成最終回覆給使用者
@@ -541,8 +1133,16 @@ def generate_response(message: str, current_mode: Mode) -> str:
                     
                     msgs.append(HumanMessage(content=final_prompt))
                     
-                    final_res = agent_general.invoke(msgs)
+                    final_res = llm_gateway.invoke(agent_general, msgs, priority=Priority.INTERACTIVE)
                     final_response = final_res.content
+
+                    # 附上完整結果的落地檔，讓 UI 可以提供下載連結
+                    spills = []
+                    for m in msgs:
+                        if isinstance(m, ToolMessage):
+                            spills.extend(p for p in find_spill_paths(m.content) if p not in spills)
+                    if spills:
+                        final_response += "\n\n" + "\n".join(f"{SPILL_MARKER}{p}" for p in spills)
                     break
 
         # 3. 處理 Normal Mode
@@ -552,7 +1152,7 @@ def generate_response(message: str, current_mode: Mode) -> str:
             messages = memory.get_messages(system_instruction=system_prompt)
             messages.append(HumanMessage(content=message))
             
-            res = agent_general.invoke(messages)
+            res = llm_gateway.invoke(agent_general, messages, priority=Priority.INTERACTIVE)
             final_response = res.content
 
         final_response = final_response.strip()
@@ -561,6 +1161,10 @@ def generate_response(message: str, current_mode: Mode) -> str:
 
         return final_response
 
+    except LLMBusyError as e:
+        print(f"🚦 LLM busy: {e}")
+        return BUSY_MESSAGE
+
     except Exception as e:
         error_msg = f"❌ Error: {e}"
         print(error_msg)
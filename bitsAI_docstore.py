@@ -0,0 +1,280 @@
+import os
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict, Counter
+from datetime import datetime
+
+# ============================================================
+# ⚙️ 文件登錄表設定
+# ============================================================
+# 每份上傳的文件一列；chunk 的 payload 只存 doc_ids (整數 list)，
+# title / source / type / subtype / 上傳時間 查詢時再透過快取 join 回來
+REGISTRY_PATH = os.getenv("BITSAI_DOC_REGISTRY", "doc_registry.sqlite")
+CACHE_SIZE = 4096            # 快取幾份文件的 metadata
+META_FIELDS = ("title", "source", "type", "subtype", "timestamp")
+EDITABLE_FIELDS = ("title", "source", "type", "subtype")
+LEGACY_HASH_PREFIX = "legacy:"   # migrate 從舊 payload 建立的文件沒有原始內容 hash
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id       INTEGER PRIMARY KEY,
+    source       TEXT NOT NULL,
+    title        TEXT NOT NULL DEFAULT '',
+    type         TEXT NOT NULL DEFAULT 'other',
+    subtype      TEXT NOT NULL DEFAULT '',
+    content_hash TEXT NOT NULL,
+    ingested_at  TEXT NOT NULL,
+    UNIQUE (source, content_hash)
+);
+CREATE INDEX IF NOT EXISTS documents_type ON documents (type);
+CREATE INDEX IF NOT EXISTS documents_source ON documents (source);
+"""
+
+_COLUMNS = "doc_id, source, title, type, subtype, content_hash, ingested_at"
+
+def _row_to_doc(row) -> dict:
+    doc_id, source, title, type_, subtype, content_hash, ingested_at = row
+    return {"doc_id": doc_id, "source": source, "title": title, "type": type_, "subtype": subtype,
+            "content_hash": content_hash, "timestamp": ingested_at}
+
+# ============================================================
+# 🗂️ Document Registry (SQLite，多個 API worker 共用同一個檔案)
+# ============================================================
+class DocumentRegistry:
+    """
+    - register() 同一個 (source, 內容 hash) 只會有一列，重複上傳沿用同一個 doc_id
+    - get_many() 先查 LRU 快取；其他行程寫入時 PRAGMA data_version 會變，快取整個作廢
+    """
+
+    def __init__(self, path: str = REGISTRY_PATH, cache_size: int = CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[int, dict]" = OrderedDict()
+        self._data_version = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def register(self, source: str, title: str, doc_type: str, subtype: str, content_hash: str,
+                 ingested_at: str = None) -> int:
+        now = ingested_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock, self._conn:
+            doc_id = self._conn.execute(
+                f"INSERT INTO documents (source, title, type, subtype, content_hash, ingested_at) "
+                f"VALUES (?, ?, ?, ?, ?, ?) "
+                f"ON CONFLICT (source, content_hash) DO UPDATE SET "
+                f"title = excluded.title, type = excluded.type, subtype = excluded.subtype, "
+                f"ingested_at = excluded.ingested_at "
+                f"RETURNING doc_id",
+                (source, title, doc_type, subtype, content_hash, now),
+            ).fetchone()[0]
+            self._cache.pop(doc_id, None)
+        return doc_id
+
+    def update(self, doc_ids, **fields) -> int:
+        """修改文件欄位 (EDITABLE_FIELDS)；只改一列，所有引用這份文件的 chunk 立即生效"""
+        fields = {k: v for k, v in fields.items() if k in EDITABLE_FIELDS}
+        doc_ids = list(doc_ids)
+        if not fields or not doc_ids:
+            return 0
+        sets = ", ".join(f"{k} = ?" for k in fields)
+        marks = ",".join("?" * len(doc_ids))
+        try:
+            with self._lock, self._conn:
+                updated = self._conn.execute(f"UPDATE documents SET {sets} WHERE doc_id IN ({marks})",
+                                             [*fields.values(), *doc_ids]).rowcount
+                for doc_id in doc_ids:
+                    self._cache.pop(doc_id, None)
+        except sqlite3.IntegrityError:
+            # (source, 內容 hash) 唯一：改成的來源已經有一份內容相同的文件
+            raise ValueError(f"來源 '{fields.get('source')}' 已有內容相同的文件，"
+                             f"不能把 doc_id {doc_ids} 改成同一個來源 (請改用其他名稱或刪除重複的文件)") from None
+        return updated
+
+    def delete(self, doc_ids) -> int:
+        """刪除文件列 (呼叫端需先確認已沒有 chunk 引用)"""
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return 0
+        marks = ",".join("?" * len(doc_ids))
+        with self._lock, self._conn:
+            deleted = self._conn.execute(f"DELETE FROM documents WHERE doc_id IN ({marks})", doc_ids).rowcount
+            for doc_id in doc_ids:
+                self._cache.pop(doc_id, None)
+        return deleted
+
+    def _check_version(self):
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._cache.clear()
+            self._data_version = version
+
+    def get_many(self, doc_ids) -> dict:
+        """{doc_id: 文件 dict}；找不到的 id 不會出現在結果裡"""
+        with self._lock:
+            self._check_version()
+            found, missing = {}, []
+            for doc_id in dict.fromkeys(doc_ids):
+                doc = self._cache.get(doc_id)
+                if doc is None:
+                    missing.append(doc_id)
+                else:
+                    self._cache.move_to_end(doc_id)
+                    found[doc_id] = doc
+            if missing:
+                marks = ",".join("?" * len(missing))
+                for row in self._conn.execute(f"SELECT {_COLUMNS} FROM documents WHERE doc_id IN ({marks})", missing):
+                    doc = found[row[0]] = _row_to_doc(row)
+                    self._cache[row[0]] = doc
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return found
+
+    def ids_matching(self, source: str = None, doc_type: str = None, subtype: str = None,
+                     title: str = None, ingested_from: str = None, ingested_to: str = None) -> list[int]:
+        """精確比對 (上傳時間為範圍)，給 Qdrant 的 doc_ids MatchAny 過濾用"""
+        where, args = [], []
+        for column, value in (("source", source), ("type", doc_type), ("subtype", subtype), ("title", title)):
+            if value:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if ingested_from:
+            where.append("ingested_at >= ?")
+            args.append(ingested_from)
+        if ingested_to:
+            where.append("ingested_at <= ?")
+            args.append(ingested_to)
+        sql = "SELECT doc_id FROM documents" + (" WHERE " + " AND ".join(where) if where else "")
+        with self._lock:
+            return [r[0] for r in self._conn.execute(sql, args)]
+
+    def search(self, text: str) -> list[int]:
+        """管理介面的關鍵字搜尋：標題包含 text，或來源 / subtype / type 完全相同"""
+        with self._lock:
+            return [r[0] for r in self._conn.execute(
+                "SELECT doc_id FROM documents WHERE title LIKE ? OR source = ? OR subtype = ? OR type = ?",
+                (f"%{text}%", text, text, text.lower()))]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def resolve(self, payload: dict) -> dict:
+        """
+        chunk payload → 完整 metadata。
+        有 doc_ids 時 source / title 等取自第一份文件，sources 列出所有共用這段內容的檔案；
+        payload 上直接設定的欄位 (例如管理介面手動修改) 優先。沒有 doc_ids 的舊資料原樣回傳
+        """
+        payload = payload or {}
+        doc_ids = payload.get("doc_ids")
+        if not doc_ids:
+            return payload
+        docs = [d for d in map(self.get_many(doc_ids).get, doc_ids) if d]
+        meta = {k: docs[0][k] for k in META_FIELDS} if docs else {}
+        meta["sources"] = list(dict.fromkeys(d["source"] for d in docs))
+        meta.update(payload)
+        return meta
+
+    def facet(self, doc_counts: dict, field: str) -> Counter:
+        """{doc_id: chunk 數} (Qdrant facet on doc_ids) 依文件欄位加總"""
+        docs = self.get_many(doc_counts)
+        counts = Counter()
+        for doc_id, n in doc_counts.items():
+            if doc_id in docs:
+                counts[docs[doc_id][field]] += n
+        return counts
+
+
+registry = DocumentRegistry()
+
+def referenced_doc_ids(client, doc_ids) -> set:
+    """仍被任何 collection 的 chunk 引用的 doc_id (登錄表由所有 collection 共用，包含 alias 切換前保留的舊 collection)"""
+    from qdrant_client.http import models
+
+    doc_ids = list(doc_ids)
+    referenced = set()
+    if not doc_ids:
+        return referenced
+    doc_filter = models.Filter(must=[models.FieldCondition(key="doc_ids", match=models.MatchAny(any=doc_ids))])
+    for c in client.get_collections().collections:
+        offset = None
+        while True:
+            records, offset = client.scroll(collection_name=c.name, scroll_filter=doc_filter, limit=MIGRATE_BATCH,
+                                            offset=offset, with_payload=["doc_ids"], with_vectors=False)
+            for r in records:
+                referenced.update((r.payload or {}).get("doc_ids") or ())
+            if offset is None:
+                break
+    return referenced & set(doc_ids)
+
+def discard_unused(client, doc_ids) -> int:
+    """刪掉沒有任何 chunk 引用的文件列 (ingest 失敗、批次刪除後)，回傳刪除列數"""
+    doc_ids = set(doc_ids)
+    return registry.delete(doc_ids - referenced_doc_ids(client, doc_ids))
+
+# ============================================================
+# 🔁 舊 payload 遷移 (每個 chunk 自帶 title / source / ... → doc_ids)
+# ============================================================
+MIGRATE_BATCH = 256
+
+def legacy_doc_id(payload: dict) -> int:
+    """舊格式 chunk 的 metadata 登錄成文件 (同一個來源檔共用一列)"""
+    source = payload.get("source") or "unknown"
+    return registry.register(source, payload.get("title") or source, payload.get("type") or "other",
+                             payload.get("subtype") or "", LEGACY_HASH_PREFIX + source,
+                             ingested_at=payload.get("timestamp"))
+
+def slim_payload(payload: dict, doc_ids: list) -> dict:
+    """去掉已移到登錄表的欄位，只留 doc_ids、chunk 內文與 chunk_id / page 等 chunk 本身的資訊"""
+    slim = {k: v for k, v in payload.items() if k not in META_FIELDS and k != "hash"}
+    slim["doc_ids"] = doc_ids
+    return slim
+
+def migrate_collection(client, collection_name: str, progress=None) -> dict:
+    """把沒有 doc_ids 的 chunk 依 (source, title, type, subtype) 登錄成文件，payload 改成只存 doc_ids"""
+    from qdrant_client.http import models
+
+    migrated = skipped = 0
+    offset = None
+    by_source = {}  # 同一個來源檔只登錄一次
+    while True:
+        records, offset = client.scroll(collection_name=collection_name, limit=MIGRATE_BATCH, offset=offset,
+                                        with_payload=True, with_vectors=False)
+        ops = []
+        for r in records:
+            payload = r.payload or {}
+            if "doc_ids" in payload:
+                skipped += 1
+                continue
+            source = payload.get("source") or "unknown"
+            if source not in by_source:
+                by_source[source] = legacy_doc_id(payload)
+            ops.append(models.OverwritePayloadOperation(
+                overwrite_payload=models.SetPayload(payload=slim_payload(payload, [by_source[source]]),
+                                                    points=[r.id])))
+        if ops:
+            client.batch_update_points(collection_name=collection_name, update_operations=ops)
+            migrated += len(ops)
+        if progress:
+            progress(migrated + skipped)
+        if offset is None:
+            break
+    return {"migrated": migrated, "already_normalized": skipped, "documents": registry.count()}
+
+
+if __name__ == "__main__":
+    import bitsAI_qdrant_client as qdrant_conn
+
+    parser = argparse.ArgumentParser(description="BITS-AI 文件登錄表：把舊 chunk payload 遷移成 doc_ids")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--collection", default=qdrant_conn.COLLECTION_NAME)
+    parser.add_argument("--path", default=qdrant_conn.QDRANT_PATH, help="本地 Qdrant 資料夾 (預設 qdrant_db)")
+    parser.add_argument("--url", default=None, help="Qdrant server 網址 (預設 BITSAI_QDRANT_URL，設定後忽略 --path)")
+    args = parser.parse_args()
+
+    client = qdrant_conn.make_client(args.url, args.path)
+    result = migrate_collection(client, args.collection, progress=lambda n: print(f"\r🔁 {n} chunks", end=""))
+    print(f"\n✅ 遷移 {result['migrated']} 筆，已是新格式 {result['already_normalized']} 筆，"
+          f"登錄表共 {result['documents']} 份文件 ({REGISTRY_PATH})")
@@ -0,0 +1,279 @@
+import os
+import time
+import threading
+from collections import deque
+
+import psutil
+import pynvml
+
+# ============================================================
+# ⚙️ 取樣設定
+# ============================================================
+SAMPLE_INTERVAL = float(os.getenv("BITSAI_METRICS_INTERVAL", "5"))   # 取樣間隔 (秒)
+HISTORY_SECONDS = 3600                                                # ring buffer 保留時間
+FIRST_SAMPLE_WINDOW = 1.0                                             # 第一筆 CPU% 的量測區間 (秒)
+TOP_PROCESSES = 5                                                     # 每次取樣保留的前幾名行程
+SCRIPT_MARKERS = ['.py', '.sh', '.r', '.pl', '.ipynb', 'python', 'node']
+
+# ============================================================
+# 🔌 取樣來源 (Backend)
+# ============================================================
+class PsutilBackend:
+    """
+    實際的系統指標來源。
+    - CPU% 以「距離上次取樣」計算，prime() 建立基準點後才有意義
+    - 行程物件跨取樣保留，per-process cpu_percent 才不會永遠是 0.0
+    - NVML 只初始化一次並保留 handle，不再每次呼叫都啟動 nvidia-smi
+    """
+
+    def __init__(self, disk_path: str = "/"):
+        self.disk_path = disk_path
+        self._procs = {}
+        self._gpu_handles = []
+        try:
+            pynvml.nvmlInit()
+            self._gpu_handles = [pynvml.nvmlDeviceGetHandleByIndex(i)
+                                 for i in range(pynvml.nvmlDeviceGetCount())]
+        except Exception:
+            self._gpu_handles = []
+
+    def prime(self):
+        """建立 CPU% 基準點 (系統與各行程)，之後的取樣才是這段區間的平均"""
+        psutil.cpu_percent(interval=None)
+        self.processes()
+
+    @property
+    def has_gpu(self) -> bool:
+        return bool(self._gpu_handles)
+
+    def cpu_count(self) -> int:
+        return psutil.cpu_count()
+
+    def system(self) -> dict:
+        mem = psutil.virtual_memory()
+        disk = psutil.disk_usage(self.disk_path)
+        return {
+            "cpu": psutil.cpu_percent(interval=None),
+            "ram_used": mem.used, "ram_total": mem.total, "ram_pct": mem.percent,
+            "disk_used": disk.used, "disk_total": disk.total, "disk_pct": disk.percent,
+        }
+
+    def gpus(self) -> list[dict]:
+        result = []
+        for i, h in enumerate(self._gpu_handles):
+            try:
+                name = pynvml.nvmlDeviceGetName(h)
+                util = pynvml.nvmlDeviceGetUtilizationRates(h)
+                mem = pynvml.nvmlDeviceGetMemoryInfo(h)
+                temp = pynvml.nvmlDeviceGetTemperature(h, pynvml.NVML_TEMPERATURE_GPU)
+                result.append({
+                    "id": i, "name": name.decode() if isinstance(name, bytes) else name,
+                    "load": float(util.gpu), "mem_used": mem.used, "mem_total": mem.total, "temp": temp,
+                })
+            except Exception:
+                continue
+        return result
+
+    def gpu_processes(self) -> dict:
+        """{pid: (gpu_id, used_bytes)}"""
+        found = {}
+        for i, h in enumerate(self._gpu_handles):
+            try:
+                for p in pynvml.nvmlDeviceGetComputeRunningProcesses(h):
+                    found[p.pid] = (i, p.usedGpuMemory or 0)
+            except Exception:
+                continue
+        return found
+
+    def processes(self) -> list[dict]:
+        alive = {}
+        rows = []
+        for proc in psutil.process_iter(['pid', 'name', 'username', 'memory_info', 'cmdline']):
+            info = proc.info
+            pid = info['pid']
+            # 沿用上次的 Process 物件，cpu_percent 才是兩次取樣之間的平均
+            tracked = self._procs.get(pid, proc)
+            try:
+                cpu = tracked.cpu_percent(interval=None)
+                cmdline = " ".join(info['cmdline']) if info.get('cmdline') else ""
+                rows.append({
+                    'pid': pid,
+                    'user': info.get('username'),
+                    'name': info.get('name'),
+                    'cpu': cpu,
+                    'mem': info['memory_info'].rss if info.get('memory_info') else 0,
+                    'script': cmdline if any(ext in cmdline.lower() for ext in SCRIPT_MARKERS) else None,
+                })
+                alive[pid] = tracked
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                continue
+        self._procs = alive
+        return rows
+
+
+class StubBackend:
+    """固定數值的假來源，測試與沒有 GPU 的環境使用"""
+
+    def __init__(self, cpu: float = 10.0, ram_pct: float = 50.0, disk_pct: float = 40.0, gpus=None, processes=None):
+        self.cpu, self.ram_pct, self.disk_pct = cpu, ram_pct, disk_pct
+        self._gpus = gpus or []
+        self._processes = processes or []
+
+    @property
+    def has_gpu(self) -> bool:
+        return bool(self._gpus)
+
+    def cpu_count(self) -> int:
+        return 4
+
+    def system(self) -> dict:
+        total = 16 * 1024 ** 3
+        return {
+            "cpu": self.cpu,
+            "ram_used": total * self.ram_pct / 100, "ram_total": total, "ram_pct": self.ram_pct,
+            "disk_used": 10 * total * self.disk_pct / 100, "disk_total": 10 * total, "disk_pct": self.disk_pct,
+        }
+
+    def gpus(self) -> list[dict]:
+        return list(self._gpus)
+
+    def gpu_processes(self) -> dict:
+        return {}
+
+    def processes(self) -> list[dict]:
+        return list(self._processes)
+
+# ============================================================
+# 🧵 背景取樣執行緒 + Ring Buffer
+# ============================================================
+class MetricsSampler:
+    """固定間隔取樣，歷史存在固定長度的 deque；工具查詢時直接讀取，不再即時量測"""
+
+    def __init__(self, backend=None, interval: float = SAMPLE_INTERVAL, history_seconds: float = HISTORY_SECONDS):
+        self.backend = backend if backend is not None else PsutilBackend()
+        self.interval = interval
+        self.history = deque(maxlen=max(1, int(history_seconds / interval)))
+        self.latest_processes = {"top_cpu": [], "top_mem": [], "top_gpu": []}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._first_sample = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="bitsai-metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+
+    def _prime(self):
+        prime = getattr(self.backend, "prime", None)
+        if prime:
+            prime()
+        return prime is not None
+
+    def _loop(self):
+        # 剛建立基準點時 CPU% 的區間幾乎是 0，第一筆等 FIRST_SAMPLE_WINDOW 之後才記錄
+        try:
+            self._prime()
+        except Exception as e:
+            print(f"⚠️ [Metrics] prime failed: {e}")
+        delay = min(self.interval, FIRST_SAMPLE_WINDOW)
+        while not self._stop.wait(delay):
+            try:
+                self.sample_once()
+            except Exception as e:
+                print(f"⚠️ [Metrics] sample failed: {e}")
+            delay = self.interval
+
+    def sample_once(self) -> dict:
+        sample = {"ts": time.time(), **self.backend.system(), "gpus": self.backend.gpus()}
+
+        procs = self.backend.processes()
+        gpu_procs = self.backend.gpu_processes()
+        for p in procs:
+            gpu_id, gpu_mem = gpu_procs.get(p['pid'], (None, 0))   # dict 查表，O(n + m)
+            p['gpu_id'], p['gpu_mem'] = gpu_id, gpu_mem
+        top = {
+            "top_cpu": sorted(procs, key=lambda x: x['cpu'], reverse=True)[:TOP_PROCESSES],
+            "top_mem": sorted(procs, key=lambda x: x['mem'], reverse=True)[:TOP_PROCESSES],
+            "top_gpu": sorted([p for p in procs if p['gpu_mem'] > 0],
+                              key=lambda x: x['gpu_mem'], reverse=True)[:TOP_PROCESSES],
+        }
+
+        with self._lock:
+            self.history.append(sample)
+            self.latest_processes = top
+        self._first_sample.set()
+        return sample
+
+    def latest(self) -> dict:
+        """最新一筆；剛啟動還沒有資料時等第一筆 (不回傳區間近乎 0 的讀數)"""
+        if self._thread and self._thread.is_alive():
+            self._first_sample.wait(FIRST_SAMPLE_WINDOW + 1)
+        with self._lock:
+            if self.history:
+                return self.history[-1]
+        if self._prime():
+            time.sleep(FIRST_SAMPLE_WINDOW)
+        return self.sample_once()
+
+    def top_processes(self) -> dict:
+        self.latest()
+        with self._lock:
+            return self.latest_processes
+
+    def window(self, seconds: float) -> list[dict]:
+        cutoff = time.time() - seconds
+        with self._lock:
+            return [s for s in self.history if s["ts"] >= cutoff]
+
+    def summary(self, seconds: float) -> dict:
+        """指定時間窗內 CPU / RAM / Disk / GPU 的平均、最大、最小值"""
+        samples = self.window(seconds)
+        if not samples:
+            samples = [self.latest()]
+
+        def stats(values):
+            return {"avg": sum(values) / len(values), "max": max(values), "min": min(values)}
+
+        result = {
+            "samples": len(samples),
+            "span": samples[-1]["ts"] - samples[0]["ts"],
+            "cpu": stats([s["cpu"] for s in samples]),
+            "ram_pct": stats([s["ram_pct"] for s in samples]),
+            "disk_pct": stats([s["disk_pct"] for s in samples]),
+            "gpus": {},
+        }
+        gpu_ids = {g["id"] for s in samples for g in s["gpus"]}
+        for gid in sorted(gpu_ids):
+            loads = [g["load"] for s in samples for g in s["gpus"] if g["id"] == gid]
+            temps = [g["temp"] for s in samples for g in s["gpus"] if g["id"] == gid]
+            result["gpus"][gid] = {"load": stats(loads), "temp": stats(temps)}
+        return result
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+def get_sampler() -> MetricsSampler:
+    """全域 sampler，第一次使用時才啟動"""
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = MetricsSampler().start()
+        return _sampler
+
+def set_sampler(sampler: MetricsSampler):
+    """替換全域 sampler (例如測試時換成 StubBackend)"""
+    global _sampler
+    with _sampler_lock:
+        if _sampler is not None and _sampler is not sampler:
+            _sampler.stop()
+        _sampler = sampler
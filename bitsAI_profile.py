@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+import cProfile
+import threading
+import functools
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+# ============================================================
+# ⚙️ Profiling 設定
+# ============================================================
+PROFILE_DIR = os.getenv("BITSAI_PROFILE_DIR", "profiles")
+PROFILE_NEXT = int(os.getenv("BITSAI_PROFILE_NEXT", "0"))        # 啟動時就分析接下來 N 個請求
+PROFILE_MODE = os.getenv("BITSAI_PROFILE_MODE", "sample")        # sample (取樣) / cprofile (逐函式)
+SAMPLE_INTERVAL = 0.005      # 取樣間隔 (秒)
+TRACEMALLOC_FRAMES = 10      # tracemalloc 保留的 stack 深度
+TRACEMALLOC_TOP = 30         # 報告列出的前幾個配置位置
+
+PROFILE_MODES = ("sample", "cprofile")
+
+# ============================================================
+# 🎛️ 開關 (關閉時 profiled() 只多一次整數比較)
+# ============================================================
+_lock = threading.Lock()
+_remaining = PROFILE_NEXT
+_mode = PROFILE_MODE if PROFILE_MODE in PROFILE_MODES else "sample"
+_in_flight = 0               # 正在分析中的請求數
+_tracemalloc_owned = False   # tracemalloc 是否由這裡開啟 (PYTHONTRACEMALLOC 開的不關)
+
+def _sync_tracemalloc():
+    """
+    有名額或有請求正在分析時開著 tracemalloc，兩者都歸零才關閉 (呼叫端持有 _lock)。
+    每個請求只取前後 snapshot，重疊的請求不會被別人的 stop() 截斷
+    """
+    global _tracemalloc_owned
+    if _remaining > 0 or _in_flight > 0:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _tracemalloc_owned = True
+    elif _tracemalloc_owned:
+        tracemalloc.stop()
+        _tracemalloc_owned = False
+
+with _lock:
+    _sync_tracemalloc()   # BITSAI_PROFILE_NEXT 啟動時就開
+
+def arm(count: int, mode: str = "sample") -> dict:
+    """分析接下來 count 個請求 (不需重啟)"""
+    global _remaining, _mode
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"mode must be one of {PROFILE_MODES}")
+    with _lock:
+        _remaining, _mode = max(int(count), 0), mode
+        _sync_tracemalloc()
+    print(f"🔬 [Profile] next {_remaining} requests ({_mode}) → {os.path.abspath(PROFILE_DIR)}")
+    return status()
+
+def disarm() -> dict:
+    return arm(0, _mode)
+
+def status() -> dict:
+    return {"remaining": _remaining, "in_flight": _in_flight, "mode": _mode,
+            "tracemalloc": tracemalloc.is_tracing(), "dir": os.path.abspath(PROFILE_DIR)}
+
+def http_control(params: dict) -> dict:
+    """metrics endpoint 用：/profile?next=5&mode=cprofile 開啟，/profile?next=0 關閉，/profile 查狀態"""
+    if "next" in params:
+        return arm(int(params["next"]), params.get("mode", _mode))
+    return status()
+
+def _claim():
+    """取得一個名額；回傳使用的模式或 None"""
+    global _remaining, _in_flight
+    with _lock:
+        if _remaining <= 0:
+            return None
+        _remaining -= 1
+        _in_flight += 1
+        return _mode
+
+# ============================================================
+# 🔥 取樣式 profiler (輸出 collapsed stacks，可直接給 flamegraph.pl / speedscope)
+# ============================================================
+class StackSampler(threading.Thread):
+    """定期讀取目標執行緒的 frame，累計 'a;b;c' 形式的 stack 次數"""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        super().__init__(name="bitsai-profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+# ============================================================
+# 🧠 tracemalloc
+# ============================================================
+def _start_tracemalloc():
+    return tracemalloc.take_snapshot()
+
+def _stop_tracemalloc(before, prefix: str):
+    """寫出這個請求的 snapshot 與前後差異，並釋放 _claim() 佔用的進行中計數"""
+    global _in_flight
+    try:
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        after.dump(prefix + ".tracemalloc")
+        with open(prefix + ".tracemalloc.txt", "w", encoding="utf-8") as f:
+            f.write(f"traced current={current / 1e6:.2f} MB peak={peak / 1e6:.2f} MB (since profiling was armed)\n")
+            f.write("tracemalloc is process-wide: the growth below also includes other threads running at the same time\n\n")
+            f.write(f"Top {TRACEMALLOC_TOP} allocation growth during the request:\n")
+            for stat in after.compare_to(before, "lineno")[:TRACEMALLOC_TOP]:
+                f.write(f"{stat}\n")
+    finally:
+        with _lock:
+            _in_flight -= 1
+            _sync_tracemalloc()
+
+# ============================================================
+# 🎯 Decorator
+# ============================================================
+def _run_profiled(kind: str, mode: str, func, args, kwargs):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    prefix = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{kind}")
+    before = _start_tracemalloc()
+    start = time.perf_counter()
+
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            profiler.dump_stats(prefix + ".pstats")
+            _stop_tracemalloc(before, prefix)
+            print(f"🔬 [Profile] {kind} {time.perf_counter() - start:.2f}s → {prefix}.pstats")
+
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        sampler.stop()
+        sampler.write(prefix + ".collapsed")
+        _stop_tracemalloc(before, prefix)
+        print(f"🔬 [Profile] {kind} {time.perf_counter() - start:.2f}s → {prefix}.collapsed")
+
+def profiled(kind: str):
+    """包住請求入口；有名額時才進入 profiler，否則直接呼叫原函式"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _remaining <= 0:
+                return func(*args, **kwargs)
+            mode = _claim()
+            if mode is None:
+                return func(*args, **kwargs)
+            return _run_profiled(kind, mode, func, args, kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,328 @@
+import os
+import json
+import time
+import argparse
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from qdrant_client.http import models
+
+import bitsAI_qdrant_client as qdrant_conn
+import bitsAI_docstore as docstore
+
+# ============================================================
+# ⚙️ 匯出 / 匯入設定
+# ============================================================
+QDRANT_PATH = qdrant_conn.QDRANT_PATH
+COLLECTION_NAME = qdrant_conn.COLLECTION_NAME
+BATCH_SIZE = 256              # 每次 scroll / upsert 的筆數，也是 Parquet row group 大小
+FORMAT_VERSION = 2            # 2：檔尾 metadata 附上 chunk 引用的文件登錄表資料列
+DOCUMENTS_KEY = "bitsai_documents"
+
+# 欄位命名：dense::<向量名稱>、sparse::<向量名稱>::indices / ::values
+# 沒有名稱的單一向量用空字串 (dense::)
+DENSE_PREFIX = "dense::"
+SPARSE_PREFIX = "sparse::"
+
+# ============================================================
+# 🧱 Schema 與轉換
+# ============================================================
+def _vector_layout(client, collection_name):
+    """回傳 (dense 向量名稱列表, sparse 向量名稱列表, 可寫進檔案的 collection 設定)"""
+    params = client.get_collection(collection_name).config.params
+    vectors = params.vectors
+    if isinstance(vectors, models.VectorParams):
+        dense_names = [""]
+        dense_config = {"": vectors.model_dump(mode="json", exclude_none=True)}
+    else:
+        dense_names = sorted(vectors or {})
+        dense_config = {k: v.model_dump(mode="json", exclude_none=True) for k, v in (vectors or {}).items()}
+    sparse = params.sparse_vectors or {}
+    sparse_names = sorted(sparse)
+    config = {
+        "format_version": FORMAT_VERSION,
+        "collection": collection_name,
+        "vectors": dense_config,
+        "sparse_vectors": {k: v.model_dump(mode="json", exclude_none=True) for k, v in sparse.items()},
+    }
+    return dense_names, sparse_names, config
+
+def _build_schema(dense_names, sparse_names, config):
+    fields = [
+        pa.field("id", pa.string()),
+        pa.field("id_is_int", pa.bool_()),
+        pa.field("payload", pa.string()),
+    ]
+    for name in dense_names:
+        fields.append(pa.field(DENSE_PREFIX + name, pa.list_(pa.float32())))
+    for name in sparse_names:
+        fields.append(pa.field(f"{SPARSE_PREFIX}{name}::indices", pa.list_(pa.uint32())))
+        fields.append(pa.field(f"{SPARSE_PREFIX}{name}::values", pa.list_(pa.float32())))
+    return pa.schema(fields, metadata={"bitsai_qdrant": json.dumps(config)})
+
+def _records_to_batch(records, schema, dense_names, sparse_names):
+    columns = {f.name: [] for f in schema}
+    for r in records:
+        columns["id"].append(str(r.id))
+        columns["id_is_int"].append(isinstance(r.id, int))
+        columns["payload"].append(json.dumps(r.payload or {}, ensure_ascii=False))
+
+        vectors = r.vector if isinstance(r.vector, dict) else {"": r.vector}
+        for name in dense_names:
+            columns[DENSE_PREFIX + name].append(vectors.get(name))
+        for name in sparse_names:
+            sv = vectors.get(name)
+            columns[f"{SPARSE_PREFIX}{name}::indices"].append(sv.indices if sv else None)
+            columns[f"{SPARSE_PREFIX}{name}::values"].append(sv.values if sv else None)
+    return pa.RecordBatch.from_pydict(columns, schema=schema)
+
+def _remap_doc_ids(payload: dict, id_map: dict) -> dict:
+    """備份檔的 doc_id → 匯入端登錄表的 doc_id (不在備份文件裡的 id 原樣保留)"""
+    if id_map and payload.get("doc_ids"):
+        payload["doc_ids"] = list(dict.fromkeys(id_map.get(i, i) for i in payload["doc_ids"]))
+    return payload
+
+def _rows_to_points(batch: pa.RecordBatch, dense_names, sparse_names, id_map=None):
+    data = batch.to_pydict()
+    points = []
+    for i, raw_id in enumerate(data["id"]):
+        vector = {}
+        for name in dense_names:
+            values = data[DENSE_PREFIX + name][i]
+            if values is not None:
+                vector[name] = values
+        for name in sparse_names:
+            indices = data[f"{SPARSE_PREFIX}{name}::indices"][i]
+            if indices is not None:
+                vector[name] = models.SparseVector(indices=indices, values=data[f"{SPARSE_PREFIX}{name}::values"][i])
+        if list(vector) == [""]:
+            vector = vector[""]
+        points.append(models.PointStruct(
+            id=int(raw_id) if data["id_is_int"][i] else raw_id,
+            payload=_remap_doc_ids(json.loads(data["payload"][i]), id_map),
+            vector=vector,
+        ))
+    return points
+
+# ============================================================
+# 📤 匯出 (scroll → Parquet，一次只保留一批在記憶體)
+# ============================================================
+def export_collection(client, collection_name, out_path, batch_size=BATCH_SIZE, progress=None):
+    """
+    串流匯出 payload + dense / sparse 向量，回傳匯出筆數。
+    chunk 的 payload 只有 doc_ids，所以匯出時一併把引用到的文件登錄表資料列寫進檔尾 metadata
+    """
+    dense_names, sparse_names, config = _vector_layout(client, collection_name)
+    config["points_count"] = client.count(collection_name=collection_name, exact=False).count
+    config["exported_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    schema = _build_schema(dense_names, sparse_names, config)
+
+    tmp_path = out_path + ".tmp"
+    exported = 0
+    offset = None
+    doc_ids = set()
+    with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+        while True:
+            records, offset = client.scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
+            )
+            if records:
+                writer.write_batch(_records_to_batch(records, schema, dense_names, sparse_names))
+                for r in records:
+                    doc_ids.update((r.payload or {}).get("doc_ids") or ())
+                exported += len(records)
+                if progress:
+                    progress(exported, config["points_count"])
+            if offset is None:
+                break
+        documents = list(docstore.registry.get_many(sorted(doc_ids)).values())
+        writer.add_key_value_metadata({DOCUMENTS_KEY: json.dumps(documents, ensure_ascii=False)})
+    os.replace(tmp_path, out_path)
+    missing = len(doc_ids) - len(documents)
+    print(f"📤 [Backup] {collection_name}: {exported} points, {len(documents)} documents → {out_path}"
+          + (f" (⚠️ {missing} 個 doc_id 不在登錄表)" if missing else ""))
+    return exported
+
+# ============================================================
+# 📥 匯入 (Parquet row group → 批次 upsert)
+# ============================================================
+def read_backup_info(in_path) -> dict:
+    """讀取備份檔內的 collection 設定 (不讀資料)"""
+    metadata = pq.ParquetFile(in_path).schema_arrow.metadata or {}
+    raw = metadata.get(b"bitsai_qdrant")
+    if raw is None:
+        raise ValueError(f"{in_path} 不是 BITS-AI 的 Qdrant 備份檔")
+    return json.loads(raw)
+
+def read_backup_documents(in_path) -> list[dict]:
+    """備份檔附帶的文件登錄表資料列；舊版 (format 1) 備份沒有，回傳空 list"""
+    raw = (pq.ParquetFile(in_path).metadata.metadata or {}).get(DOCUMENTS_KEY.encode())
+    return json.loads(raw) if raw else []
+
+def register_documents(documents) -> dict:
+    """把備份內的文件登錄到本機登錄表 (同一個 source + 內容 hash 沿用既有列)，回傳 {備份 doc_id: 本機 doc_id}"""
+    return {
+        d["doc_id"]: docstore.registry.register(d["source"], d["title"], d["type"], d["subtype"],
+                                                d["content_hash"], ingested_at=d["timestamp"])
+        for d in documents
+    }
+
+def _create_collection(client, collection_name, config):
+    vectors = config["vectors"]
+    if list(vectors) == [""]:
+        vectors_config = models.VectorParams.model_validate(vectors[""])
+    else:
+        vectors_config = {k: models.VectorParams.model_validate(v) for k, v in vectors.items()}
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=vectors_config,
+        sparse_vectors_config={k: models.SparseVectorParams.model_validate(v)
+                               for k, v in config["sparse_vectors"].items()} or None,
+    )
+
+def import_collection(client, in_path, collection_name=None, batch_size=BATCH_SIZE,
+                      recreate=False, alias=None, drop_previous=False, progress=None):
+    """
+    串流匯入，不重新 embedding。
+    - 先把備份內的文件登錄到本機登錄表，payload 的 doc_ids 換成本機的 doc_id
+    - collection 不存在時依備份內的設定建立；recreate=True 會先刪掉既有的
+    - alias：匯入到新的 collection (預設 <alias>_<時間>) 後再把 alias 原子性地切過去，
+      bitsAI_core 透過 alias 讀寫，所以不中斷；drop_previous=True 切換後刪除 alias 原本指向的 collection
+    回傳匯入筆數
+    """
+    config = read_backup_info(in_path)
+    if alias:
+        if qdrant_conn.is_physical_collection(client, alias):
+            raise ValueError(f"'{alias}' 是實體 collection，無法建立同名 alias："
+                             f"請先執行 python -u bitsAI_qdrant_backup.py adopt-alias --collection {alias}")
+        collection_name = collection_name or qdrant_conn.new_physical_name(alias)
+        if collection_name == alias:
+            raise ValueError("匯入目標 collection 不能與 alias 同名")
+    collection_name = collection_name or config["collection"]
+    dense_names = sorted(config["vectors"])
+    sparse_names = sorted(config["sparse_vectors"])
+
+    if recreate and client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    if not client.collection_exists(collection_name):
+        _create_collection(client, collection_name, config)
+
+    id_map = register_documents(read_backup_documents(in_path))
+    imported = 0
+    total = config.get("points_count")
+    parquet_file = pq.ParquetFile(in_path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        client.upsert(
+            collection_name=collection_name,
+            points=_rows_to_points(batch, dense_names, sparse_names, id_map),
+            wait=True
+        )
+        imported += batch.num_rows
+        if progress:
+            progress(imported, total)
+
+    if alias:
+        previous = qdrant_conn.point_alias(client, alias, collection_name)
+        if previous and previous != collection_name:
+            if drop_previous:
+                client.delete_collection(previous)
+                print(f"🗑️ [Backup] 已刪除原本的 {previous}")
+            else:
+                print(f"ℹ️ [Backup] alias {alias} 原本指向 {previous} (保留，可用來還原)")
+    print(f"📥 [Backup] {in_path}: {imported} points, {len(id_map)} documents → {collection_name}"
+          + (f" (alias {alias})" if alias else ""))
+    return imported
+
+# ============================================================
+# 🔀 舊版實體 collection → alias (一次性)
+# ============================================================
+def copy_collection(client, source, target, batch_size=BATCH_SIZE, progress=None):
+    """把 source 的 points (payload + 向量) 複製到新建的 target，不重新 embedding"""
+    _, _, config = _vector_layout(client, source)
+    _create_collection(client, target, config)
+    total = client.count(collection_name=source, exact=True).count
+    copied = 0
+    offset = None
+    while True:
+        records, offset = client.scroll(collection_name=source, limit=batch_size, offset=offset,
+                                        with_payload=True, with_vectors=True)
+        if records:
+            client.upsert(collection_name=target, wait=True, points=[
+                models.PointStruct(id=r.id, payload=r.payload or {}, vector=r.vector) for r in records])
+            copied += len(records)
+            if progress:
+                progress(copied, total)
+        if offset is None:
+            break
+    return copied
+
+def adopt_alias(client, name=COLLECTION_NAME, batch_size=BATCH_SIZE, progress=None) -> str:
+    """
+    舊版直接建立的實體 collection 改成 alias：複製到 <name>_<時間>、確認筆數、刪除原本的、建立 alias。
+    刪除到建立 alias 之間 (毫秒級) 讀寫會失敗，請在沒有寫入時執行。回傳新的實體 collection 名稱
+    """
+    if not qdrant_conn.is_physical_collection(client, name):
+        target = qdrant_conn.resolve_alias(client, name)
+        if target is None:
+            raise ValueError(f"找不到 collection '{name}'")
+        print(f"ℹ️ [Backup] {name} 已經是 alias (→ {target})")
+        return target
+    target = qdrant_conn.new_physical_name(name)
+    copied = copy_collection(client, name, target, batch_size, progress)
+    expected = client.count(collection_name=name, exact=True).count
+    if copied != expected or client.count(collection_name=target, exact=True).count != expected:
+        client.delete_collection(target)
+        raise RuntimeError(f"複製筆數不符 ({copied} / {expected})，已取消，{name} 維持原狀")
+    client.delete_collection(name)
+    qdrant_conn.point_alias(client, name, target)
+    print(f"🔀 [Backup] {name} → alias of {target} ({copied} points)")
+    return target
+
+# ============================================================
+# 🖥️ CLI
+# ============================================================
+def _print_progress(done, total):
+    total_text = f"/{total}" if total else ""
+    print(f"\r⏳ {done}{total_text} points", end="", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="BITS-AI Qdrant 知識庫匯出 / 匯入 (Parquet，含 dense + sparse 向量)")
+    parser.add_argument("--path", default=QDRANT_PATH, help="本地 Qdrant 資料夾 (預設 qdrant_db)")
+    parser.add_argument("--url", default=None, help="Qdrant server URL (預設 BITSAI_QDRANT_URL)，設定後忽略 --path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="匯出 collection 到 Parquet")
+    p_export.add_argument("output")
+    p_export.add_argument("--collection", default=COLLECTION_NAME)
+
+    p_import = sub.add_parser("import", help="從 Parquet 匯入 collection")
+    p_import.add_argument("input")
+    p_import.add_argument("--collection", default=None, help="目標 collection (預設使用備份內的名稱)")
+    p_import.add_argument("--recreate", action="store_true", help="先刪除既有的目標 collection")
+    p_import.add_argument("--alias", default=None, help="匯入完成後把此 alias 指向目標 collection")
+    p_import.add_argument("--drop-previous", action="store_true", help="切換 alias 後刪除它原本指向的 collection")
+
+    p_adopt = sub.add_parser("adopt-alias", help="把舊版的實體 collection 改成 alias (一次性)")
+    p_adopt.add_argument("--collection", default=COLLECTION_NAME)
+
+    args = parser.parse_args()
+    client = qdrant_conn.make_client(args.url, args.path)
+
+    start = time.time()
+    if args.command == "export":
+        n = export_collection(client, args.collection, args.output, args.batch_size, _print_progress)
+    elif args.command == "adopt-alias":
+        target = adopt_alias(client, args.collection, args.batch_size, _print_progress)
+        n = client.count(collection_name=target, exact=True).count
+    else:
+        n = import_collection(client, args.input, args.collection, args.batch_size,
+                              args.recreate, args.alias, args.drop_previous, _print_progress)
+    print(f"\n✅ {n} points, {time.time() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
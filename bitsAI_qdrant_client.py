@@ -0,0 +1,71 @@
+import os
+import time
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+# ============================================================
+# ⚙️ Qdrant 連線設定 (bitsAI_core / 管理介面 / 備份 / 遷移共用)
+# ============================================================
+QDRANT_PATH = "qdrant_db"
+QDRANT_URL = os.getenv("BITSAI_QDRANT_URL")   # 設定後改連 Qdrant server (多個 API worker 共用時必須)
+COLLECTION_NAME = "lab_knowledge"   # alias；實體 collection 是 lab_knowledge_<建立時間>
+
+def make_client(url: str = None, path: str = None) -> QdrantClient:
+    """url 優先，其次 BITSAI_QDRANT_URL；都沒有時開本地資料夾 (path 或 qdrant_db)"""
+    url = url or QDRANT_URL
+    return QdrantClient(url=url) if url else QdrantClient(path=path or QDRANT_PATH)
+
+def describe(url: str = None, path: str = None) -> str:
+    url = url or QDRANT_URL
+    return url or os.path.abspath(path or QDRANT_PATH)
+
+# ============================================================
+# 🔀 Collection alias (匯入備份時原子切換，讀寫端都透過 alias)
+# ============================================================
+def resolve_alias(client, name: str):
+    """alias 指向的實體 collection；name 不是 alias 時回傳 None"""
+    for alias in client.get_aliases().aliases:
+        if alias.alias_name == name:
+            return alias.collection_name
+    return None
+
+def physical_name(client, name: str) -> str:
+    return resolve_alias(client, name) or name
+
+def is_physical_collection(client, name: str) -> bool:
+    """舊版直接以 COLLECTION_NAME 建立的實體 collection (無法再建立同名 alias)"""
+    return any(c.name == name for c in client.get_collections().collections)
+
+def new_physical_name(alias: str) -> str:
+    return f"{alias}_{time.strftime('%Y%m%d%H%M%S')}"
+
+def point_alias(client, alias: str, collection_name: str):
+    """把 alias 原子性地切到 collection_name，回傳原本指向的 collection (沒有則 None)"""
+    if is_physical_collection(client, alias):
+        raise ValueError(f"'{alias}' 是實體 collection，無法建立同名 alias："
+                         f"請先執行 python -u bitsAI_qdrant_backup.py adopt-alias --collection {alias}")
+    previous = resolve_alias(client, alias)
+    operations = []
+    if previous is not None:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    operations.append(models.CreateAliasOperation(create_alias=models.CreateAlias(
+        collection_name=collection_name, alias_name=alias)))
+    client.update_collection_aliases(change_aliases_operations=operations)
+    return previous
+
+def create_aliased_collection(client, alias: str, **collection_config) -> str:
+    """建立新的實體 collection 並讓 alias 指向它；其他 worker 搶先建好時改用它的，回傳實體名稱"""
+    physical = new_physical_name(alias)
+    created = False
+    try:
+        client.create_collection(collection_name=physical, **collection_config)
+        created = True
+        client.update_collection_aliases(change_aliases_operations=[models.CreateAliasOperation(
+            create_alias=models.CreateAlias(collection_name=physical, alias_name=alias))])
+    except Exception:
+        if created:
+            client.delete_collection(physical)
+        if resolve_alias(client, alias) is None:
+            raise
+    return resolve_alias(client, alias)
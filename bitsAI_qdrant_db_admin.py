@@ -1,18 +1,60 @@
 import gradio as gr 
 import pandas as pd
+import os
 import json
-from qdrant_client import QdrantClient
+import time
+import threading
+import httpx
 from qdrant_client.http import models
+import bitsAI_qdrant_backup as backup
+import bitsAI_docstore as docstore
+import bitsAI_qdrant_client as qdrant_conn
 
 # ================= 設定區 =================
-QDRANT_PATH = "qdrant_db" 
-client = QdrantClient(path=QDRANT_PATH) 
+# 與 bitsAI_core 相同：有 BITSAI_QDRANT_URL 時連 Qdrant server，否則開本地 qdrant_db
+QDRANT_PATH = qdrant_conn.QDRANT_PATH
+client = qdrant_conn.make_client()
+
+# 表格只讀取這些 payload 欄位；chunk 內文 (document) 等點選時才載入
+# title / source / type / subtype / timestamp 在文件登錄表 (bitsAI_docstore)，依 doc_ids join 回來
+PAYLOAD_FIELDS = ["title", "source", "sources", "type", "subtype", "chunk_id", "page", "timestamp", "doc_ids", "document"]
+DISPLAY_FIELDS = ["title", "source", "type", "subtype", "chunk_id", "timestamp"]
+
+# 搜尋用的 payload index (add_docs_to_qdrant 存的欄位；舊格式的 chunk 仍帶 title / source 等)
+TEXT_INDEX_FIELDS = ["document", "title"]               # 全文檢索
+KEYWORD_INDEX_FIELDS = ["source", "type", "subtype"]    # 精確比對
+INTEGER_INDEX_FIELDS = ["doc_ids"]                      # 文件登錄表的 id
+DATETIME_INDEX_FIELDS = ["timestamp"]                   # 時間範圍 (批次操作用)
+
+# 語意搜尋使用與 bitsAI_core 相同的 embedding 模型 (第一次語意搜尋時才載入)
+DENSE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+SPARSE_MODEL = "prithivida/Splade_PP_en_v1"
+SEMANTIC_MAX_RESULTS = 500    # 語意搜尋最多往後翻到第幾筆
+
+SEARCH_MODES = ["關鍵字", "語意", "混合"]
+
+FACET_FIELDS = ["type", "source", "subtype"]   # 統計頁的分組欄位
+FACET_LIMIT = 15
+DOC_FACET_LIMIT = 100_000    # 依 doc_ids 分組時取回的文件數上限 (再依登錄表欄位加總)
+# Vacuum：已刪除比例超過 5% 且 segment 至少 100 筆就重寫 (Qdrant 預設 20% / 1000 筆)
+VACUUM_DELETED_THRESHOLD = 0.05
+VACUUM_MIN_VECTORS = 100
+# 「立即建立索引」：暫時把 indexing_threshold 降到 1 KB，所有 segment 都建 HNSW
+OPTIMIZE_INDEXING_THRESHOLD = 1
+# 暫時調整的 optimizer 設定在 collection 回到 green 後還原 (每隔幾秒檢查，最多等多久)
+OPTIMIZE_POLL_SECONDS = 5
+OPTIMIZE_RESTORE_TIMEOUT = 3600
+# Profiling 開關透過 BITSAI API 的 GET /profile (只對回應這個請求的 worker 生效)
+API_URL = os.getenv("BITSAI_API_URL", "http://127.0.0.1:8000")
+PROFILE_MODES = ["sample", "cprofile"]
 # =========================================
 
 def get_collections():
+    """alias (bitsAI_core 讀寫的名稱，例如 lab_knowledge) 排在前面，再列出實體 collection"""
     try:
+        aliases = [a.alias_name for a in client.get_aliases().aliases]
         collections = client.get_collections().collections
-        return [c.name for c in collections]
+        return aliases + [c.name for c in collections]
     except Exception as e:
         print(f"Error fetching collections: {e}")
         return []
@@ -24,78 +66,196 @@ def truncate_text(text, max_len=50):
         return text[:max_len] + "..."
     return text
 
-def load_data(collection_name, limit=20, search_query=""):
+_indexed_collections = set()
+
+def ensure_payload_indexes(collection_name):
+    """建立全文 / keyword payload index (已存在時 Qdrant 會直接略過)"""
+    if collection_name in _indexed_collections:
+        return
+    text_params = models.TextIndexParams(
+        type=models.TextIndexType.TEXT,
+        tokenizer=models.TokenizerType.MULTILINGUAL,   # 中英文混合內容
+        lowercase=True,
+    )
+    try:
+        for field in TEXT_INDEX_FIELDS:
+            client.create_payload_index(collection_name, field_name=field, field_schema=text_params)
+        for field in KEYWORD_INDEX_FIELDS:
+            client.create_payload_index(collection_name, field_name=field,
+                                        field_schema=models.PayloadSchemaType.KEYWORD)
+        for field in INTEGER_INDEX_FIELDS:
+            client.create_payload_index(collection_name, field_name=field,
+                                        field_schema=models.PayloadSchemaType.INTEGER)
+        for field in DATETIME_INDEX_FIELDS:
+            client.create_payload_index(collection_name, field_name=field,
+                                        field_schema=models.PayloadSchemaType.DATETIME)
+        _indexed_collections.add(collection_name)
+    except Exception as e:
+        print(f"⚠️ 建立 payload index 失敗: {e}")
+
+def doc_ids_condition(doc_ids):
+    """登錄表查到的文件 → doc_ids 過濾 (沒有符合的文件時給一個不存在的 id)"""
+    return models.FieldCondition(key="doc_ids", match=models.MatchAny(any=doc_ids or [-1]))
+
+def build_search_filter(search_query):
+    """關鍵字搜尋：chunk 內文 / 標題走全文 index，來源檔名 / 類型走 keyword index，新格式的 chunk 透過登錄表比對"""
+    if not search_query or not search_query.strip():
+        return None
+    search_text = search_query.strip()
+    return models.Filter(
+        should=[
+            models.FieldCondition(key="document", match=models.MatchText(text=search_text)),
+            doc_ids_condition(docstore.registry.search(search_text)),
+            models.FieldCondition(key="title", match=models.MatchText(text=search_text)),
+            models.FieldCondition(key="source", match=models.MatchValue(value=search_text)),
+            models.FieldCondition(key="subtype", match=models.MatchValue(value=search_text)),
+            models.FieldCondition(key="type", match=models.MatchValue(value=search_text.lower())),
+        ]
+    )
+
+_embedders_ready = False
+
+def semantic_search(collection_name, search_text, query_filter, limit):
+    """用 app 相同的 dense + sparse 模型做混合向量檢索，回傳依分數排序的結果"""
+    global _embedders_ready
+    if not _embedders_ready:
+        print("⏳ Loading embedding models...")
+        client.set_model(DENSE_MODEL)
+        client.set_sparse_model(SPARSE_MODEL)
+        _embedders_ready = True
+    return client.query(
+        collection_name=collection_name,
+        query_text=search_text,
+        query_filter=query_filter,
+        limit=limit
+    )
+
+def count_points(collection_name, query_filter=None):
+    """總筆數；沒有過濾條件時用近似值 (只讀 collection 統計，不掃資料)"""
+    try:
+        return client.count(collection_name=collection_name, count_filter=query_filter,
+                            exact=query_filter is not None).count
+    except Exception as e:
+        print(f"⚠️ 計數失敗: {e}")
+        return None
+
+def new_page_state():
+    """cursor 分頁狀態：offsets[i] 是第 i 頁的起始 cursor，next 是下一頁的 cursor"""
+    return {"offsets": [None], "index": 0, "next": None, "total": None}
+
+def payload_projection(fields):
+    """要顯示登錄表欄位時一併讀取 doc_ids"""
+    fields = list(fields)
+    if "doc_ids" not in fields and set(fields) & {*docstore.META_FIELDS, "sources"}:
+        fields.append("doc_ids")
+    return fields
+
+def fetch_page(collection_name, limit, query_filter, fields, offset=None):
+    """只取需要顯示的 payload 欄位 (projection)，回傳 (records, next_page_offset)"""
+    with_payload = models.PayloadSelectorInclude(include=payload_projection(fields)) if fields else True
+    return client.scroll(
+        collection_name=collection_name,
+        scroll_filter=query_filter,
+        limit=int(limit),
+        offset=offset,
+        with_payload=with_payload,
+        with_vectors=False
+    )
+
+def records_to_table(records, fields, scores=None):
+    """Record → 顯示用 DataFrame (Select + ID + [分數] + 欄位)"""
+    rows = []
+    for i, r in enumerate(records):
+        item = docstore.registry.resolve(r.payload)
+        row = {"Select": False, "id": str(r.id)}
+        if scores is not None:
+            row["score"] = f"{scores[i]:.4f}"
+        keys = fields or list(item.keys())
+        for k in keys:
+            row[k] = truncate_text(item.get(k, ""), max_len=60)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def page_info(page, shown):
+    total = page.get("total")
+    total_text = f"共 {total} 筆" if total is not None else "總數未知"
+    more = "，還有下一頁" if page.get("next") is not None else ""
+    return f"📄 第 {page['index'] + 1} 頁 · 本頁 {shown} 筆 · {total_text}{more}"
+
+def fetch_ranked_page(collection_name, limit, search_text, query_filter, fields, start):
     """
-    讀取資料
-    回傳: DataFrame, Full_Data, Editor區塊顯示狀態, Table區塊顯示狀態
+    語意 / 混合搜尋的一頁：cursor 是排名位置 (int)。
+    回傳 (records, scores, next_start)
+    """
+    limit = int(limit)
+    hits = semantic_search(collection_name, search_text, query_filter,
+                           min(start + limit + 1, SEMANTIC_MAX_RESULTS))
+    window = hits[start:start + limit]
+    records = [models.Record(id=h.id, payload={k: h.metadata.get(k) for k in payload_projection(fields)}
+                             if fields else h.metadata)
+               for h in window]
+    has_more = len(hits) > start + limit and start + limit < SEMANTIC_MAX_RESULTS
+    return records, [h.score for h in window], (start + limit if has_more else None)
+
+def load_data(collection_name, limit=20, search_query="", fields=None, page=None, mode=SEARCH_MODES[0]):
+    """
+    讀取目前 cursor 所在的一頁
+    - 關鍵字：payload index 過濾 + scroll cursor
+    - 語意：向量檢索排名；混合：關鍵字過濾後再依向量分數排名
+    回傳: DataFrame, 本頁 ID 列表, 分頁狀態, 分頁資訊, Editor區塊顯示狀態, Table區塊顯示狀態
     """
     # 預設隱藏狀態
     hide_ui = gr.update(visible=False)
     show_ui = gr.update(visible=True)
     empty_df = pd.DataFrame()
+    page = page or new_page_state()
 
     if not collection_name:
-        return empty_df, [], hide_ui, hide_ui
+        return empty_df, [], page, "", hide_ui, hide_ui
     
     try:
-        # --- 建構搜尋過濾器 ---
-        query_filter = None
-        if search_query.strip():
-            search_text = search_query.strip()
-            query_filter = models.Filter(
-                should=[
-                    models.FieldCondition(key="page_content", match=models.MatchText(text=search_text)),
-                    models.FieldCondition(key="text", match=models.MatchText(text=search_text)),
-                    models.FieldCondition(key="title", match=models.MatchText(text=search_text)),
-                    models.FieldCondition(key="filename", match=models.MatchText(text=search_text)),
-                ]
-            )
+        ensure_payload_indexes(collection_name)
+        search_text = (search_query or "").strip()
+        ranked = bool(search_text) and mode != SEARCH_MODES[0]
+        query_filter = None if mode == SEARCH_MODES[1] else build_search_filter(search_text)
 
-        # --- 使用 Scroll API ---
-        records, _ = client.scroll(
-            collection_name=collection_name,
-            scroll_filter=query_filter, 
-            limit=limit,
-            with_payload=True,
-            with_vectors=False
-        )
-        
-        full_data = [] 
-        display_data = [] 
+        if page["total"] is None:
+            page["total"] = None if ranked and query_filter is None else count_points(collection_name, query_filter)
+
+        offset = page["offsets"][page["index"]]
+        if ranked:
+            records, scores, next_offset = fetch_ranked_page(collection_name, limit, search_text,
+                                                             query_filter, fields, offset or 0)
+        else:
+            # --- 使用 Scroll API (保留 next_page_offset 供下一頁使用) ---
+            records, next_offset = fetch_page(collection_name, limit, query_filter, fields, offset=offset)
+            scores = None
+        page["next"] = next_offset
 
-        for r in records:
-            item = r.payload if r.payload else {}
-            item_id = str(r.id)
-            
-            full_item = {"id": item_id}
-            full_item.update(item)
-            full_data.append(full_item)
-
-            display_item = {"id": item_id}
-            for k, v in item.items():
-                display_item[k] = truncate_text(v, max_len=60)
-            display_data.append(display_item)
-            
         # 如果沒資料，回傳空並隱藏區塊
-        if not full_data:
+        if not records:
             print("🔍 找不到符合條件的資料")
-            return empty_df, [], hide_ui, hide_ui
-            
-        df_display = pd.DataFrame(display_data)
-        
-        # 處理顯示欄位 (Select + ID + 其他)
-        cols = ['id'] + [c for c in df_display.columns if c != 'id']
-        df_display = df_display[cols]
-        df_display.insert(0, "Select", False) 
+            return empty_df, [], page, page_info(page, 0), hide_ui, hide_ui
 
-        print(f"✅ 成功讀取 {len(full_data)} 筆資料")
+        print(f"✅ 成功讀取 {len(records)} 筆資料 (第 {page['index'] + 1} 頁)")
         
         # 資料存在，回傳 show_ui 將區塊打開
-        return df_display, full_data, show_ui, show_ui
+        return (records_to_table(records, fields, scores), [str(r.id) for r in records], page,
+                page_info(page, len(records)), show_ui, show_ui)
 
     except Exception as e:
         print(f"❌ 讀取錯誤: {str(e)}")
-        return empty_df, [], hide_ui, hide_ui
+        return empty_df, [], page, f"❌ 讀取錯誤: {e}", hide_ui, hide_ui
+
+def parse_point_id(point_id):
+    """表格裡的 ID 都是字串；整數 ID 要轉回 int 才查得到"""
+    text = str(point_id)
+    return int(text) if text.isdigit() else text
+
+def load_point(collection_name, point_id):
+    """點選時才讀取單筆完整 payload (lazy loading)"""
+    points = client.retrieve(collection_name=collection_name, ids=[parse_point_id(point_id)], with_payload=True)
+    return points[0].payload if points else None
 
 def batch_delete_data(collection_name, df_data):
     if not collection_name: return "⚠️ 請先選擇 Collection"
@@ -104,7 +264,7 @@ def batch_delete_data(collection_name, df_data):
     selected_rows = df_data[df_data["Select"] == True]
     if selected_rows.empty: return "⚠️ 未勾選任何資料"
 
-    ids_to_delete = selected_rows["id"].tolist()
+    ids_to_delete = [parse_point_id(i) for i in selected_rows["id"].tolist()]
     try:
         client.delete(
             collection_name=collection_name,
@@ -115,17 +275,347 @@ def batch_delete_data(collection_name, df_data):
         return f"❌ 刪除失敗: {str(e)}"
 
 def save_payload(collection_name, target_id, new_payload_str):
+    """
+    單筆修改：set_payload 只合併有改的欄位，不覆寫整份 payload。
+    新格式的 chunk：title / source / type / subtype 改在登錄表 (這個 chunk 顯示的第一份文件)，
+    並移除 payload 上同名的覆寫欄位，之後登錄表的修改才會繼續生效
+    """
     if not collection_name or not target_id: return "⚠️ 請先選擇資料"
     try:
         new_payload = json.loads(new_payload_str)
-        client.overwrite_payload(
+        point_id = parse_point_id(target_id)
+        doc_ids = (load_point(collection_name, target_id) or {}).get("doc_ids") or []
+        doc_fields = {k: v for k, v in new_payload.items() if k in docstore.EDITABLE_FIELDS} if doc_ids else {}
+        note = ""
+        if doc_fields:
+            docstore.registry.update(doc_ids[:1], **doc_fields)
+            client.delete_payload(collection_name=collection_name, keys=list(doc_fields), points=[point_id])
+            new_payload = {k: v for k, v in new_payload.items() if k not in doc_fields}
+            note = f" (登錄表 doc_id {doc_ids[0]} 的 {', '.join(doc_fields)}，該文件所有 chunk 一起生效)"
+        if new_payload:
+            client.set_payload(
+                collection_name=collection_name,
+                payload=new_payload,
+                points=[point_id]
+            )
+        return f"💾 成功更新 ID: {target_id}{note}"
+    except Exception as e:
+        return f"❌ 更新失敗: {str(e)}"
+
+# ================= 依條件批次操作 =================
+
+def split_bulk_conditions(source="", doc_type="", subtype="", title="", ts_from="", ts_to=""):
+    """
+    source / type / subtype / title 精確比對，timestamp 範圍 (YYYY-MM-DD [HH:MM:SS])。
+    回傳 (舊格式 chunk 的 payload filter, 登錄表中符合的 doc_ids)；全空回傳 (None, [])
+    """
+    legacy, criteria = [], {}
+    for key, value in (("source", source), ("type", doc_type), ("subtype", subtype), ("title", title)):
+        if value and value.strip():
+            legacy.append(models.FieldCondition(key=key, match=models.MatchValue(value=value.strip())))
+            criteria["doc_type" if key == "type" else key] = value.strip()
+    ts_from, ts_to = (ts_from or "").strip(), (ts_to or "").strip()
+    if ts_from or ts_to:
+        legacy.append(models.FieldCondition(
+            key="timestamp",
+            range=models.DatetimeRange(gte=ts_from or None, lte=ts_to or None)
+        ))
+        # 登錄表的時間是字串比較；只給日期時 lte 要包含當天
+        criteria["ingested_from"] = ts_from or None
+        criteria["ingested_to"] = (ts_to + " 23:59:59" if len(ts_to) == 10 else ts_to) or None
+    if not legacy:
+        return None, []
+    return models.Filter(must=legacy), docstore.registry.ids_matching(**criteria)
+
+def build_bulk_filter(source="", doc_type="", subtype="", title="", ts_from="", ts_to=""):
+    """舊格式的 chunk 直接比對 payload；新格式的 chunk 比對登錄表查出的 doc_ids；全空回傳 None"""
+    legacy_filter, doc_ids = split_bulk_conditions(source, doc_type, subtype, title, ts_from, ts_to)
+    if legacy_filter is None:
+        return None
+    return models.Filter(should=[legacy_filter, models.Filter(must=[doc_ids_condition(doc_ids)])])
+
+def preview_bulk(collection_name, source, doc_type, subtype, title, ts_from, ts_to):
+    if not collection_name: return "⚠️ 請先選擇 Collection"
+    query_filter = build_bulk_filter(source, doc_type, subtype, title, ts_from, ts_to)
+    if query_filter is None: return "⚠️ 請至少設定一個條件"
+    count = client.count(collection_name=collection_name, count_filter=query_filter, exact=True).count
+    return f"🔎 符合條件的資料：{count} 筆"
+
+def detach_documents(collection_name, doc_ids, batch_size=256):
+    """
+    把 doc_ids 從 chunk 的 doc_ids 移除：只屬於這些文件的 chunk 刪除，
+    與其他文件共用 (去重) 的 chunk 保留並改寫 doc_ids。回傳 (刪除筆數, 改寫筆數)
+    """
+    targets = set(doc_ids)
+    deleted = detached = 0
+    offset = None
+    while True:
+        records, offset = client.scroll(
             collection_name=collection_name,
-            payload=new_payload,
-            points=[target_id]
+            scroll_filter=models.Filter(must=[doc_ids_condition(doc_ids)]),
+            limit=batch_size, offset=offset, with_payload=["doc_ids"], with_vectors=False
         )
-        return f"💾 成功更新 ID: {target_id}"
+        orphans, ops = [], []
+        for r in records:
+            remaining = [i for i in (r.payload or {}).get("doc_ids") or [] if i not in targets]
+            if remaining:
+                ops.append(models.SetPayloadOperation(
+                    set_payload=models.SetPayload(payload={"doc_ids": remaining}, points=[r.id])))
+            else:
+                orphans.append(r.id)
+        if orphans:
+            ops.append(models.DeleteOperation(delete=models.PointIdsList(points=orphans)))
+        if ops:
+            client.batch_update_points(collection_name=collection_name, update_operations=ops)
+        deleted += len(orphans)
+        detached += len(records) - len(orphans)
+        if offset is None:
+            break
+    return deleted, detached
+
+def bulk_delete(collection_name, source, doc_type, subtype, title, ts_from, ts_to, progress=gr.Progress()):
+    """
+    舊格式的 chunk：server 端 delete-by-filter。
+    新格式的 chunk：移除符合文件的 doc_ids，沒有剩下任何文件的 chunk 才刪除，最後刪掉沒有 chunk 引用的登錄表資料列
+    """
+    if not collection_name: return "⚠️ 請先選擇 Collection"
+    legacy_filter, doc_ids = split_bulk_conditions(source, doc_type, subtype, title, ts_from, ts_to)
+    if legacy_filter is None: return "⚠️ 請至少設定一個條件 (避免誤刪整個 Collection)"
+    # 只刪還沒有 doc_ids 的舊格式 chunk，新格式的 chunk 交給 detach_documents
+    legacy_filter.must.append(models.IsEmptyCondition(is_empty=models.PayloadField(key="doc_ids")))
+    try:
+        start = time.time()
+        progress(0.1, desc="計算符合筆數")
+        before = client.count(collection_name=collection_name, count_filter=legacy_filter, exact=True).count
+        if before == 0 and not doc_ids: return "🔎 沒有符合條件的資料"
+        if before:
+            progress(0.3, desc=f"刪除 {before} 筆舊格式資料")
+            client.delete(
+                collection_name=collection_name,
+                points_selector=models.FilterSelector(filter=legacy_filter)
+            )
+        deleted = detached = n_docs = 0
+        if doc_ids:
+            progress(0.5, desc=f"移除 {len(doc_ids)} 份文件的 chunk")
+            deleted, detached = detach_documents(collection_name, doc_ids)
+            progress(0.8, desc="清理登錄表")
+            n_docs = docstore.discard_unused(client, doc_ids)
+        progress(1.0, desc="完成")
+        return (f"🗑️ 已刪除 {before + deleted} 筆，{detached} 筆與其他文件共用的 chunk 只移除引用，"
+                f"登錄表刪除 {n_docs} 份文件，耗時 {time.time() - start:.2f}s")
     except Exception as e:
-        return f"❌ 更新失敗: {str(e)}"
+        return f"❌ 批次刪除失敗: {str(e)}"
+
+def bulk_set_payload(collection_name, payload_str, source, doc_type, subtype, title, ts_from, ts_to, progress=gr.Progress()):
+    """
+    一次 server 端 set-payload-by-filter (合併欄位，例如把某個 source 的 type 改成 paper)。
+    新格式的 chunk：title / source / type / subtype 改在文件登錄表，其餘欄位才寫進 payload
+    """
+    if not collection_name: return "⚠️ 請先選擇 Collection"
+    query_filter = build_bulk_filter(source, doc_type, subtype, title, ts_from, ts_to)
+    if query_filter is None: return "⚠️ 請至少設定一個條件"
+    try:
+        payload = json.loads(payload_str or "{}")
+        if not isinstance(payload, dict) or not payload:
+            return "⚠️ 請輸入要更新的欄位，例如 {\"type\": \"paper\"}"
+        start = time.time()
+        progress(0.1, desc="計算符合筆數")
+        count = client.count(collection_name=collection_name, count_filter=query_filter, exact=True).count
+        if count == 0: return "🔎 沒有符合條件的資料"
+        progress(0.4, desc=f"更新 {count} 筆")
+        legacy_filter, doc_ids = split_bulk_conditions(source, doc_type, subtype, title, ts_from, ts_to)
+        # 先改登錄表 (來源重複時會失敗)，失敗就不動任何 payload
+        n_docs = docstore.registry.update(doc_ids, **payload)
+        client.set_payload(
+            collection_name=collection_name,
+            payload=payload,
+            points=models.FilterSelector(filter=legacy_filter)
+        )
+        chunk_payload = {k: v for k, v in payload.items() if k not in docstore.EDITABLE_FIELDS}
+        if chunk_payload and doc_ids:
+            client.set_payload(
+                collection_name=collection_name,
+                payload=chunk_payload,
+                points=models.FilterSelector(filter=models.Filter(must=[doc_ids_condition(doc_ids)]))
+            )
+        progress(1.0, desc="完成")
+        return (f"🏷️ 已更新 {count} 筆的 {', '.join(payload)} (登錄表 {n_docs} 份文件)，"
+                f"耗時 {time.time() - start:.2f}s")
+    except Exception as e:
+        return f"❌ 批次更新失敗: {str(e)}"
+
+# ================= 統計與健康狀態 =================
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+def _raw_vector_bytes(info):
+    """依向量維度估算 dense 向量原始大小 (float32)"""
+    vectors = info.config.params.vectors
+    dims = [vectors.size] if isinstance(vectors, models.VectorParams) else [v.size for v in (vectors or {}).values()]
+    return (info.points_count or 0) * sum(dims) * 4
+
+def collection_stats(collection_name):
+    """collection info + facet 分組統計，回傳 Markdown"""
+    if not collection_name: return "⚠️ 請先選擇 Collection"
+    try:
+        ensure_payload_indexes(collection_name)
+        info = client.get_collection(collection_name)
+        points = info.points_count or 0
+        indexed = info.indexed_vectors_count or 0
+        physical = qdrant_conn.physical_name(client, collection_name)
+        local_dir = os.path.join(QDRANT_PATH, "collection", physical)
+        disk = (f"{_dir_size(local_dir) / (1024 * 1024):.1f} MB"
+                if not qdrant_conn.QDRANT_URL and os.path.isdir(local_dir) else "N/A (server)")
+        thresholds = info.config.optimizer_config
+
+        lines = [
+            f"### 📊 {collection_name}" + (f" (alias → {physical})" if physical != collection_name else ""),
+            f"- 狀態：**{info.status.value if hasattr(info.status, 'value') else info.status}** · "
+            f"Optimizer：{getattr(info.optimizer_status, 'value', info.optimizer_status)}",
+            f"- Points：**{points}** · Segments：{info.segments_count}",
+            f"- 已建索引向量：{indexed} · 未建索引：{max(points - indexed, 0)} "
+            f"(少於 indexing_threshold={thresholds.indexing_threshold} KB 的 segment 不建 HNSW)",
+            f"- 磁碟：{disk} · Dense 向量原始大小 (約等於 RAM 下限)：{_raw_vector_bytes(info) / (1024 * 1024):.1f} MB",
+            f"- Vacuum 條件：deleted_threshold={thresholds.deleted_threshold}, "
+            f"vacuum_min_vector_number={thresholds.vacuum_min_vector_number}",
+        ]
+        if info.payload_schema:
+            lines.append("- Payload index：" + ", ".join(
+                f"{k} ({getattr(v.data_type, 'value', v.data_type)})" for k, v in info.payload_schema.items()))
+
+        # 新格式的 chunk 依 doc_ids 分組後用登錄表的欄位加總，再加上舊格式 payload 的分組
+        doc_counts = {h.value: h.count for h in
+                      client.facet(collection_name, key="doc_ids", limit=DOC_FACET_LIMIT, exact=False).hits}
+        lines.append(f"- 文件登錄表：{docstore.registry.count()} 份文件，此 collection 引用 {len(doc_counts)} 份")
+        for field in FACET_FIELDS:
+            counts = docstore.registry.facet(doc_counts, field)
+            for h in client.facet(collection_name, key=field, limit=FACET_LIMIT, exact=False).hits:
+                counts[h.value] += h.count
+            if not counts:
+                continue
+            lines.append(f"\n**依 {field}** (前 {FACET_LIMIT})\n\n| {field} | points |\n|---|---:|")
+            lines += [f"| {value} | {count} |" for value, count in counts.most_common(FACET_LIMIT)]
+        return "\n".join(lines)
+    except Exception as e:
+        return f"❌ 讀取統計失敗: {str(e)}"
+
+_restore_lock = threading.Lock()
+_pending_restores = {}   # 實體 collection -> 調整前的 optimizer 設定 (還原前再按一次不會把暫時值當成原值)
+
+def _restore_when_idle(physical):
+    """等 optimizer 做完 (status green) 再把暫時調整的 optimizer 設定還原"""
+    deadline = time.time() + OPTIMIZE_RESTORE_TIMEOUT
+    time.sleep(OPTIMIZE_POLL_SECONDS)
+    while time.time() < deadline:
+        try:
+            info = client.get_collection(physical)
+            if getattr(info.status, "value", info.status) == "green":
+                break
+        except Exception as e:
+            print(f"⚠️ 讀取 {physical} 狀態失敗: {e}")
+        time.sleep(OPTIMIZE_POLL_SECONDS)
+    with _restore_lock:
+        original = _pending_restores.pop(physical, None)
+    if original:
+        try:
+            client.update_collection(physical, optimizers_config=models.OptimizersConfigDiff(**original))
+            print(f"↩️ {physical} optimizer 設定已還原: {original}")
+        except Exception as e:
+            print(f"❌ {physical} optimizer 設定還原失敗 ({original}): {e}")
+
+def apply_optimizer_temporarily(collection_name, **overrides):
+    """暫時套用 optimizer 設定觸發重寫 / 建索引，optimizer 完成後背景還原成原本的值"""
+    if not qdrant_conn.QDRANT_URL:
+        return "⚠️ 本地模式 (qdrant_db) 沒有背景 optimizer，這個操作不會有任何效果；請連 Qdrant server 使用"
+    physical = qdrant_conn.physical_name(client, collection_name)
+    current = client.get_collection(physical).config.optimizer_config
+    with _restore_lock:
+        start_restore = physical not in _pending_restores
+        original = _pending_restores.setdefault(physical, {})
+        for key in overrides:
+            original.setdefault(key, getattr(current, key))
+    try:
+        client.update_collection(physical, optimizers_config=models.OptimizersConfigDiff(**overrides))
+    except Exception:
+        if start_restore:
+            with _restore_lock:
+                _pending_restores.pop(physical, None)
+        raise
+    if start_restore:
+        threading.Thread(target=_restore_when_idle, args=(physical,),
+                         name="bitsai-optimizer-restore", daemon=True).start()
+    return None
+
+def trigger_optimize(collection_name):
+    """暫時把 indexing_threshold 降到最低，讓還沒建 HNSW 的小 segment 也立即建索引，完成後還原"""
+    if not collection_name: return "⚠️ 請先選擇 Collection"
+    try:
+        msg = apply_optimizer_temporarily(collection_name, indexing_threshold=OPTIMIZE_INDEXING_THRESHOLD)
+        return msg or (f"⚙️ 已暫時設定 indexing_threshold={OPTIMIZE_INDEXING_THRESHOLD} KB，所有 segment 會建立 HNSW 索引；"
+                       f"optimizer 完成 (status green) 後自動還原原本的設定 (管理介面需保持開啟)")
+    except Exception as e:
+        return f"❌ 建立索引失敗: {str(e)}"
+
+def trigger_vacuum(collection_name):
+    """大量刪除後暫時降低 vacuum 門檻，讓 optimizer 重寫含大量已刪除資料的 segment，完成後還原"""
+    if not collection_name: return "⚠️ 請先選擇 Collection"
+    try:
+        msg = apply_optimizer_temporarily(collection_name, deleted_threshold=VACUUM_DELETED_THRESHOLD,
+                                          vacuum_min_vector_number=VACUUM_MIN_VECTORS)
+        return msg or (f"🧽 已暫時設定 deleted_threshold={VACUUM_DELETED_THRESHOLD}, "
+                       f"vacuum_min_vector_number={VACUUM_MIN_VECTORS}；optimizer 完成後自動還原 (管理介面需保持開啟)")
+    except Exception as e:
+        return f"❌ Vacuum 失敗: {str(e)}"
+
+# ================= 備份 / 還原 =================
+
+def run_export(collection_name, out_path, progress=gr.Progress()):
+    if not collection_name: return "⚠️ 請先選擇 Collection"
+    if not out_path or not out_path.strip(): return "⚠️ 請輸入匯出檔案路徑"
+    try:
+        start = time.time()
+        n = backup.export_collection(
+            client, collection_name, out_path.strip(),
+            progress=lambda done, total: progress(done / total if total else None, desc=f"匯出 {done} 筆")
+        )
+        size_mb = os.path.getsize(out_path.strip()) / (1024 * 1024)
+        return f"📤 已匯出 {n} 筆至 {out_path.strip()} ({size_mb:.1f} MB)，耗時 {time.time() - start:.1f}s"
+    except Exception as e:
+        return f"❌ 匯出失敗: {str(e)}"
+
+def run_import(in_path, target_collection, alias, progress=gr.Progress()):
+    if not in_path or not in_path.strip(): return "⚠️ 請輸入備份檔案路徑"
+    try:
+        start = time.time()
+        n = backup.import_collection(
+            client, in_path.strip(), target_collection.strip() or None, alias=alias.strip() or None,
+            progress=lambda done, total: progress(done / total if total else None, desc=f"匯入 {done} 筆")
+        )
+        return f"📥 已匯入 {n} 筆，耗時 {time.time() - start:.1f}s"
+    except Exception as e:
+        return f"❌ 匯入失敗: {str(e)}"
+
+# ================= Profiling (API worker) =================
+
+def profile_control(count=None, mode="sample"):
+    """count=None 只查狀態；0 關閉；N 分析該 worker 接下來的 N 個請求 (不需重啟)"""
+    params = {} if count is None else {"next": int(count), "mode": mode}
+    try:
+        r = httpx.get(f"{API_URL}/profile", params=params, timeout=5)
+        r.raise_for_status()
+        st = r.json()
+    except (httpx.HTTPError, ValueError) as e:
+        return f"❌ 無法連線到 BITS-AI API ({API_URL}): {e}"
+    return (f"🔬 worker pid {st['pid']}：剩餘 {st['remaining']} 個請求 ({st['mode']})，"
+            f"分析中 {st['in_flight']} 個，輸出到 `{st['dir']}`")
 
 # ================= UI 介面 =================
 
@@ -144,7 +634,8 @@ with gr.Blocks(title="Qdrant 資料庫管理", theme=gr.themes.Soft(), css=custo
     gr.Markdown("# BitsAI - Qdrant DB Manager")
     
     # === State ===
-    full_data_state = gr.State([]) 
+    row_ids_state = gr.State([]) 
+    page_state = gr.State(new_page_state())
     selected_id_state = gr.State(None)
     
     # --- 1. 頂部操作區 (永遠顯示) ---
@@ -154,8 +645,10 @@ with gr.Blocks(title="Qdrant 資料庫管理", theme=gr.themes.Soft(), css=custo
         with gr.Column(scale=4): 
             with gr.Group():
                 with gr.Row():
-                    search_box = gr.Textbox(label="🔍 搜尋", placeholder="關鍵字...", scale=2)
-                    limit_slider = gr.Slider(5, 200, 20, step=5, label="筆數", scale=2)
+                    search_box = gr.Textbox(label="🔍 搜尋", placeholder="關鍵字 / 檔名 / 問題...", scale=2)
+                    search_mode = gr.Radio(SEARCH_MODES, value=SEARCH_MODES[0], label="搜尋方式", scale=1)
+                    limit_slider = gr.Slider(5, 200, 20, step=5, label="每頁筆數", scale=2)
+                fields_selector = gr.CheckboxGroup(choices=PAYLOAD_FIELDS, value=DISPLAY_FIELDS, label="顯示欄位")
         with gr.Column(scale=1, min_width=150):
             load_btn = gr.Button("🚀 讀取資料", variant="primary")
             refresh_btn = gr.Button("🔄 列表重整")
@@ -186,6 +679,11 @@ with gr.Blocks(title="Qdrant 資料庫管理", theme=gr.themes.Soft(), css=custo
             col_count=(1, "fixed"),
             type="pandas"
         )
+
+        with gr.Row():
+            prev_btn = gr.Button("⬅️ 上一頁", scale=1)
+            page_info_md = gr.Markdown()
+            next_btn = gr.Button("下一頁 ➡️", scale=1)
         
         with gr.Row():
             batch_delete_btn = gr.Button(
@@ -219,64 +717,165 @@ with gr.Blocks(title="Qdrant 資料庫管理", theme=gr.themes.Soft(), css=custo
         #             variant="secondary", 
         #             scale=1
         #         )
+
+    # --- 4. 依條件批次操作 ---
+    with gr.Accordion("🧹 依條件批次操作 (刪除 / 修改 metadata)", open=False):
+        with gr.Row():
+            bulk_source = gr.Textbox(label="source", placeholder="例如 old_paper.pdf")
+            bulk_type = gr.Dropdown(choices=["", "people", "paper", "other"], value="", label="type")
+            bulk_subtype = gr.Textbox(label="subtype")
+            bulk_title = gr.Textbox(label="title")
+        with gr.Row():
+            bulk_ts_from = gr.Textbox(label="timestamp 起", placeholder="2025-01-01")
+            bulk_ts_to = gr.Textbox(label="timestamp 迄", placeholder="2025-06-30 23:59:59")
+        bulk_payload = gr.Code(label="要合併的欄位 (JSON)", language="json", value='{"type": "paper"}', lines=3)
+        with gr.Row():
+            bulk_preview_btn = gr.Button("🔎 預覽筆數")
+            bulk_update_btn = gr.Button("🏷️ 套用欄位更新", variant="secondary")
+            bulk_delete_btn = gr.Button("🗑️ 刪除符合資料", variant="stop", elem_classes=["delete-btn"])
+        bulk_out = gr.Markdown()
+
+    # --- 5. 統計與健康狀態 ---
+    with gr.Accordion("📊 統計與健康狀態", open=False):
+        with gr.Row():
+            stats_btn = gr.Button("🔄 更新統計", variant="primary")
+            optimize_btn = gr.Button("⚙️ 立即建立索引 (完成後還原設定)")
+            vacuum_btn = gr.Button("🧽 Vacuum (大量刪除後，完成後還原設定)")
+        stats_msg = gr.Markdown()
+        stats_out = gr.Markdown()
+
+    # --- 6. 備份 / 還原 (Parquet，含向量，不需重新 embedding) ---
+    with gr.Accordion("💾 備份 / 還原", open=False):
+        with gr.Row():
+            export_path = gr.Textbox(label="匯出檔案", value="lab_knowledge_backup.parquet", scale=3)
+            export_btn = gr.Button("📤 匯出目前 Collection", scale=1)
+        with gr.Row():
+            import_path = gr.Textbox(label="備份檔案", placeholder="lab_knowledge_backup.parquet", scale=2)
+            import_target = gr.Textbox(label="匯入到 Collection (空白 = 備份內名稱；有 alias 時為 <alias>_<時間>)", scale=2)
+            import_alias = gr.Textbox(label="完成後切換 alias (選填)", scale=1)
+            import_btn = gr.Button("📥 匯入", scale=1)
+        backup_out = gr.Markdown()
+
+    # --- 7. Profiling (API 的 chat / 上傳請求) ---
+    with gr.Accordion("🔬 Profiling (接下來 N 個請求，多 worker 時只作用在回應的那個 worker)", open=False):
+        with gr.Row():
+            profile_count = gr.Number(label="請求數", value=5, precision=0, minimum=0)
+            profile_mode = gr.Dropdown(choices=PROFILE_MODES, value="sample", label="模式 (sample = flamegraph)")
+            profile_arm_btn = gr.Button("▶️ 開始", variant="primary")
+            profile_off_btn = gr.Button("⏹️ 關閉")
+            profile_status_btn = gr.Button("🔄 狀態")
+        profile_out = gr.Markdown()
         
     # ================= 事件綁定 =================
     
     refresh_btn.click(lambda: gr.update(choices=get_collections()), outputs=col_selector)
-    
-    # [關鍵修改] load_data 增加了兩個 output 來控制 layout 的 visibility
+
+    page_outputs = [data_table, row_ids_state, page_state, page_info_md, editor_layout, table_layout]
+
+    # 讀取：重設 cursor 並重新計數
+    def run_load(col, limit, search, fields, mode):
+        return load_data(col, limit, search, fields, new_page_state(), mode)
+
     load_btn.click(
-        fn=load_data, 
-        inputs=[col_selector, limit_slider, search_box], 
-        outputs=[data_table, full_data_state, editor_layout, table_layout]
+        fn=run_load, 
+        inputs=[col_selector, limit_slider, search_box, fields_selector, search_mode], 
+        outputs=page_outputs
+    )
+    search_box.submit(
+        fn=run_load,
+        inputs=[col_selector, limit_slider, search_box, fields_selector, search_mode],
+        outputs=page_outputs
     )
+
+    # 翻頁：下一頁用 scroll 回傳的 next_page_offset，上一頁用記錄下來的起始 cursor
+    def run_next(col, limit, search, fields, page, mode):
+        if page["next"] is None:
+            return load_data(col, limit, search, fields, page, mode)
+        page["offsets"] = page["offsets"][:page["index"] + 1] + [page["next"]]
+        page["index"] += 1
+        return load_data(col, limit, search, fields, page, mode)
+
+    def run_prev(col, limit, search, fields, page, mode):
+        page["index"] = max(page["index"] - 1, 0)
+        return load_data(col, limit, search, fields, page, mode)
+
+    page_inputs = [col_selector, limit_slider, search_box, fields_selector, page_state, search_mode]
+    next_btn.click(fn=run_next, inputs=page_inputs, outputs=page_outputs)
+    prev_btn.click(fn=run_prev, inputs=page_inputs, outputs=page_outputs)
     
-    # 表格選取事件
-    def on_select(evt: gr.SelectData, full_data):
-        if not full_data: return None, None, "{}"
+    # 表格選取事件：只在點選時讀取該筆完整 payload
+    def on_select(evt: gr.SelectData, col, row_ids):
+        if not row_ids: return None, None, "{}"
         row_index = evt.index[0]
-        if row_index < len(full_data):
-            item = full_data[row_index]
-            target_id = item.get("id", "")
-            payload = {k: v for k, v in item.items() if k != 'id'}
+        if row_index < len(row_ids):
+            target_id = row_ids[row_index]
+            payload = load_point(col, target_id)
+            if payload is None:
+                return None, None, "{}"
             return target_id, target_id, json.dumps(payload, indent=4, ensure_ascii=False)
         return None, None, "{}"
 
     data_table.select(
         on_select, 
-        inputs=[full_data_state],
+        inputs=[col_selector, row_ids_state],
         outputs=[selected_id_state, id_display, json_editor]
     )
 
     # 儲存事件
-    def run_save(col, tid, json_txt, current_search, current_limit):
+    def run_save(col, tid, json_txt, current_limit, current_search, fields, page, mode):
         msg = save_payload(col, tid, json_txt)
         print(f"[Save] {msg}")
-        # 儲存後重新載入，並保持介面顯示 (True, True)
-        new_df, new_full, _, _ = load_data(col, current_limit, current_search) 
-        return new_df, new_full
+        # 儲存後只重新讀取目前這一頁
+        new_df, new_ids, page, info, _, _ = load_data(col, current_limit, current_search, fields, page, mode)
+        return new_df, new_ids, page, info
 
     save_btn.click(
         fn=run_save,
-        inputs=[col_selector, selected_id_state, json_editor, search_box, limit_slider],
-        outputs=[data_table, full_data_state]
+        inputs=[col_selector, selected_id_state, json_editor, limit_slider, search_box, fields_selector, page_state,
+                search_mode],
+        outputs=[data_table, row_ids_state, page_state, page_info_md]
     )
 
     # 刪除事件
-    def run_batch_delete(col, df, current_search, current_limit):
+    def run_batch_delete(col, df, current_limit, current_search, fields, page, mode):
         msg = batch_delete_data(col, df)
         print(f"[Batch Delete] {msg}") 
         
-        # 刪除後重新載入，load_data 會自動判斷是否還有資料來決定是否隱藏
-        new_df, new_full, show_editor, show_table = load_data(col, current_limit, current_search)
+        # 刪除後重新計數並讀取目前這一頁，load_data 會自動判斷是否還有資料來決定是否隱藏
+        page["total"] = None
+        results = load_data(col, current_limit, current_search, fields, page, mode)
         
-        return new_df, new_full, show_editor, show_table, None, "", "{}"
+        return (*results, None, "", "{}")
 
     batch_delete_btn.click(
         fn=run_batch_delete,
-        inputs=[col_selector, data_table, search_box, limit_slider],
-        outputs=[data_table, full_data_state, editor_layout, table_layout, selected_id_state, id_display, json_editor]
+        inputs=[col_selector, data_table, limit_slider, search_box, fields_selector, page_state, search_mode],
+        outputs=page_outputs + [selected_id_state, id_display, json_editor]
+    )
+
+    # 批次操作事件
+    bulk_conditions = [bulk_source, bulk_type, bulk_subtype, bulk_title, bulk_ts_from, bulk_ts_to]
+    bulk_preview_btn.click(fn=preview_bulk, inputs=[col_selector] + bulk_conditions, outputs=bulk_out)
+    bulk_delete_btn.click(fn=bulk_delete, inputs=[col_selector] + bulk_conditions, outputs=bulk_out)
+    bulk_update_btn.click(fn=bulk_set_payload, inputs=[col_selector, bulk_payload] + bulk_conditions, outputs=bulk_out)
+
+    # 統計事件 (最佳化 / vacuum 後重新讀取統計)
+    stats_btn.click(fn=collection_stats, inputs=col_selector, outputs=stats_out)
+    optimize_btn.click(fn=trigger_optimize, inputs=col_selector, outputs=stats_msg).then(
+        collection_stats, inputs=col_selector, outputs=stats_out)
+    vacuum_btn.click(fn=trigger_vacuum, inputs=col_selector, outputs=stats_msg).then(
+        collection_stats, inputs=col_selector, outputs=stats_out)
+
+    # 備份 / 還原事件
+    export_btn.click(fn=run_export, inputs=[col_selector, export_path], outputs=backup_out)
+    import_btn.click(fn=run_import, inputs=[import_path, import_target, import_alias], outputs=backup_out).then(
+        lambda: gr.update(choices=get_collections()), outputs=col_selector
     )
 
+    # Profiling 事件
+    profile_arm_btn.click(fn=profile_control, inputs=[profile_count, profile_mode], outputs=profile_out)
+    profile_off_btn.click(fn=lambda mode: profile_control(0, mode), inputs=profile_mode, outputs=profile_out)
+    profile_status_btn.click(fn=profile_control, outputs=profile_out)
+
 if __name__ == "__main__":
-    demo.launch(server_name="0.0.0.0", server_port=7860)
\ No newline at end of file
+    demo.launch(server_name="0.0.0.0", server_port=7860)
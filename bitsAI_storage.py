@@ -0,0 +1,589 @@
+import os
+import re
+import json
+import time
+import fnmatch
+import hashlib
+import threading
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import duckdb
+
+# ============================================================
+# ⚙️ 表格資料中心路徑設定
+# ============================================================
+STORAGE_DIR = os.path.abspath("data_storage").replace("\\", "/")
+COLUMNAR_DIR = os.path.abspath("data_columnar").replace("\\", "/")  # 轉換後的 Parquet 檔
+os.makedirs(STORAGE_DIR, exist_ok=True)
+os.makedirs(COLUMNAR_DIR, exist_ok=True)
+
+CONVERTIBLE_EXTS = {".csv", ".tsv"}
+PARQUET_EXTS = {".parquet"}
+
+INDEX_RESCAN_SECONDS = 30    # 目錄 mtime 沒變時，多久強制重掃一次 (抓原地覆寫的檔案)
+
+CATALOG_PATH = f"{COLUMNAR_DIR}/schema_catalog.json"
+CATALOG_SAMPLE_VALUES = 3     # 每個欄位保留幾個範例值
+CATALOG_SAMPLE_CHARS = 24     # 範例值最長字元數
+
+# ============================================================
+# 🗂️ 目錄索引 (scandir + stat 快取)
+# ============================================================
+class StorageIndex:
+    """
+    data_storage 的檔案索引：{檔名: {"size", "mtime"}}。
+    - 目錄 mtime 沒變 (沒有新增 / 刪除 / 改名) 就直接用快取，不再逐檔 stat
+    - 上傳流程透過 file_changed() 個別更新，原地覆寫的檔案也會定期重掃補上
+    - . 開頭的檔案 (上傳中的暫存檔) 不列入
+    """
+
+    def __init__(self, root: str, rescan_seconds: float = INDEX_RESCAN_SECONDS):
+        self.root = root
+        self.rescan_seconds = rescan_seconds
+        self._entries = {}
+        self._dir_mtime = None
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force: bool = False) -> dict:
+        try:
+            dir_mtime = os.stat(self.root).st_mtime
+        except OSError:
+            dir_mtime = None
+        with self._lock:
+            fresh = time.time() - self._scanned_at < self.rescan_seconds
+            if not force and fresh and dir_mtime == self._dir_mtime:
+                return self._entries
+
+            entries = {}
+            try:
+                with os.scandir(self.root) as it:
+                    for entry in it:
+                        try:
+                            if entry.name.startswith(".") or not entry.is_file():
+                                continue
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        entries[entry.name] = {"size": st.st_size, "mtime": st.st_mtime}
+            except FileNotFoundError:
+                pass
+            self._entries, self._dir_mtime, self._scanned_at = entries, dir_mtime, time.time()
+            return entries
+
+    def touch(self, path: str):
+        """單一檔案新增 / 覆寫後更新索引"""
+        name = os.path.basename(path)
+        try:
+            st = os.stat(os.path.join(self.root, name))
+        except OSError:
+            self.remove(name)
+            return
+        with self._lock:
+            self._entries = {**self._entries, name: {"size": st.st_size, "mtime": st.st_mtime}}
+
+    def remove(self, name: str):
+        with self._lock:
+            if name in self._entries:
+                self._entries = {k: v for k, v in self._entries.items() if k != name}
+
+    def names(self) -> list[str]:
+        return list(self.refresh())
+
+    def lookup(self, name: str):
+        """大小寫不敏感地找出實際檔名"""
+        entries = self.refresh()
+        if name in entries:
+            return name
+        lowered = name.lower()
+        return next((n for n in entries if n.lower() == lowered), None)
+
+    def query(self, pattern: str = "", sort_by: str = "name", descending: bool = False,
+              offset: int = 0, limit: int = 20):
+        """
+        pattern 含 * ? [ 時當作 glob，否則當作檔名前綴 (皆不分大小寫)。
+        回傳 (符合的總數, 這一頁的 [(檔名, 資訊)])
+        """
+        items = list(self.refresh().items())
+        if pattern:
+            pat = pattern.lower()
+            if any(ch in pat for ch in "*?["):
+                items = [(n, e) for n, e in items if fnmatch.fnmatch(n.lower(), pat)]
+            else:
+                items = [(n, e) for n, e in items if n.lower().startswith(pat)]
+
+        if sort_by in ("size", "mtime"):
+            items.sort(key=lambda x: x[1][sort_by], reverse=descending)
+        else:
+            items.sort(key=lambda x: x[0].lower(), reverse=descending)
+        offset = max(offset, 0)
+        return len(items), items[offset:offset + max(limit, 0)]
+
+    def summary(self, newest: int = 5) -> dict:
+        entries = self.refresh()
+        recent = sorted(entries.items(), key=lambda x: x[1]["mtime"], reverse=True)[:newest]
+        return {
+            "count": len(entries),
+            "total_size": sum(e["size"] for e in entries.values()),
+            "newest": recent,
+        }
+
+
+storage_index = StorageIndex(STORAGE_DIR)
+
+# ============================================================
+# 🧱 Columnar 轉換 (CSV → Parquet)
+# ============================================================
+_convert_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bitsai-columnar")
+_listeners = []
+
+def view_name_for(filename: str) -> str:
+    """CSV_1.csv -> CSV_1 (只保留可當作 SQL 識別字的字元)"""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return re.sub(r"[^0-9A-Za-z_]", "_", stem)
+
+def parquet_path_for(filename: str) -> str:
+    name = os.path.basename(filename)
+    if os.path.splitext(name)[1].lower() in PARQUET_EXTS:
+        return f"{STORAGE_DIR}/{name}"
+    return f"{COLUMNAR_DIR}/{name}.parquet"
+
+def is_columnar_fresh(source_path: str) -> bool:
+    """Parquet 存在且比原始檔新"""
+    target = parquet_path_for(source_path)
+    try:
+        return os.path.getmtime(target) >= os.path.getmtime(source_path)
+    except OSError:
+        return False
+
+_change_listeners = []
+
+def on_converted(callback):
+    """註冊轉換完成的 callback(filename, parquet_path)，例如讓 MCP session 註冊 view"""
+    _listeners.append(callback)
+
+def on_file_changed(callback):
+    """註冊檔案新增 / 覆寫的 callback(filename)，例如清掉相關的查詢快取"""
+    _change_listeners.append(callback)
+
+def convert_to_parquet(source_path: str) -> str:
+    """用內嵌 DuckDB 把 CSV 轉成 Parquet；已是最新就略過"""
+    source_path = source_path.replace("\\", "/")
+    target = parquet_path_for(source_path)
+    if is_columnar_fresh(source_path):
+        return target
+
+    # 同一個檔案可能同時有兩個轉換 (重新上傳 / 背景掃描)，暫存檔名不能撞在一起
+    tmp_target = f"{target}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    with duckdb.connect(":memory:") as con:
+        con.execute(
+            f"COPY (SELECT * FROM read_csv_auto(?)) TO '{tmp_target}' (FORMAT PARQUET, COMPRESSION ZSTD)",
+            [source_path],
+        )
+    os.replace(tmp_target, target)
+    print(f"🧱 [Columnar] {os.path.basename(source_path)} → {os.path.basename(target)}")
+    return target
+
+def _convert_and_notify(source_path: str, force: bool = False):
+    try:
+        ext = os.path.splitext(source_path)[1].lower()
+        target = source_path if ext in PARQUET_EXTS else convert_to_parquet(source_path)
+        update_catalog(source_path, target, force=force)
+    except Exception as e:
+        print(f"❌ [Columnar] {os.path.basename(source_path)} 轉換失敗: {e}")
+        return None
+
+    filename = os.path.basename(source_path)
+    for cb in list(_listeners):
+        try:
+            cb(filename, target)
+        except Exception as e:
+            print(f"⚠️ [Columnar] listener error: {e}")
+    return target
+
+def schedule_conversion(source_path: str, force: bool = False):
+    """在背景轉換，回傳 Future；不支援的格式回傳 None。force=True 時不沿用 catalog 既有的 profile"""
+    ext = os.path.splitext(source_path)[1].lower()
+    if ext not in CONVERTIBLE_EXTS | PARQUET_EXTS:
+        return None
+    return _convert_executor.submit(_convert_and_notify, source_path, force)
+
+def _drop_stale_columnar(path: str):
+    """
+    內容已換掉的檔案先刪掉舊的 Parquet 副本：去重上傳會 hardlink 到既有檔案，
+    mtime 是舊檔的，可能比上一版的 Parquet 還舊，只比 mtime 會把舊 Parquet 當成最新
+    """
+    if os.path.splitext(path)[1].lower() not in CONVERTIBLE_EXTS:
+        return
+    try:
+        os.remove(parquet_path_for(path))
+    except FileNotFoundError:
+        pass
+
+def file_changed(path: str):
+    """data_storage 內的檔案被新增或覆寫：通知 listener 並排程背景轉換"""
+    filename = os.path.basename(path)
+    _drop_stale_columnar(path)
+    storage_index.touch(path)
+    for cb in list(_change_listeners):
+        try:
+            cb(filename)
+        except Exception as e:
+            print(f"⚠️ [Storage] change listener error: {e}")
+    return schedule_conversion(path, force=True)
+
+def scan_storage():
+    """啟動時補轉換尚未轉成 Parquet 或尚未建立 schema 的檔案，並移除已刪檔案的 catalog"""
+    futures = []
+    present = storage_index.refresh(force=True)
+    for name in present:
+        path = f"{STORAGE_DIR}/{name}"
+        try:
+            current = is_columnar_fresh(path) and _catalog_is_current(name, os.stat(path))
+        except OSError:
+            continue
+        if not current:
+            fut = schedule_conversion(path)
+            if fut:
+                futures.append(fut)
+    with _catalog_lock:
+        removed = set(_catalog) - set(present)
+        for name in removed:
+            del _catalog[name]
+        _save_catalog(removed=removed)
+    return futures
+
+# ============================================================
+# 📥 上傳寫入 (hardlink / 串流複製 + 去重)
+# ============================================================
+COPY_CHUNK_BYTES = 4 << 20    # 串流複製的區塊大小
+_hash_cache = {}              # {檔名: (size, mtime, sha1)}
+_hash_lock = threading.Lock()
+
+def cached_hash(path: str, st=None) -> str:
+    """同一個檔名 size / mtime 沒變就不重算 sha1"""
+    name = os.path.basename(path)
+    st = st or os.stat(path)
+    with _hash_lock:
+        cached = _hash_cache.get(name)
+    if cached and cached[:2] == (st.st_size, st.st_mtime):
+        return cached[2]
+    digest = file_hash(path)
+    _remember_hash(name, st, digest)
+    return digest
+
+def _remember_hash(name: str, st, digest: str):
+    with _hash_lock:
+        _hash_cache[name] = (st.st_size, st.st_mtime, digest)
+
+def _stream_copy(src: str, dst: str) -> str:
+    """邊複製邊算 sha1，只讀一次來源檔"""
+    h = hashlib.sha1()
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        for block in iter(lambda: fin.read(COPY_CHUNK_BYTES), b""):
+            h.update(block)
+            fout.write(block)
+    return h.hexdigest()
+
+def _find_duplicate(src: str, size: int, filename: str):
+    """
+    先用檔案大小過濾，只有同大小的既有檔案才需要算 hash (同名檔優先比對)。
+    回傳 (來源 sha1 或 None, 內容相同的既有檔名或 None)
+    """
+    candidates = sorted((n for n, e in storage_index.refresh().items() if e["size"] == size),
+                        key=lambda n: n != filename)
+    if not candidates:
+        return None, None
+    digest = file_hash(src)
+    for name in candidates:
+        try:
+            if cached_hash(f"{STORAGE_DIR}/{name}") == digest:
+                return digest, name
+        except OSError:
+            continue
+    return digest, None
+
+def ingest_file(src: str, filename: str = None, st=None) -> dict:
+    """
+    把上傳暫存檔放進 data_storage：
+    - 內容與同名檔相同 → 略過 (不觸發快取失效與重新轉換)
+    - 內容與其他檔案相同 → hardlink 到既有檔案，不佔額外空間
+    - 同一個檔案系統 → hardlink，不搬動任何資料
+    - 跨檔案系統 → 串流複製並同時計算 sha1
+    一律先寫入暫存名再 os.replace，覆寫時不會讓查詢讀到一半的檔案。
+    回傳 {"file", "status", "bytes", "seconds"}
+    """
+    started = time.perf_counter()
+    filename = os.path.basename(filename or src)
+    st = st or os.stat(src)
+    dest = f"{STORAGE_DIR}/{filename}"
+    tmp = f"{STORAGE_DIR}/.{filename}.{threading.get_ident()}.part"
+
+    digest, duplicate = _find_duplicate(src, st.st_size, filename)
+    if duplicate == filename:
+        status = "unchanged"
+    else:
+        try:
+            os.link(f"{STORAGE_DIR}/{duplicate}" if duplicate else src, tmp)
+            status = "deduplicated" if duplicate else "linked"
+        except OSError:
+            digest = _stream_copy(src, tmp)
+            status = "copied"
+        os.replace(tmp, dest)
+        if digest:
+            _remember_hash(filename, os.stat(dest), digest)
+        file_changed(dest)
+
+    return {
+        "file": filename,
+        "status": status,
+        "bytes": st.st_size,
+        "seconds": time.perf_counter() - started,
+    }
+
+# ============================================================
+# 📇 Schema Catalog (欄位 / 型別 / 筆數 / 範例值)
+# ============================================================
+_catalog_lock = threading.Lock()
+CATALOG_LOCK_TIMEOUT = 10     # 其他行程持有 catalog 檔案鎖超過幾秒視為殘留，直接移除
+
+def _load_catalog() -> dict:
+    try:
+        with open(CATALOG_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _catalog_stamp():
+    try:
+        st = os.stat(CATALOG_PATH)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+_catalog_loaded = _catalog_stamp()   # 上次載入時 schema_catalog.json 的 (mtime, size)
+_catalog = _load_catalog()
+
+@contextmanager
+def _catalog_file_lock():
+    """跨行程的檔案鎖 (O_EXCL 建立 .lock 檔)，多個 API worker 不會同時改寫 schema_catalog.json"""
+    lock_path = CATALOG_PATH + ".lock"
+    deadline = time.time() + CATALOG_LOCK_TIMEOUT
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.time() > deadline:
+                print(f"⚠️ [Catalog] 移除殘留的檔案鎖 {lock_path}")
+                try:
+                    os.remove(lock_path)
+                except OSError:
+                    pass
+                deadline = time.time() + CATALOG_LOCK_TIMEOUT
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock_path)
+
+def _save_catalog(changed=(), removed=()):
+    """
+    只把這次變動的檔名寫回：在檔案鎖內重新讀取磁碟上的 catalog (其他 worker 可能剛寫過)，
+    套用 changed / removed 後再寫入，不會蓋掉別的行程新增的項目。呼叫端需持有 _catalog_lock
+    """
+    if not changed and not removed:
+        return
+    with _catalog_file_lock():
+        on_disk = _load_catalog()
+        for name in changed:
+            on_disk[name] = _catalog[name]
+        for name in removed:
+            on_disk.pop(name, None)
+        tmp = f"{CATALOG_PATH}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(on_disk, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, CATALOG_PATH)
+
+def refresh_catalog() -> bool:
+    """
+    其他行程改過 schema_catalog.json 時重新載入 (只比對檔案 mtime / size，沒變就不讀檔)：
+    新增或變動的檔案照常通知 on_file_changed / on_converted listener (清查詢快取、註冊 view)
+    """
+    global _catalog_loaded
+    stamp = _catalog_stamp()
+    if stamp == _catalog_loaded:
+        return False
+    with _catalog_lock:
+        if stamp == _catalog_loaded:
+            return False
+        _catalog_loaded = stamp
+        on_disk = _load_catalog()
+        changed = [name for name, entry in on_disk.items() if _catalog.get(name) != entry]
+        removed = [name for name in _catalog if name not in on_disk]
+        _catalog.clear()
+        _catalog.update(on_disk)
+
+    for name in changed + removed:
+        storage_index.touch(f"{STORAGE_DIR}/{name}")
+        for cb in list(_change_listeners):
+            try:
+                cb(name)
+            except Exception as e:
+                print(f"⚠️ [Storage] change listener error: {e}")
+    for name in changed:
+        for cb in list(_listeners):
+            try:
+                cb(name, parquet_path_for(name))
+            except Exception as e:
+                print(f"⚠️ [Columnar] listener error: {e}")
+    if changed or removed:
+        print(f"📇 [Catalog] 其他行程更新了 catalog：{len(changed)} 個檔案變動，{len(removed)} 個移除")
+    return True
+
+def _catalog_is_current(filename: str, st) -> bool:
+    entry = _catalog.get(filename)
+    return bool(entry) and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _short(value) -> str:
+    text = str(value)
+    return text if len(text) <= CATALOG_SAMPLE_CHARS else text[:CATALOG_SAMPLE_CHARS] + "…"
+
+def profile_table(parquet_path: str) -> dict:
+    """用 DuckDB 讀 Parquet metadata 取得欄位、型別、筆數與少量範例值"""
+    with duckdb.connect(":memory:") as con:
+        rel = f"read_parquet('{parquet_path}')"
+        described = con.execute(f"DESCRIBE SELECT * FROM {rel}").fetchall()
+        row_count = con.execute(f"SELECT COUNT(*) FROM {rel}").fetchone()[0]
+        sample_rows = con.execute(f"SELECT * FROM {rel} LIMIT 50").fetchall()
+
+    columns = []
+    for idx, (col_name, col_type, *_rest) in enumerate(described):
+        samples = []
+        for row in sample_rows:
+            value = row[idx]
+            if value is None or _short(value) in samples:
+                continue
+            samples.append(_short(value))
+            if len(samples) >= CATALOG_SAMPLE_VALUES:
+                break
+        columns.append({"name": col_name, "type": col_type, "samples": samples})
+    return {"rows": row_count, "columns": columns}
+
+def update_catalog(source_path: str, parquet_path: str = None, force: bool = False) -> dict:
+    """檔案有變動 (mtime/size) 才重新 profile；force=True (剛寫入的檔案) 一律重新 profile"""
+    filename = os.path.basename(source_path)
+    st = os.stat(source_path)
+    with _catalog_lock:
+        if not force and _catalog_is_current(filename, st):
+            return _catalog[filename]
+
+    entry = {
+        "file": filename,
+        "path": f"{STORAGE_DIR}/{filename}",
+        "view": view_name_for(filename),
+        "mtime": st.st_mtime,
+        "size": st.st_size,
+        "sha1": cached_hash(source_path, st),
+        **profile_table(parquet_path or parquet_path_for(filename)),
+    }
+    with _catalog_lock:
+        _catalog[filename] = entry
+        _save_catalog(changed=[filename])
+    print(f"📇 [Catalog] {filename}: {entry['rows']} rows, {len(entry['columns'])} columns")
+    return entry
+
+def get_catalog() -> dict:
+    refresh_catalog()
+    with _catalog_lock:
+        return dict(_catalog)
+
+def remove_from_catalog(filename: str):
+    with _catalog_lock:
+        if _catalog.pop(filename, None) is not None:
+            _save_catalog(removed=[filename])
+
+def format_catalog_entry(entry: dict, with_samples: bool = True) -> str:
+    """壓縮成一行，方便塞進 prompt"""
+    cols = []
+    for c in entry["columns"]:
+        text = f"{c['name']} {c['type']}"
+        if with_samples and c["samples"]:
+            text += f" [e.g. {', '.join(c['samples'])}]"
+        cols.append(text)
+    return (f"- {entry['file']} (path '{entry['path']}', view \"{entry['view']}\", "
+            f"{entry['rows']} rows): " + "; ".join(cols))
+
+_WORD_RE = re.compile(r"[0-9A-Za-z_\u4e00-\u9fff]+")
+
+def catalog_slice(question: str, max_files: int = 3, with_samples: bool = True) -> str:
+    """
+    挑出與問題相關的檔案 schema：
+    1. 問題中直接提到的檔名 / 檔名主幹
+    2. 欄位名稱出現在問題裡的檔案
+    3. 都沒有時給最近更新的幾個檔案
+    """
+    catalog = get_catalog()
+    if not catalog:
+        return ""
+
+    q_lower = question.lower()
+    words = {w.lower() for w in _WORD_RE.findall(question)}
+    scored = []
+    for name, entry in catalog.items():
+        score = 0
+        if name.lower() in q_lower:
+            score += 10
+        elif os.path.splitext(name)[0].lower() in words:
+            score += 8
+        score += sum(1 for c in entry["columns"] if c["name"].lower() in words)
+        scored.append((score, entry["mtime"], entry))
+
+    scored.sort(key=lambda x: (x[0], x[1]), reverse=True)
+    relevant = [e for score, _, e in scored if score > 0][:max_files]
+    if not relevant:
+        relevant = [e for _, _, e in scored[:max_files]]
+    return "\n".join(format_catalog_entry(e, with_samples) for e in relevant)
+
+# ============================================================
+# 🔀 查詢改寫與 View 註冊
+# ============================================================
+def columnar_tables(names=None) -> dict:
+    """{原始檔名: parquet 路徑}，只列出已是最新的檔案 (names 指定時只檢查這些檔案)"""
+    tables = {}
+    for name in (storage_index.names() if names is None else names):
+        ext = os.path.splitext(name)[1].lower()
+        if ext in PARQUET_EXTS or (ext in CONVERTIBLE_EXTS and is_columnar_fresh(f"{STORAGE_DIR}/{name}")):
+            tables[name] = parquet_path_for(name)
+    return tables
+
+def view_sql(filename: str, parquet_path: str) -> str:
+    return f'CREATE OR REPLACE VIEW "{view_name_for(filename)}" AS SELECT * FROM read_parquet(\'{parquet_path}\')'
+
+def view_registration_sql(names=None) -> list[str]:
+    return [view_sql(name, path) for name, path in columnar_tables(names).items()]
+
+# read_csv('/.../data_storage/x.csv') 或 read_csv_auto(...)，只改寫沒有額外參數的呼叫
+_READ_CSV_RE = re.compile(r"read_csv(?:_auto)?\(\s*'([^']+)'\s*\)", re.IGNORECASE)
+
+def rewrite_to_columnar(sql: str) -> str:
+    """把指向 data_storage CSV 的 read_csv(...) 改成讀取對應的 Parquet"""
+    def _swap(match):
+        path = match.group(1).replace("\\", "/")
+        if os.path.dirname(path) != STORAGE_DIR:
+            return match.group(0)
+        if os.path.splitext(path)[1].lower() not in CONVERTIBLE_EXTS or not is_columnar_fresh(path):
+            return match.group(0)
+        return f"read_parquet('{parquet_path_for(path)}')"
+
+    return _READ_CSV_RE.sub(_swap, sql)
@@ -1,21 +1,30 @@
 import os
+import re
 import sys
 import json
-import psutil
-import GPUtil
-import pynvml
+import time
+import uuid
+import shlex
+import tempfile
 from datetime import datetime
 from langchain_core.tools import tool, StructuredTool
 import asyncio
+import atexit
+import threading
+import concurrent.futures
+from enum import Enum
+from collections import OrderedDict
 from contextlib import AsyncExitStack
 
+import duckdb
+
 # === MCP Imports ===
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 
-STORAGE_DIR = os.path.abspath("data_storage").replace("\\", "/")
-if not os.path.exists(STORAGE_DIR):
-    os.makedirs(STORAGE_DIR)
+import bitsAI_storage as storage
+from bitsAI_storage import STORAGE_DIR
+from bitsAI_monitor import get_sampler
 
 # ============================================================
 # 🧩 本地工具定義 (保持不變)
@@ -24,9 +33,9 @@ if not os.path.exists(STORAGE_DIR):
 @tool("system_info")
 def system_info() -> str:
     """CPU and RAM usage"""
-    mem = psutil.virtual_memory()
-    return (f"🖥️ CPU: {psutil.cpu_count()} cores, Usage: {psutil.cpu_percent()}%\n"
-            f"💾 RAM: {mem.used / 1e9:.2f}/{mem.total / 1e9:.2f} GB")
+    s = get_sampler().latest()
+    return (f"🖥️ CPU: {get_sampler().backend.cpu_count()} cores, Usage: {s['cpu']}%\n"
+            f"💾 RAM: {s['ram_used'] / 1e9:.2f}/{s['ram_total'] / 1e9:.2f} GB")
 
 @tool("get_time")
 def get_time() -> str:
@@ -38,84 +47,33 @@ def get_time() -> str:
 @tool("gpu_info")
 def gpu_info() -> str:
     """Get NVIDIA GPU status (Load, Memory, Temperature)"""
-    try:
-        gpus = GPUtil.getGPUs()
-        if not gpus:
-            return "❌ No NVIDIA GPU detected."
-        
-        info = []
-        for gpu in gpus:
-            used_gb = gpu.memoryUsed / 1024
-            total_gb = gpu.memoryTotal / 1024
-            gpu_status = (f"🎮 GPU: {gpu.name} | Load: {gpu.load*100:.1f}% | "
-                          f"Temp: {gpu.temperature}°C | "
-                          f"Mem: {used_gb:.2f}/{total_gb:.2f} GB")
-            info.append(gpu_status)
-        return "\n".join(info)
-    except Exception as e:
-        return f"⚠️ Could not retrieve GPU info: {str(e)}"
+    gpus = get_sampler().latest()["gpus"]
+    if not gpus:
+        return "❌ No NVIDIA GPU detected."
+
+    info = []
+    for gpu in gpus:
+        used_gb = gpu["mem_used"] / 1024 ** 3
+        total_gb = gpu["mem_total"] / 1024 ** 3
+        gpu_status = (f"🎮 GPU: {gpu['name']} | Load: {gpu['load']:.1f}% | "
+                      f"Temp: {gpu['temp']}°C | "
+                      f"Mem: {used_gb:.2f}/{total_gb:.2f} GB")
+        info.append(gpu_status)
+    return "\n".join(info)
 
 @tool("disk_info")
 def disk_info() -> str:
     """Get Disk/Storage usage for the root directory"""
-    usage = psutil.disk_usage('/')
-    return (f"💽 Disk: {usage.used / 1e9:.2f}/{usage.total / 1e9:.2f} GB "
-            f"({usage.percent}% used)")
+    s = get_sampler().latest()
+    return (f"💽 Disk: {s['disk_used'] / 1e9:.2f}/{s['disk_total'] / 1e9:.2f} GB "
+            f"({s['disk_pct']}% used)")
 
 @tool("resource_monitor")
 def resource_monitor() -> str:
     """Identify top CPU, RAM, and GPU consuming processes and their scripts."""
-    processes = []
-    
-    # 1. 取得 CPU 與 RAM 的行程資訊
-    for proc in psutil.process_iter(['pid', 'name', 'username', 'cpu_percent', 'memory_info', 'cmdline']):
-        try:
-            info = proc.info
-            cmdline = " ".join(info['cmdline']) if info['cmdline'] else ""
-            is_script = any(ext in cmdline.lower() for ext in ['.py', '.sh', '.r', '.pl', '.ipynb', 'python', 'node'])
-            
-            processes.append({
-                'pid': info['pid'],
-                'user': info['username'],
-                'name': info['name'],
-                'cpu': info['cpu_percent'],
-                'mem': info['memory_info'].rss / 1e9,
-                'script': cmdline if is_script else None,
-                'gpu_mem': 0,
-                'gpu_id': None
-            })
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            pass
-
-    # 2. 取得 GPU 行程資訊 (使用 NVML)
-    gpu_processes = []
-    try:
-        pynvml.nvmlInit()
-        device_count = pynvml.nvmlDeviceGetCount()
-        for i in range(device_count):
-            handle = pynvml.nvmlDeviceGetHandleByIndex(i)
-            procs = pynvml.nvmlDeviceGetComputeRunningProcesses(handle)
-            for p in procs:
-                gpu_processes.append({
-                    'pid': p.pid,
-                    'gpu_id': i,
-                    'gpu_mem': p.usedGpuMemory / 1e9 
-                })
-        pynvml.nvmlShutdown()
-    except Exception:
-        pass 
-
-    # 3. 將 GPU 數據合併回主列表
-    for gp in gpu_processes:
-        for p in processes:
-            if p['pid'] == gp['pid']:
-                p['gpu_mem'] = gp['gpu_mem']
-                p['gpu_id'] = gp['gpu_id']
-
-    # 4. 排序並產出結果
-    top_cpu = sorted(processes, key=lambda x: x['cpu'], reverse=True)[:3]
-    top_mem = sorted(processes, key=lambda x: x['mem'], reverse=True)[:3]
-    top_gpu = sorted([p for p in processes if p['gpu_mem'] > 0], key=lambda x: x['gpu_mem'], reverse=True)[:3]
+    # 背景 sampler 已經整理好排行榜，這裡只負責排版
+    top = get_sampler().top_processes()
+    top_cpu, top_mem, top_gpu = top["top_cpu"][:3], top["top_mem"][:3], top["top_gpu"][:3]
 
     result = ["📊 **Resource Consumption Leaderboard**"]
     
@@ -127,43 +85,841 @@ def resource_monitor() -> str:
     result.append("\n🧠 Top 3 RAM Usage:")
     for p in top_mem:
         s = f" (📜 {p['script'][:40]}...)" if p['script'] else ""
-        result.append(f"- User: {p['user']} | Mem: {p['mem']:.2f} GB | Proc: {p['name']}{s}")
+        result.append(f"- User: {p['user']} | Mem: {p['mem'] / 1e9:.2f} GB | Proc: {p['name']}{s}")
 
     if top_gpu:
         result.append("\n🎮 Top 3 GPU Usage:")
         for p in top_gpu:
             s = f" (📜 {p['script'][:40]}...)" if p['script'] else ""
-            result.append(f"- User: {p['user']} | GPU[{p['gpu_id']}] VRAM: {p['gpu_mem']:.2f} GB | Proc: {p['name']}{s}")
+            result.append(f"- User: {p['user']} | GPU[{p['gpu_id']}] VRAM: {p['gpu_mem'] / 1e9:.2f} GB | Proc: {p['name']}{s}")
     else:
         result.append("\n🎮 GPU Usage: No active GPU compute processes found.")
 
     return "\n".join(result)
 
+@tool("metrics_history")
+def metrics_history(minutes: float = 10) -> str:
+    """
+    Average / max / min of CPU, RAM, Disk and GPU usage over the last N minutes.
+    Use this for questions like "average CPU over the last 10 minutes" or "was the GPU busy in the past hour".
+    """
+    summary = get_sampler().summary(max(minutes, 0) * 60)
+
+    def fmt(name, st, unit="%"):
+        return f"{name}: avg {st['avg']:.1f}{unit} | max {st['max']:.1f}{unit} | min {st['min']:.1f}{unit}"
+
+    result = [f"📈 **Last {minutes:g} min** ({summary['samples']} samples over {summary['span'] / 60:.1f} min)",
+              "- " + fmt("🖥️ CPU", summary["cpu"]),
+              "- " + fmt("💾 RAM", summary["ram_pct"]),
+              "- " + fmt("💽 Disk", summary["disk_pct"])]
+    for gid, g in summary["gpus"].items():
+        result.append(f"- {fmt(f'🎮 GPU[{gid}] Load', g['load'])} | temp max {g['temp']['max']:.0f}°C")
+    return "\n".join(result)
+
+LIST_PAGE_SIZE = 20          # list_storage_files 每頁最多幾個檔案
+LIST_NEWEST = 5              # 摘要中列出的最新檔案數
+
+def _format_file_line(name: str, info: dict, catalog: dict) -> str:
+    size = info["size"] / (1024 * 1024)
+    modified = datetime.fromtimestamp(info["mtime"]).strftime("%Y-%m-%d %H:%M")
+    entry = catalog.get(name)
+    if entry:
+        return f"- {name} ({size:.4f} MB, {modified}, {entry['rows']} rows, {len(entry['columns'])} cols)"
+    return f"- {name} ({size:.4f} MB, {modified})"
+
 @tool("list_storage_files")
-def list_storage_files() -> str:
+def list_storage_files(pattern: str = "", sort_by: str = "", descending: bool = False,
+                       offset: int = 0, limit: int = 0) -> str:
     """
-    List filenames in the data_storage directory.
+    List files in the data_storage directory.
+    With no arguments returns a compact summary (file count, total size, newest files).
+    Optional arguments:
+    - pattern: glob (e.g. "*.csv", "exp_2025*") or filename prefix
+    - sort_by: "name", "size" or "mtime"; descending: true for largest / newest first
+    - offset, limit: pagination (limit max 20)
     IMPORTANT RESTRICTION:
     - Use this tool ONLY when the user asks "what files are there?" or "show the file list".
     - If the user specifies a filename (e.g., "read test.csv", "get column from data.csv"), DO NOT USE THIS TOOL.
     - Instead, use the SQL tool directly to query the file.
     """
-    if not os.path.exists(STORAGE_DIR): return "📂 Directory empty."
-    files = os.listdir(STORAGE_DIR)
-    info = []
-    for f in files:
-        path = os.path.join(STORAGE_DIR, f)
-        size = os.path.getsize(path) / (1024*1024)
-        info.append(f"- {f} ({size:.4f} MB)")
-    return f"📂 **Files in {STORAGE_DIR}:**\n" + "\n".join(info)
+    index = storage.storage_index
+    catalog = storage.get_catalog()
+
+    if not (pattern or sort_by or offset or limit):
+        summary = index.summary(LIST_NEWEST)
+        if not summary["count"]:
+            return "📂 Directory empty."
+        lines = [f"📂 **{STORAGE_DIR}**: {summary['count']} files, "
+                 f"{summary['total_size'] / (1024 * 1024):.2f} MB total",
+                 "🆕 Newest:"]
+        lines += [_format_file_line(name, info, catalog) for name, info in summary["newest"]]
+        if summary["count"] > len(summary["newest"]):
+            lines.append("ℹ️ Use pattern / sort_by / offset / limit to browse the rest.")
+        return "\n".join(lines)
+
+    limit = min(limit or LIST_PAGE_SIZE, LIST_PAGE_SIZE)
+    total, rows = index.query(pattern, sort_by or "name", descending, offset, limit)
+    if not rows:
+        return f"📂 No files match '{pattern}'." if total == 0 else f"📂 Offset {offset} is past the end ({total} files)."
+
+    header = f"📂 **Files in {STORAGE_DIR}**" + (f" matching '{pattern}'" if pattern else "")
+    lines = [f"{header}: showing {offset + 1}-{offset + len(rows)} of {total}"]
+    lines += [_format_file_line(name, info, catalog) for name, info in rows]
+    if offset + len(rows) < total:
+        lines.append(f"➡️ Next page: offset={offset + len(rows)}")
+    return "\n".join(lines)
+
+# ============================================================
+# 🔁 MCP 專用背景 Event Loop
+# ============================================================
+class MCPEventLoop:
+    """
+    在獨立執行緒上常駐的 event loop。
+    所有 MCP stdio session 都建立並綁定在這個 loop 上，
+    任何 Gradio worker 執行緒都可以透過 submit / run / run_async 安全地把 coroutine 丟進來。
+    """
+
+    def __init__(self, name: str = "bitsai-mcp-loop"):
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(self._ready.set)
+        self._loop.run_forever()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Thread-safe 送出 coroutine，回傳 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro, timeout: float = None):
+        """阻塞等待結果 (不可在 loop 執行緒內呼叫，否則會 deadlock)"""
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("MCPEventLoop.run() called from the loop thread; use run_async instead.")
+        return self.submit(coro).result(timeout)
+
+    async def run_async(self, coro):
+        """從任何 event loop await 在 MCP loop 上執行的 coroutine"""
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def stop(self):
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+
+mcp_loop = MCPEventLoop()
+
+# ============================================================
+# 🏊 MCP Server Pool
+# ============================================================
+MCP_ENABLED = os.getenv("BITSAI_MCP", "1") != "0"            # 0 = 不啟動 MCP server (離線 benchmark)
+# DuckDB MCP server 啟動指令 (load test 可換成 benchmarks/stub_mcp_server.py)
+DUCKDB_MCP_COMMAND = os.getenv("BITSAI_DUCKDB_MCP_COMMAND", "uvx mcp-server-motherduck --db-path :memory:")
+MCP_POOL_SIZE = int(os.getenv("BITSAI_MCP_POOL_SIZE", "3"))   # 同時常駐的 MCP server 子行程數
+MCP_PING_INTERVAL = 30       # 健康檢查間隔 (秒)
+MCP_PING_TIMEOUT = 5
+MCP_START_TIMEOUT = 60
+MCP_CALL_TIMEOUT = 300       # 單次 call_tool 上限 (秒)
+
+
+class _MCPServerSlot:
+    """
+    單一 MCP server 子行程與其 ClientSession。
+    stdio_client / ClientSession 的 context 必須在同一個 task 進入與離開，
+    因此每個 slot 由一個專屬 task 持有自己的 AsyncExitStack，重啟時整組關掉再重開。
+    """
+
+    def __init__(self, index: int, server_params: StdioServerParameters):
+        self.index = index
+        self.server_params = server_params
+        self.session = None
+        self.healthy = False
+        self.in_flight = 0
+        self.restarts = 0
+        self.last_error = None
+        self._task = None
+        self._stop = None
+        self._ready = None
+        self._lock = asyncio.Lock()
+        self.on_start = None
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self.healthy
+
+    def mark_dead(self, err: Exception):
+        self.healthy = False
+        self.last_error = err
+
+    async def _serve(self):
+        try:
+            async with AsyncExitStack() as stack:
+                read_stream, write_stream = await stack.enter_async_context(stdio_client(self.server_params))
+                session = await stack.enter_async_context(ClientSession(read_stream, write_stream))
+                await session.initialize()
+                self.session = session
+                self.healthy = True
+                self._ready.set()
+                await self._stop.wait()
+        except Exception as e:
+            self.last_error = e
+        finally:
+            self.session = None
+            self.healthy = False
+            self._ready.set()
+
+    async def start(self):
+        self._stop = asyncio.Event()
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._serve(), name=f"mcp-slot-{self.index}")
+        await asyncio.wait_for(self._ready.wait(), timeout=MCP_START_TIMEOUT)
+        if not self.alive:
+            raise RuntimeError(f"MCP server #{self.index} failed to start: {self.last_error}")
+        if self.on_start:
+            await self.on_start(self)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=10)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self._task.cancel()
+        except Exception:
+            pass
+        self._task = None
+
+    async def restart(self):
+        async with self._lock:
+            # 可能已被健康檢查或其他呼叫者重啟過
+            if await self.ping():
+                return
+            print(f"♻️ Restarting MCP server #{self.index} (last error: {self.last_error!r})")
+            await self.stop()
+            self.restarts += 1
+            await self.start()
+
+    async def ping(self) -> bool:
+        if not self.alive:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=MCP_PING_TIMEOUT)
+            return True
+        except Exception as e:
+            self.last_error = e
+            return False
+
+
+class MCPServerPool:
+    """
+    N 個相同設定的 MCP server 子行程。
+    - call_tool 分派到目前 in-flight 最少的存活 server (least-busy)
+    - 背景定期 ping，掛掉的 server 自動重啟
+    - aclose() 由 _mcp_exit_stack 在結束時呼叫
+    """
+
+    def __init__(self, server_params: StdioServerParameters, size: int = MCP_POOL_SIZE, init_sql=None):
+        self.server_params = server_params
+        self.slots = [_MCPServerSlot(i, server_params) for i in range(max(1, size))]
+        self._health_task = None
+        # init_sql: () -> list[(tool_name, sql)]，每台 server 啟動/重啟後執行 (例如註冊 view)
+        self.init_sql = init_sql
+        for slot in self.slots:
+            slot.on_start = self._run_init_sql
+
+    async def start(self):
+        results = await asyncio.gather(*(slot.start() for slot in self.slots), return_exceptions=True)
+        for slot, res in zip(self.slots, results):
+            if isinstance(res, BaseException):
+                print(f"⚠️ MCP server #{slot.index} not started: {res}")
+        if not any(slot.alive for slot in self.slots):
+            raise RuntimeError(f"No MCP server could be started ({self.server_params.command}).")
+        self._health_task = asyncio.create_task(self._health_loop(), name="mcp-pool-health")
+
+    async def _run_init_sql(self, slot):
+        if not self.init_sql:
+            return
+        for tool_name, sql in self.init_sql():
+            try:
+                await slot.session.call_tool(tool_name, arguments={"query": sql})
+            except Exception as e:
+                print(f"⚠️ MCP server #{slot.index} init SQL failed: {e}")
+
+    async def broadcast_sql(self, tool_name: str, sql: str):
+        """在每台存活的 server 上執行同一段 SQL (例如新檔案的 view)"""
+        alive = [s for s in self.slots if s.alive]
+        await asyncio.gather(
+            *(s.session.call_tool(tool_name, arguments={"query": sql}) for s in alive),
+            return_exceptions=True,
+        )
+
+    def _pick(self):
+        alive = [s for s in self.slots if s.alive]
+        return min(alive, key=lambda s: s.in_flight) if alive else None
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(MCP_PING_INTERVAL)
+            for slot in self.slots:
+                if not await slot.ping():
+                    try:
+                        await slot.restart()
+                    except Exception as e:
+                        print(f"❌ MCP server #{slot.index} restart failed: {e}")
+
+    def _schedule_restart(self, slot):
+        async def _restart():
+            try:
+                await slot.restart()
+            except Exception as e:
+                print(f"❌ MCP server #{slot.index} restart failed: {e}")
+        asyncio.create_task(_restart())
+
+    async def list_tools(self):
+        slot = self._pick()
+        if slot is None:
+            raise RuntimeError("No live MCP server in pool.")
+        return await slot.session.list_tools()
+
+    async def call_tool(self, name: str, arguments: dict):
+        """送到最閒的 server；若該 server 連線已斷，重啟它並改送另一台重試一次"""
+        last_err = None
+        for _ in range(2):
+            slot = self._pick()
+            if slot is None:
+                # 全部掛掉時，直接在當下重啟第一台
+                slot = self.slots[0]
+                await slot.restart()
+            slot.in_flight += 1
+            try:
+                return await asyncio.wait_for(
+                    slot.session.call_tool(name, arguments=arguments), timeout=MCP_CALL_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                raise
+            except Exception as e:
+                # server 還能回 ping 代表只是這個請求有問題，直接往上丟
+                if await slot.ping():
+                    raise
+                last_err = e
+                slot.mark_dead(e)
+                self._schedule_restart(slot)
+            finally:
+                slot.in_flight -= 1
+        raise RuntimeError(f"MCP call failed after retry: {last_err!r}")
+
+    def status(self) -> list[dict]:
+        return [
+            {"index": s.index, "alive": s.alive, "in_flight": s.in_flight,
+             "restarts": s.restarts, "last_error": repr(s.last_error) if s.last_error else None}
+            for s in self.slots
+        ]
+
+    async def aclose(self):
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        await asyncio.gather(*(slot.stop() for slot in self.slots), return_exceptions=True)
+
+
+# ============================================================
+# 📦 SQL 結果整形 (上限 / 分頁 / 落地)
+# ============================================================
+SQL_RESULT_MAX_ROWS = 50          # 每頁最多筆數
+SQL_RESULT_MAX_BYTES = 6000       # 每頁最多字元數 (送進模型的部分)
+SQL_CELL_MAX_CHARS = 60           # 單一欄位值最長字元數
+SQL_MAX_CURSORS = 256
+RESULT_SPILL_DIR = os.path.join(tempfile.gettempdir(), "bitsai_results").replace("\\", "/")
+RESULT_SPILL_MAX_AGE = 24 * 3600
+RESULT_SPILL_SWEEP_INTERVAL = 600   # 寫入新落地檔時，最多每隔幾秒掃一次過期檔案
+os.makedirs(RESULT_SPILL_DIR, exist_ok=True)
+
+# 可以包進 COPY (...) / 子查詢的單一查詢敘述
+_SELECT_LIKE_RE = re.compile(r"^\s*(select|with|from|values|table)\b", re.IGNORECASE)
+
+SPILL_MARKER = "📎 Full result: "
+_SPILL_RE = re.compile(re.escape(SPILL_MARKER) + r"(\S+)")
+
+_result_cursors: "OrderedDict[str, dict]" = OrderedDict()
+_cursor_lock = threading.Lock()
+_last_sweep = 0.0
+
+def _remove_spill(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _cleanup_spills():
+    """刪除超過 RESULT_SPILL_MAX_AGE 的落地檔 (包含其他行程留下的) 與對應的 cursor"""
+    global _last_sweep
+    now = _last_sweep = time.time()
+    with _cursor_lock:
+        for cursor_id in [c for c, info in _result_cursors.items() if now - info["created"] > RESULT_SPILL_MAX_AGE]:
+            del _result_cursors[cursor_id]
+    for entry in os.scandir(RESULT_SPILL_DIR):
+        try:
+            if now - entry.stat().st_mtime > RESULT_SPILL_MAX_AGE:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+def _maybe_sweep_spills():
+    if time.time() - _last_sweep > RESULT_SPILL_SWEEP_INTERVAL:
+        _cleanup_spills()
+
+_cleanup_spills()
+
+def is_select_like(sql: str) -> bool:
+    body = sql.strip().rstrip(";")
+    return bool(_SELECT_LIKE_RE.match(body)) and ";" not in body
+
+def _cell(value) -> str:
+    text = "NULL" if value is None else str(value).replace("\n", " ").replace("|", "/")
+    return text if len(text) <= SQL_CELL_MAX_CHARS else text[:SQL_CELL_MAX_CHARS] + "…"
+
+def _register_cursor(cursor_id: str, info: dict):
+    """超過 SQL_MAX_CURSORS 時淘汰最久沒用的 cursor，連同它的落地檔一起刪除"""
+    info.setdefault("created", time.time())
+    evicted = []
+    with _cursor_lock:
+        _result_cursors[cursor_id] = info
+        while len(_result_cursors) > SQL_MAX_CURSORS:
+            evicted.append(_result_cursors.popitem(last=False)[1]["path"])
+    for path in evicted:
+        _remove_spill(path)
+    _maybe_sweep_spills()
+
+def _get_cursor(cursor_id: str):
+    with _cursor_lock:
+        info = _result_cursors.get(cursor_id)
+        if info and time.time() - info["created"] > RESULT_SPILL_MAX_AGE:
+            del _result_cursors[cursor_id]
+            _remove_spill(info["path"])
+            return None
+        if info:
+            _result_cursors.move_to_end(cursor_id)
+        return info
+
+_CURSOR_ID_RE = re.compile(r"^[0-9a-f]{10}$")
+
+def _cursor_path(cursor_id: str):
+    """
+    cursor 的落地檔路徑。cursor 只記在建立它的行程裡，多個 API worker 時下一輪可能落在別的 worker，
+    記憶體裡找不到就直接找共用暫存資料夾的落地檔 (未過期才算數)；都沒有回傳 None
+    """
+    info = _get_cursor(cursor_id)
+    if info:
+        return info["path"] if os.path.exists(info["path"]) else None
+    if not _CURSOR_ID_RE.match(cursor_id or ""):
+        return None
+    path = spill_path_for(cursor_id)
+    try:
+        fresh = time.time() - os.path.getmtime(path) <= RESULT_SPILL_MAX_AGE
+    except OSError:
+        return None
+    return path if fresh else None
+
+def _read_spill_page(path: str, offset: int, limit: int):
+    """從落地 CSV 讀一頁 (全部以字串讀取，保留原始顯示值)"""
+    with duckdb.connect(":memory:") as con:
+        rel = f"read_csv('{path}', header=true, all_varchar=true)"
+        total = con.execute(f"SELECT COUNT(*) FROM {rel}").fetchone()[0]
+        cur = con.execute(f"SELECT * FROM {rel} LIMIT {int(limit)} OFFSET {int(offset)}")
+        columns = [d[0] for d in cur.description]
+        rows = cur.fetchall()
+    return columns, rows, total
+
+def format_result_page(cursor_id: str, columns, rows, total: int, offset: int) -> str:
+    """精簡表格：第一行欄名，之後每行一筆 (以 | 分隔)，受 SQL_RESULT_MAX_BYTES 限制"""
+    lines = [" | ".join(_cell(c) for c in columns)]
+    used = len(lines[0])
+    shown = 0
+    for row in rows:
+        line = " | ".join(_cell(v) for v in row)
+        if shown and used + len(line) + 1 > SQL_RESULT_MAX_BYTES:
+            break
+        lines.append(line)
+        used += len(line) + 1
+        shown += 1
+
+    first, last = (offset + 1, offset + shown) if shown else (0, 0)
+    summary = f"📊 {total} rows × {len(columns)} columns — showing rows {first}-{last}."
+    if offset + shown < total:
+        summary += (f" More rows available: call fetch_result_page(cursor='{cursor_id}', "
+                    f"offset={offset + shown}).")
+    path = _cursor_path(cursor_id)
+    if path and shown < total:
+        summary += f"\n{SPILL_MARKER}{path}"
+    return summary + "\n" + "\n".join(lines)
+
+_PAGE_SUMMARY_RE = re.compile(r"^📊 (\d+) rows × (\d+) columns")
+
+def parse_result_page(text: str):
+    """format_result_page 的反向：回傳 (columns, rows, total)；不是分頁結果 (例如錯誤) 則回傳 None"""
+    lines = text.splitlines()
+    m = _PAGE_SUMMARY_RE.match(lines[0]) if lines else None
+    if not m:
+        return None
+    body = [line for line in lines[1:] if not line.startswith(SPILL_MARKER)]
+    if not body:
+        return None
+    columns = body[0].split(" | ")
+    rows = [line.split(" | ") for line in body[1:]]
+    return columns, rows, int(m.group(1))
+
+def find_spill_paths(text: str) -> list[str]:
+    """從工具輸出中找出落地檔路徑"""
+    return _SPILL_RE.findall(text)
+
+def spill_path_for(cursor_id: str) -> str:
+    return f"{RESULT_SPILL_DIR}/{cursor_id}.csv"
+
+async def run_shaped_query(pool, tool_name: str, sql: str, cache_key=None) -> str:
+    """
+    SELECT 類查詢：在 MCP server 端 COPY 完整結果到暫存 CSV，
+    只把第一頁 (筆數 / 字元數上限) 與總筆數回給模型，其餘透過 cursor 分頁。
+    cache_key 命中時完全不經過 MCP。
+    """
+    cached = sql_cache.get(cache_key)
+    if cached is not None:
+        print("⚡ [SQL Cache] hit")
+        return cached
+
+    body = storage.rewrite_to_columnar(sql.strip().rstrip(";"))
+    cursor_id = uuid.uuid4().hex[:10]
+    path = spill_path_for(cursor_id)
+    copy_sql = f"COPY ({body}) TO '{path}' (HEADER, DELIMITER ',')"
+
+    result = await pool.call_tool(tool_name, arguments={"query": copy_sql})
+    if getattr(result, "isError", False) or not os.path.exists(path):
+        text = "\n".join(c.text for c in (result.content or []) if c.type == "text")
+        # 錯誤訊息裡的 COPY 包裝對模型沒有意義，換回原始 SQL
+        raise classify_duckdb_error(text.replace(copy_sql, body)) or ToolCallError(
+            ToolErrorKind.EXECUTION, text or "Query produced no result file.")
+
+    columns, rows, total = await asyncio.to_thread(_read_spill_page, path, 0, SQL_RESULT_MAX_ROWS)
+    _register_cursor(cursor_id, {"path": path, "sql": body, "total": total, "columns": columns})
+    output = format_result_page(cursor_id, columns, rows, total, 0)
+    sql_cache.put(cache_key, output, cursor_id)
+    return output
+
+def shape_text_result(text: str) -> str:
+    """非 SELECT 的輸出 (DESCRIBE / SHOW ...) 只做字元上限，完整內容落地"""
+    if len(text) <= SQL_RESULT_MAX_BYTES:
+        return text
+    _maybe_sweep_spills()
+    cursor_id = uuid.uuid4().hex[:10]
+    path = f"{RESULT_SPILL_DIR}/{cursor_id}.txt"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return (text[:SQL_RESULT_MAX_BYTES] +
+            f"\n... [truncated {len(text) - SQL_RESULT_MAX_BYTES} chars]\n{SPILL_MARKER}{path}")
+
+# ============================================================
+# ⚡ SQL 結果快取 (正規化 SQL + 來源檔 mtime/size)
+# ============================================================
+SQL_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+_QUOTED_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+_IDENT_RE = re.compile(r"[A-Za-z_][0-9A-Za-z_]*")
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+
+def strip_string_literals(sql: str) -> str:
+    """拿掉單引號字串 (WHERE name = 'CSV_1' 不算引用 view)；雙引號識別字 ("CSV_1") 保留"""
+    return _STRING_LITERAL_RE.sub(" ", sql)
+
+def normalize_sql(sql: str) -> str:
+    """引號外的內容轉小寫並壓縮空白，去掉結尾分號；引號內保持原樣"""
+    parts, last = [], 0
+    body = sql.strip().rstrip(";").strip()
+    for m in _QUOTED_RE.finditer(body):
+        parts.append(" ".join(body[last:m.start()].lower().split()))
+        parts.append(m.group(0))
+        last = m.end()
+    parts.append(" ".join(body[last:].lower().split()))
+    return " ".join(p for p in parts if p)
+
+def referenced_storage_files(sql: str) -> set:
+    """找出 SQL 直接引用 (路徑) 或透過 view 名稱引用的 data_storage 檔案"""
+    files = set()
+    for m in _QUOTED_RE.finditer(sql):
+        literal = m.group(0)[1:-1].replace("\\", "/")
+        if os.path.dirname(literal) == STORAGE_DIR:
+            files.add(os.path.basename(literal))
+    views = {e["view"].lower(): name for name, e in storage.get_catalog().items()}
+    if views:
+        for token in _IDENT_RE.findall(strip_string_literals(sql)):
+            name = views.get(token.lower())
+            if name:
+                files.add(name)
+    return files
+
+def _fingerprint(files: set):
+    fp = []
+    for name in sorted(files):
+        try:
+            st = os.stat(f"{STORAGE_DIR}/{name}")
+        except OSError:
+            return None
+        fp.append((name, st.st_mtime_ns, st.st_size))
+    return tuple(fp)
+
+
+class SQLResultCache:
+    """以 bytes 計算容量的 LRU；key = (正規化 SQL, 來源檔指紋)"""
+
+    def __init__(self, max_bytes: int = SQL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, sql: str):
+        files = referenced_storage_files(sql)
+        if not files:
+            return None   # 沒有引用 data_storage 的查詢 (例如 now()) 不快取
+        fp = _fingerprint(files)
+        return (normalize_sql(sql), fp) if fp else None
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry["cursor"] and not _get_cursor(entry["cursor"])):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, key, value: str, cursor_id: str = None):
+        if key is None:
+            return
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._bytes -= old["size"]
+            self._entries[key] = {"value": value, "size": size, "cursor": cursor_id,
+                                  "files": {name for name, *_ in key[1]}}
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted["size"]
+
+    def invalidate_file(self, filename: str):
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if filename in e["files"]]:
+                self._bytes -= self._entries.pop(key)["size"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+sql_cache = SQLResultCache()
+storage.on_file_changed(sql_cache.invalidate_file)
+
+# ============================================================
+# 🧪 SQL 預先驗證 (本地 DuckDB EXPLAIN)
+# ============================================================
+class ToolErrorKind(str, Enum):
+    BAD_ARGUMENTS = "bad_arguments"
+    MISSING_FILE = "missing_file"
+    UNKNOWN_TABLE = "unknown_table"
+    UNKNOWN_COLUMN = "unknown_column"
+    SYNTAX = "syntax"
+    TIMEOUT = "timeout"
+    EXECUTION = "execution"
+
+# 這些錯誤讓 LLM 修正後重試是有意義的；其他 (逾時、執行期錯誤) 重試只是浪費
+RETRYABLE_ERROR_KINDS = {
+    ToolErrorKind.BAD_ARGUMENTS, ToolErrorKind.MISSING_FILE, ToolErrorKind.UNKNOWN_TABLE,
+    ToolErrorKind.UNKNOWN_COLUMN, ToolErrorKind.SYNTAX,
+}
+
+
+class ToolCallError(Exception):
+    """工具呼叫失敗；kind 讓 generate_response 決定是否重試，str() 是給模型看的訊息"""
+
+    def __init__(self, kind: ToolErrorKind, message: str, hint: str = ""):
+        super().__init__(message)
+        self.kind = kind
+        self.message = message
+        self.hint = hint
+
+    def __str__(self):
+        text = f"❌ SQL {self.kind.value} error: {self.message}"
+        if self.hint:
+            text += f"\n\n⚠️ SYSTEM HINT: {self.hint}"
+        return text
+
+
+DATA_FILE_EXTS = (".csv", ".tsv", ".parquet", ".json")
+_DUCKDB_ERROR_RE = re.compile(r"^\s*(?:Error:\s*)?(?P<type>[A-Za-z ]+?)?\s*Error:\s*(?P<msg>.*)", re.DOTALL)
+_ARGUMENT_HINT = (
+    "You MUST use the 'query' argument with a valid SQL string.\n"
+    "Do NOT pass 'file' or 'head' directly.\n"
+    f"Correct Example: {{'query': \"SELECT * FROM read_csv('{STORAGE_DIR}/filename.csv') LIMIT 5\"}}"
+)
+
+def _storage_files() -> dict:
+    """{小寫檔名: 實際檔名}"""
+    return {name.lower(): name for name in storage.storage_index.names()}
+
+def _missing_file_hint() -> str:
+    names = sorted(_storage_files().values())
+    listing = ", ".join(names[:20]) + (" ..." if len(names) > 20 else "")
+    return (f"Available files: {listing or '(none)'}. "
+            f"Use the full path, e.g. read_csv('{STORAGE_DIR}/<file>').")
+
+def classify_duckdb_error(text: str):
+    """把 DuckDB 錯誤訊息轉成 ToolCallError；不是錯誤訊息就回傳 None (只看開頭，避免資料內容誤判)"""
+    m = _DUCKDB_ERROR_RE.match(text)
+    if not m:
+        return None
+    err_type = (m.group("type") or "").strip().lower()
+    msg = " ".join(m.group("msg").split())[:400] or text.strip()
+
+    if err_type == "parser":
+        return ToolCallError(ToolErrorKind.SYNTAX, msg, "Fix the SQL syntax (DuckDB dialect).")
+    if err_type == "binder" and "column" in msg.lower():
+        return ToolCallError(ToolErrorKind.UNKNOWN_COLUMN, msg,
+                             "Use only the column names listed in KNOWN DATASETS / the candidate bindings.")
+    if err_type == "catalog":
+        views = ", ".join(f'"{e["view"]}"' for e in storage.get_catalog().values())
+        return ToolCallError(ToolErrorKind.UNKNOWN_TABLE, msg,
+                             f"Query files with read_csv('{STORAGE_DIR}/<file>') or a registered view: {views or '(none)'}.")
+    if err_type == "io" or "no files found" in msg.lower() or "no such file" in msg.lower():
+        return ToolCallError(ToolErrorKind.MISSING_FILE, msg, _missing_file_hint())
+    return ToolCallError(ToolErrorKind.EXECUTION, msg)
+
+# 只有出現在「讀檔位置」的字串才當作檔案路徑：
+# read_csv('x.csv') / read_parquet(['a.parquet', 'b.parquet']) 的參數，或 FROM / JOIN 'x.csv'
+_FILE_POSITION_RE = re.compile(
+    r"(?:\b(?:from|join)\s*|\bread_\w+\s*\(\s*(?:\[\s*(?:'(?:[^']|'')*'\s*,\s*)*)?)\Z",
+    re.IGNORECASE,
+)
+_VIEW_TOKEN_RE = re.compile(r"[0-9A-Za-z_]+")
+
+def _rewrite_file_literals(sql: str) -> str:
+    """
+    讀檔位置的 'CSV_1.csv' / 'data_storage/CSV_1.csv' 這類相對路徑改成 STORAGE_DIR 絕對路徑；
+    找不到檔案直接報錯。WHERE name = 'report.csv' 之類的一般字串與 data_storage 以外的絕對路徑不動
+    """
+    files = _storage_files()
+
+    def _swap(match):
+        literal = match.group(0)
+        if not literal.startswith("'"):
+            return literal
+        value = literal[1:-1].replace("\\", "/")
+        if not value.lower().endswith(DATA_FILE_EXTS) or "*" in value or "://" in value:
+            return literal
+        if not _FILE_POSITION_RE.search(sql[max(0, match.start() - 2000):match.start()]):
+            return literal
+        in_storage = os.path.dirname(value) == STORAGE_DIR
+        if not in_storage and (os.path.isabs(value) or re.match(r"^[A-Za-z]:/", value)):
+            return literal
+        if in_storage and os.path.basename(value) in files.values():
+            return literal
+        actual = files.get(os.path.basename(value).lower())
+        if actual is None:
+            raise ToolCallError(ToolErrorKind.MISSING_FILE, f"File '{value}' does not exist in data storage.",
+                                _missing_file_hint())
+        return f"'{STORAGE_DIR}/{actual}'"
+
+    return _QUOTED_RE.sub(_swap, sql)
+
+def referenced_view_files(sql: str) -> list[str]:
+    """SQL 中以 view 名稱引用的 data_storage 檔案 (只比對名稱，不讀檔)"""
+    tokens = {t.lower() for t in _VIEW_TOKEN_RE.findall(strip_string_literals(sql))}
+    return [name for name in storage.storage_index.names() if storage.view_name_for(name).lower() in tokens]
+
+def validate_sql(args: dict) -> str:
+    """
+    在送到 MCP 之前先在本地檢查：
+    1. 參數格式 (必須有字串 query)
+    2. 讀檔位置的檔名改寫成 STORAGE_DIR 絕對路徑、檔案必須存在
+    3. SELECT 類查詢用內嵌 DuckDB EXPLAIN (對 Parquet 只讀 metadata，不執行查詢)，
+       只註冊這個查詢用到的 view
+    回傳改寫後的 SQL；失敗丟出 ToolCallError。
+    """
+    sql = args.get("query") if isinstance(args, dict) else None
+    if not isinstance(sql, str) or not sql.strip():
+        raise ToolCallError(ToolErrorKind.BAD_ARGUMENTS,
+                            f"Expected a 'query' string argument, got {sorted(args) if isinstance(args, dict) else args!r}.",
+                            _ARGUMENT_HINT)
+
+    sql = _rewrite_file_literals(sql.strip())
+    if not is_select_like(sql):
+        return sql
+
+    with duckdb.connect(":memory:") as con:
+        for view in storage.view_registration_sql(referenced_view_files(sql)):
+            con.execute(view)
+        try:
+            con.execute("EXPLAIN " + storage.rewrite_to_columnar(sql.rstrip(";")))
+        except duckdb.Error as e:
+            err = classify_duckdb_error(str(e))
+            if err is None or err.kind == ToolErrorKind.EXECUTION:
+                # 本地無法判斷的錯誤交給 server 端實際執行
+                return sql
+            raise err
+    return sql
+
+@tool("fetch_result_page")
+def fetch_result_page(cursor: str, offset: int = 0, limit: int = SQL_RESULT_MAX_ROWS) -> str:
+    """
+    Fetch more rows of a previous SQL result.
+    Use the cursor id and offset given in the '📊 ... More rows available' line of the SQL tool output.
+    Do NOT re-run the SQL query just to see more rows.
+    """
+    path = _cursor_path(cursor)
+    if path is None:
+        raise ToolCallError(ToolErrorKind.BAD_ARGUMENTS, f"Unknown or expired cursor '{cursor}'.",
+                            "Re-run the SQL query to get a new cursor.")
+    limit = max(1, min(int(limit), SQL_RESULT_MAX_ROWS))
+    columns, rows, total = _read_spill_page(path, max(0, int(offset)), limit)
+    return format_result_page(cursor, columns, rows, total, max(0, int(offset)))
 
 # ============================================================
 # 🌉 Tool Loader
 # ============================================================
 _mcp_exit_stack = AsyncExitStack()
+mcp_pools: list[MCPServerPool] = []
+DUCKDB_QUERY_TOOL = "query"   # mcp-server-motherduck 的 SQL 工具名稱
 
-async def connect_to_mcp_server(command: str, args: list[str], env: dict = None):
-    """連線到指定的 MCP Server 並回傳 tools"""
+def shutdown_mcp():
+    """關閉所有 MCP session 與子行程，並停止背景 loop"""
+    try:
+        mcp_loop.run(_mcp_exit_stack.aclose(), timeout=10)
+    except Exception as e:
+        print(f"⚠️ MCP shutdown error: {e}")
+    mcp_loop.stop()
+
+atexit.register(shutdown_mcp)
+
+async def connect_to_mcp_server(command: str, args: list[str], env: dict = None,
+                                pool_size: int = MCP_POOL_SIZE, init_sql=None):
+    """啟動一組 MCP Server (pool) 並回傳 tools"""
     server_params = StdioServerParameters(
         command=command,
         args=args,
@@ -171,11 +927,13 @@ async def connect_to_mcp_server(command: str, args: list[str], env: dict = None)
     )
     
     try:
-        read_stream, write_stream = await _mcp_exit_stack.enter_async_context(stdio_client(server_params))
-        session = await _mcp_exit_stack.enter_async_context(ClientSession(read_stream, write_stream))
-        await session.initialize()
+        pool = MCPServerPool(server_params, size=pool_size, init_sql=init_sql)
+        await pool.start()
+        _mcp_exit_stack.push_async_callback(pool.aclose)
+        mcp_pools.append(pool)
+        print(f"🏊 MCP pool ready: {sum(s.alive for s in pool.slots)}/{len(pool.slots)} servers ({command})")
         
-        mcp_list_tools = await session.list_tools()
+        mcp_list_tools = await pool.list_tools()
         langchain_tools = []
 
         for mcp_tool in mcp_list_tools.tools:
@@ -183,22 +941,35 @@ async def connect_to_mcp_server(command: str, args: list[str], env: dict = None)
             # 我們修改工具描述，強制 LLM 知道檔案都在 data_storage 資料夾下
             # 並要求它在 SQL 查詢時使用絕對路徑或正確的相對路徑
             enhanced_description = mcp_tool.description
-            if "sql" in mcp_tool.name.lower() or "query" in mcp_tool.name.lower():
+            is_sql_tool = "sql" in mcp_tool.name.lower() or "query" in mcp_tool.name.lower()
+            if is_sql_tool:
                 enhanced_description += (
                     f"\n\n IMPORTANT PATH INSTRUCTION \n"
                     f"All CSV/Parquet files are located in: '{STORAGE_DIR}'\n"
                     f"When writing SQL, you MUST prepend the path to the filename.\n"
-                    f"Example: SELECT * FROM read_csv('{STORAGE_DIR}/your_file.csv');"
+                    f"Example: SELECT * FROM read_csv('{STORAGE_DIR}/your_file.csv');\n"
+                    f"Converted files are also registered as views named after the file "
+                    f"(e.g. CSV_1.csv -> SELECT * FROM \"CSV_1\")."
                 )
 
             # 使用閉包捕獲當前 tool 的資訊
-            def make_wrapper(tool_name, tool_session):
+            def make_wrapper(tool_name, tool_pool, is_sql_tool):
                 async def _tool_wrapper(**kwargs):
                     try:
                         if "kwargs" in kwargs and isinstance(kwargs["kwargs"], dict):
                             actual_args = kwargs["kwargs"]
                         else:
                             actual_args = kwargs
+
+                        cache_key = None
+                        if is_sql_tool:
+                            # 本地驗證 + 檔名改寫；有問題直接丟 ToolCallError，不浪費 MCP round trip
+                            sql = await asyncio.to_thread(validate_sql, actual_args)
+                            # 快取 key 以驗證後的 SQL 計算 (改寫成 Parquet 前)
+                            if is_select_like(sql):
+                                cache_key = sql_cache.make_key(sql)
+                            # 已轉成 Parquet 的 CSV 改讀 columnar 檔
+                            actual_args = {**actual_args, "query": storage.rewrite_to_columnar(sql)}
                         
                         # === [DEBUG] 1. 印出送出的指令 ===
                         print(f"\n📝 [MCP DEBUG] Sending to {tool_name}:")
@@ -208,9 +979,19 @@ async def connect_to_mcp_server(command: str, args: list[str], env: dict = None)
                             print(f"   👉 Args: {json.dumps(actual_args, ensure_ascii=False)}")
                         print("-" * 50)
                         
-                        # 執行工具
-                        result = await tool_session.call_tool(tool_name, arguments=actual_args)
-                        
+                        # 執行工具：SELECT 類查詢在 server 端落地完整結果，只回傳第一頁
+                        query = actual_args.get("query")
+                        if isinstance(query, str) and is_select_like(query):
+                            result = await run_shaped_query(tool_pool, tool_name, query, cache_key)
+                        else:
+                            result = await tool_pool.call_tool(tool_name, arguments=actual_args)
+
+                        if isinstance(result, str):
+                            print(f"📥 [MCP DEBUG] Received from {tool_name} (paged):")
+                            print(f"   📄 Data:\n{result[:500]}")
+                            print("=" * 50 + "\n")
+                            return result
+
                         # === [DEBUG] 2. 印出收到的結果 (💡 新增這裡) ===
                         print(f"📥 [MCP DEBUG] Received from {tool_name}:")
                         if result.content:
@@ -227,40 +1008,47 @@ async def connect_to_mcp_server(command: str, args: list[str], env: dict = None)
                             print("   ⚠️ No content returned (Empty).")
                         print("=" * 50 + "\n")
                         # ==============================================
-                        
+
                         output_text = []
                         if result.content:
                             for content in result.content:
                                 if content.type == "text":
                                     output_text.append(content.text)
-                        
-                        # === 💡 FIX 2: 錯誤攔截與提示 (針對問題2的輔助) ===
-                        final_output = "\n".join(output_text) if output_text else "No output."
-                        
-                        # 如果 DuckDB 回傳找不到檔案的錯誤，我們在工具輸出中偷偷加一句提示
-                        # 這會刺激 LLM 自動修正，而不是只有報錯
-                        if "No such file or directory" in final_output:
-                            final_output += f"\n\n⚠️ SYSTEM HINT: The file was not found. Did you forget to add the path '{STORAGE_DIR}/'?"
-
-                        if "validation error" in final_output.lower() or "required property" in final_output.lower():
-                            final_output += (
-                                f"\n\n⚠️ SYSTEM HINT: Argument Error. "
-                                f"You MUST use the 'query' argument with a valid SQL string.\n"
-                                f"Do NOT pass 'file' or 'head' directly.\n"
-                                f"Correct Example: {{'query': \"SELECT * FROM read_csv('{STORAGE_DIR}/filename.csv') LIMIT 5\"}}"
-                            )
-                            
-                        return final_output
+                        final_output = "\n".join(output_text)
+
+                        # === 💡 FIX 2: 錯誤以結構化的 ToolCallError 回報 (只看 isError 與訊息開頭) ===
+                        if result.isError or (is_sql_tool and classify_duckdb_error(final_output)):
+                            err = classify_duckdb_error(final_output)
+                            if err is None and ("validation error" in final_output.lower()
+                                                or "required property" in final_output.lower()):
+                                err = ToolCallError(ToolErrorKind.BAD_ARGUMENTS, final_output, _ARGUMENT_HINT)
+                            raise err or ToolCallError(ToolErrorKind.EXECUTION, final_output or "Tool reported an error.")
 
+                        # 送進模型的內容同樣受字元上限限制，完整輸出落地到暫存檔
+                        return shape_text_result(final_output) if final_output else "No output."
+
+                    except ToolCallError:
+                        raise
                     except Exception as tool_err:
-                        return f"❌ Tool execution failed: {tool_err}"
+                        raise ToolCallError(ToolErrorKind.EXECUTION, f"Tool execution failed: {tool_err}")
                 return _tool_wrapper
 
+            # session 綁在 mcp_loop 上，因此不論從哪個執行緒或 loop 呼叫都轉送過去執行
+            def make_dispatchers(wrapper):
+                def _sync(**kwargs):
+                    return mcp_loop.run(wrapper(**kwargs))
+
+                async def _async(**kwargs):
+                    return await mcp_loop.run_async(wrapper(**kwargs))
+                return _sync, _async
+
+            sync_fn, async_fn = make_dispatchers(make_wrapper(mcp_tool.name, pool, is_sql_tool))
             lc_tool = StructuredTool.from_function(
-                func=None,
-                coroutine=make_wrapper(mcp_tool.name, session),
+                func=sync_fn,
+                coroutine=async_fn,
                 name=mcp_tool.name,
                 description=enhanced_description, # 使用修改後的描述
+                args_schema=mcp_tool.inputSchema, # 保留 MCP 的參數 schema，invoke 時才不會丟掉參數
             )
             langchain_tools.append(lc_tool)
             print(f"🔗 Loaded MCP Tool: {mcp_tool.name} (with path injection)")
@@ -276,9 +1064,16 @@ async def connect_to_mcp_server(command: str, args: list[str], env: dict = None)
 async def get_all_tools_async():
     """非同步:載入本地工具與 DuckDB MCP 工具"""
     
-    # 1. 基本本地工具
-    tools = [system_info, get_time, gpu_info, disk_info, resource_monitor, list_storage_files]
+    # 1. 基本本地工具 (系統指標由背景 sampler 持續取樣，啟動時就開始累積歷史)
+    get_sampler()
+    tools = [system_info, get_time, gpu_info, disk_info, resource_monitor, metrics_history,
+             list_storage_files, fetch_result_page]
     
+    if not MCP_ENABLED:
+        print("⏭️ MCP disabled (BITSAI_MCP=0), using local tools only")
+        storage.scan_storage()
+        return tools
+
     # 2. MCP Server: DuckDB (MotherDuck 官方版本)
     print("⏳ Connecting to MCP: DuckDB (MotherDuck official server)...")
     print(f"📂 Working Directory: {STORAGE_DIR}")
@@ -293,14 +1088,27 @@ async def get_all_tools_async():
     # - 使用 DuckDB 的 read_csv() 函數直接讀取檔案
     # - 支援複雜的 SQL 分析 (JOIN, GROUP BY, 聚合函數等)
     # - 可查詢本地檔案或 S3 遠端資料
+    # 每台 :memory: server 啟動後都註冊一次 Parquet view；新檔轉換完成後再廣播
+    def duckdb_init_sql():
+        return [(DUCKDB_QUERY_TOOL, sql) for sql in storage.view_registration_sql()]
+
+    # 預設：MotherDuck 官方 DuckDB MCP Server，記憶體模式 (--db-path :memory:)，不建立實體檔案
+    command, *command_args = shlex.split(DUCKDB_MCP_COMMAND)
     mcp_tools = await connect_to_mcp_server(
-        command="uvx",
-        args=[
-            "mcp-server-motherduck",  # MotherDuck 官方 DuckDB MCP Server
-            "--db-path", ":memory:",  # 使用記憶體模式，不建立實體檔案
-        ],
-        env=mcp_env
+        command=command,
+        args=command_args,
+        env=mcp_env,
+        init_sql=duckdb_init_sql,
     )
+
+    if mcp_pools:
+        duckdb_pool = mcp_pools[-1]
+        storage.on_converted(
+            lambda filename, parquet_path: mcp_loop.submit(
+                duckdb_pool.broadcast_sql(DUCKDB_QUERY_TOOL, storage.view_sql(filename, parquet_path))
+            )
+        )
+    storage.scan_storage()
     
     tools.extend(mcp_tools)
     
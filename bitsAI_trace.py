@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ============================================================
+# ⚙️ Tracing 設定
+# ============================================================
+TRACE_DIR = os.getenv("BITSAI_TRACE_DIR", "traces")              # JSONL 輸出資料夾 (每天一個檔)
+METRICS_HOST = os.getenv("BITSAI_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("BITSAI_METRICS_PORT", "9464"))     # 0 = 不啟動 metrics endpoint
+HISTOGRAM_SIZE = 2000        # 每個 (kind, mode, stage) 保留最近幾筆耗時
+RECENT_TRACES = 50           # /traces 端點保留最近幾筆完整 trace
+
+_current_trace = contextvars.ContextVar("bitsai_trace", default=None)
+_current_span = contextvars.ContextVar("bitsai_span", default=None)
+
+# ============================================================
+# 🧵 Trace / Span
+# ============================================================
+class Span:
+    """單一階段；attrs 可在執行中補上 (例如 token 數、筆數)"""
+
+    __slots__ = ("name", "parent", "start", "duration", "attrs", "error")
+
+    def __init__(self, name: str, parent: str = None, **attrs):
+        self.name = name
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attrs = attrs
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class Trace:
+    """一次請求 (chat / ingest) 的所有 span"""
+
+    def __init__(self, kind: str, mode: str = "", **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.mode = mode
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.started_at = datetime.now().isoformat(timespec="milliseconds")
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """可跨執行緒使用 (工具呼叫在 MCP loop 上執行時直接拿 trace 物件)"""
+        parent = _current_span.get()
+        sp = Span(name, parent.name if parent else None, **attrs)
+        token = _current_span.set(sp)
+        try:
+            yield sp
+        except BaseException as e:
+            sp.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            sp.duration = time.perf_counter() - sp.start
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(sp)
+
+    def to_dict(self, duration: float, status: str) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return {
+            "trace_id": self.trace_id,
+            "kind": self.kind,
+            "mode": self.mode,
+            "started_at": self.started_at,
+            "duration_ms": round(duration * 1000, 2),
+            "status": status,
+            **self.attrs,
+            "spans": [
+                {
+                    "name": s.name,
+                    "parent": s.parent,
+                    "offset_ms": round((s.start - self.start) * 1000, 2),
+                    "duration_ms": round((s.duration or 0) * 1000, 2),
+                    **({"error": s.error} if s.error else {}),
+                    **s.attrs,
+                }
+                for s in spans
+            ],
+        }
+
+
+class _NullSpan:
+    """沒有進行中的 trace 時使用，呼叫端不必判斷"""
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+def current_trace():
+    return _current_trace.get()
+
+@contextmanager
+def span(name: str, trace: Trace = None, **attrs):
+    """在目前 (或指定) 的 trace 底下開一個 span；沒有 trace 時不做任何記錄"""
+    trace = trace or _current_trace.get()
+    if trace is None:
+        yield _NULL_SPAN
+        return
+    with trace.span(name, **attrs) as sp:
+        yield sp
+
+@contextmanager
+def start_trace(kind: str, mode: str = "", **attrs):
+    """請求的根節點：結束時寫入 JSONL 並更新統計"""
+    trace = Trace(kind, mode, **attrs)
+    token = _current_trace.set(trace)
+    status = "ok"
+    try:
+        yield trace
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _current_trace.reset(token)
+        record = trace.to_dict(time.perf_counter() - trace.start, status)
+        recorder.record(record)
+
+# ============================================================
+# 📈 JSONL 輸出 + 百分位數統計
+# ============================================================
+def _percentile(ordered, q: float) -> float:
+    if not ordered:
+        return 0.0
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class TraceRecorder:
+    def __init__(self, trace_dir: str = TRACE_DIR, histogram_size: int = HISTOGRAM_SIZE):
+        self.trace_dir = trace_dir
+        self._lock = threading.Lock()
+        self._durations = defaultdict(lambda: deque(maxlen=histogram_size))  # (kind, mode, stage) -> 秒
+        self._tokens = defaultdict(lambda: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        self._recent = deque(maxlen=RECENT_TRACES)
+
+    def _write(self, record: dict):
+        try:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            path = os.path.join(self.trace_dir, f"traces-{datetime.now():%Y%m%d}.jsonl")
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            print(f"⚠️ [Trace] write failed: {e}")
+
+    def record(self, record: dict):
+        kind, mode = record["kind"], record["mode"]
+        with self._lock:
+            self._durations[(kind, mode, "total")].append(record["duration_ms"])
+            for s in record["spans"]:
+                self._durations[(kind, mode, s["name"])].append(s["duration_ms"])
+                if "prompt_tokens" in s or "completion_tokens" in s:
+                    tok = self._tokens[s["name"]]
+                    tok["calls"] += 1
+                    tok["prompt_tokens"] += s.get("prompt_tokens") or 0
+                    tok["completion_tokens"] += s.get("completion_tokens") or 0
+            self._recent.append(record)
+            self._write(record)
+
+    def metrics(self) -> dict:
+        """{kind: {mode: {stage: {count, p50, p95, p99, max}}}} (毫秒) + token 累計"""
+        with self._lock:
+            items = [(k, sorted(v)) for k, v in self._durations.items()]
+            tokens = {k: dict(v) for k, v in self._tokens.items()}
+        stages = {}
+        for (kind, mode, stage), ordered in items:
+            stages.setdefault(kind, {}).setdefault(mode or "-", {})[stage] = {
+                "count": len(ordered),
+                "p50": _percentile(ordered, 0.50),
+                "p95": _percentile(ordered, 0.95),
+                "p99": _percentile(ordered, 0.99),
+                "max": ordered[-1] if ordered else 0.0,
+            }
+        return {"latency_ms": stages, "llm_tokens": tokens}
+
+    def recent(self, n: int = 10) -> list:
+        with self._lock:
+            return list(self._recent)[-n:]
+
+
+recorder = TraceRecorder()
+
+# ============================================================
+# 🌐 本地 Metrics Endpoint
+# ============================================================
+_providers = {}
+_routes = {}
+_server = None
+
+def register_metrics(name: str, provider):
+    """額外的 metrics 來源 (例如 LLM gateway 排隊狀態)，provider() 回傳 dict"""
+    _providers[name] = provider
+
+def register_route(path: str, handler):
+    """額外的 GET 端點 (例如 /profile 開關)，handler(query 參數 dict) 回傳可轉 JSON 的結果"""
+    _routes[path] = handler
+
+def collect_metrics() -> dict:
+    data = recorder.metrics()
+    for name, provider in list(_providers.items()):
+        try:
+            data[name] = provider()
+        except Exception as e:
+            data[name] = {"error": str(e)}
+    return data
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        params = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+        try:
+            if path in ("/", "/metrics"):
+                body = collect_metrics()
+            elif path == "/traces":
+                body = recorder.recent(int(params.get("n", 10)))
+            elif path in _routes:
+                body = _routes[path](params)
+            else:
+                self.send_error(404)
+                return
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        payload = json.dumps(body, ensure_ascii=False, indent=1, default=str).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """背景啟動 GET /metrics、/traces?n=10 與 register_route 註冊的端點；port=0 或已啟動時略過"""
+    global _server
+    if _server is not None or not port:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"⚠️ [Trace] metrics endpoint not started: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, name="bitsai-metrics-http", daemon=True).start()
+    print(f"📈 Metrics endpoint: http://{host}:{port}/metrics")
+    return _server
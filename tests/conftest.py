@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# bitsAI_storage / bitsAI_docstore 在 import 時就會在工作目錄建立 data_storage、doc_registry.sqlite 等，
+# 測試一律在暫存資料夾執行，不碰專案裡的資料
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BITSAI_METRICS_PORT", "0")
+os.chdir(tempfile.mkdtemp(prefix="bitsai-tests-"))
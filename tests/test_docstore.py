@@ -0,0 +1,54 @@
+import pytest
+
+from bitsAI_docstore import DocumentRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return DocumentRegistry(str(tmp_path / "registry.sqlite"))
+
+
+def test_register_is_idempotent_per_source_and_content(registry):
+    a = registry.register("a.md", "A", "paper", "", "h1")
+    assert registry.register("a.md", "A v2", "paper", "", "h1") == a
+    assert registry.register("a.md", "A", "paper", "", "h2") != a
+    assert registry.get_many([a])[a]["title"] == "A v2"
+    assert registry.count() == 2
+
+
+def test_update_changes_every_chunk_through_resolve(registry):
+    a = registry.register("a.md", "A", "paper", "", "h1")
+    b = registry.register("b.md", "B", "other", "", "h2")
+    payload = {"text": "shared", "doc_ids": [a, b]}
+    assert registry.resolve(payload)["title"] == "A"
+    assert registry.resolve(payload)["sources"] == ["a.md", "b.md"]
+
+    assert registry.update([a], title="New A", content_hash="ignored") == 1
+    assert registry.resolve(payload)["title"] == "New A"
+    assert registry.resolve({"doc_ids": [a], "title": "override"})["title"] == "override"
+    assert registry.resolve({"text": "legacy"}) == {"text": "legacy"}
+
+
+def test_update_to_an_existing_source_and_hash_is_a_clear_error(registry):
+    a = registry.register("a.md", "A", "paper", "", "same")
+    registry.register("b.md", "B", "paper", "", "same")
+    with pytest.raises(ValueError, match="b.md"):
+        registry.update([a], source="b.md")
+    assert registry.get_many([a])[a]["source"] == "a.md"
+
+
+def test_other_connections_see_updates(registry):
+    a = registry.register("a.md", "A", "paper", "", "h1")
+    registry.get_many([a])
+    DocumentRegistry(registry.path).update([a], title="From another worker")
+    assert registry.get_many([a])[a]["title"] == "From another worker"
+
+
+def test_ids_matching_delete_and_facet(registry):
+    a = registry.register("a.md", "A", "paper", "x", "h1", ingested_at="2025-01-01 10:00:00")
+    b = registry.register("b.md", "B", "other", "x", "h2", ingested_at="2025-03-01 10:00:00")
+    assert registry.ids_matching(doc_type="paper") == [a]
+    assert registry.ids_matching(subtype="x", ingested_from="2025-02-01") == [b]
+    assert registry.facet({a: 3, b: 2}, "type") == {"paper": 3, "other": 2}
+    assert registry.delete([a]) == 1
+    assert registry.get_many([a, b]).keys() == {b}
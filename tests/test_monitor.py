@@ -0,0 +1,52 @@
+import time
+
+from bitsAI_monitor import MetricsSampler, StubBackend
+
+
+def make_sampler(**kwargs):
+    gpus = [{"id": 0, "name": "Stub GPU", "load": 30.0, "temp": 60.0, "mem_used": 1024, "mem_total": 8192}]
+    processes = [
+        {"pid": 1, "name": "a.py", "cpu": 5.0, "mem": 1.0},
+        {"pid": 2, "name": "b.py", "cpu": 50.0, "mem": 3.0},
+    ]
+    backend = StubBackend(cpu=20.0, gpus=gpus, processes=processes, **kwargs)
+    return backend, MetricsSampler(backend=backend, interval=0.05, history_seconds=1)
+
+
+def test_sample_once_records_history_and_top_processes():
+    _, sampler = make_sampler()
+    sample = sampler.sample_once()
+    assert sample["cpu"] == 20.0
+    assert sampler.latest() is sample
+    assert [p["pid"] for p in sampler.top_processes()["top_cpu"]] == [2, 1]
+    assert sampler.top_processes()["top_gpu"] == []
+
+
+def test_history_is_a_fixed_size_ring_buffer():
+    _, sampler = make_sampler()
+    for _ in range(sampler.history.maxlen + 5):
+        sampler.sample_once()
+    assert len(sampler.history) == sampler.history.maxlen
+
+
+def test_summary_over_window():
+    backend, sampler = make_sampler()
+    sampler.sample_once()
+    backend.cpu = 60.0
+    sampler.sample_once()
+    summary = sampler.summary(60)
+    assert summary["samples"] == 2
+    assert summary["cpu"] == {"avg": 40.0, "max": 60.0, "min": 20.0}
+    assert summary["gpus"][0]["load"]["avg"] == 30.0
+
+
+def test_background_thread_samples_without_gpu():
+    backend = StubBackend()
+    sampler = MetricsSampler(backend=backend, interval=0.05, history_seconds=1).start()
+    try:
+        assert sampler.latest()["gpus"] == []
+        time.sleep(0.2)
+        assert len(sampler.window(5)) >= 2
+    finally:
+        sampler.stop()
+    assert not backend.has_gpu
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+import bitsAI_storage as storage
+import bitsAI_tools as tools
+
+
+@pytest.fixture
+def csv_file():
+    path = f"{storage.STORAGE_DIR}/cache_test.csv"
+    with open(path, "w") as f:
+        f.write("a,b\n1,2\n")
+    yield path
+    os.remove(path)
+
+
+def test_key_depends_on_file_and_normalized_sql(csv_file):
+    cache = tools.SQLResultCache()
+    key = cache.make_key(f"SELECT * FROM read_csv('{csv_file}')")
+    assert key == cache.make_key(f"select *   from read_csv('{csv_file}');")
+    assert cache.make_key("SELECT now()") is None
+
+
+def test_put_get_and_invalidate_file(csv_file):
+    cache = tools.SQLResultCache()
+    key = cache.make_key(f"SELECT * FROM read_csv('{csv_file}')")
+    cache.put(key, "result")
+    assert cache.get(key) == "result"
+    cache.invalidate_file("other.csv")
+    assert cache.get(key) == "result"
+    cache.invalidate_file("cache_test.csv")
+    assert cache.get(key) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_rewriting_the_file_changes_the_key(csv_file):
+    cache = tools.SQLResultCache()
+    sql = f"SELECT * FROM read_csv('{csv_file}')"
+    key = cache.make_key(sql)
+    with open(csv_file, "a") as f:
+        f.write("3,4\n")
+    assert cache.make_key(sql) != key
+
+
+def test_lru_evicts_by_bytes(csv_file):
+    cache = tools.SQLResultCache(max_bytes=10)
+    key = cache.make_key(f"SELECT * FROM read_csv('{csv_file}')")
+    other = cache.make_key(f"SELECT a FROM read_csv('{csv_file}')")
+    cache.put(key, "x" * 6)
+    cache.put(other, "y" * 6)
+    assert cache.get(key) is None
+    assert cache.get(other) == "y" * 6
+
+
+def test_view_names_inside_string_literals_are_not_references(monkeypatch):
+    monkeypatch.setattr(storage, "get_catalog", lambda: {"CSV_1.csv": {"view": "CSV_1"}, "B.csv": {"view": "B"}})
+    assert tools.referenced_storage_files("SELECT * FROM B WHERE name = 'CSV_1'") == {"B.csv"}
+    assert tools.referenced_storage_files('SELECT * FROM "CSV_1"') == {"CSV_1.csv"}